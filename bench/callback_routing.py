@@ -0,0 +1,120 @@
+"""Стоимость маршрутизации одного callback: цепочка lambda-фильтров против CallbackTable.
+
+Берёт реальные маршруты из bot.app (ключи callbacks в порядке объявления обработчиков) и строит
+два роутера с пустыми обработчиками: прежний — по одному обработчику с lambda-фильтром на маршрут,
+новый — один обработчик с фильтром CallbackTable. Для каждого маршрута замеряет только выбор
+обработчика (фильтры) и полный проход Dispatcher.feed_update; печатает среднее и худший маршрут.
+
+    python -m bench.callback_routing [--rounds 2000]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import CallbackQuery, Update, User
+
+from bot.app import callbacks
+from bot.callback_routing import CallbackTable
+
+PAYLOAD = "12345"
+
+
+def _routes():
+    """(callback_data, ключ, точный ли) в порядке строк app.py — так шли и lambda-фильтры."""
+    routes = [(key, route, True) for key, route in callbacks._exact.items()]
+    routes += [(key, route, False) for key, route in callbacks._prefix.items()]
+    routes.sort(key=lambda item: item[1].handler.__code__.co_firstlineno)
+    return [(key if exact else key + PAYLOAD, key, exact) for key, _, exact in routes]
+
+
+async def _noop(cb, **kwargs):
+    return None
+
+
+def _lambda_filters(routes):
+    filters = []
+    for _, key, exact in routes:
+        if exact:
+            filters.append(lambda c, key=key: c.data == key)
+        else:
+            filters.append(lambda c, key=key: c.data and c.data.startswith(key))
+    return filters
+
+
+def _table(routes):
+    table = CallbackTable()
+    for _, key, exact in routes:
+        (table.exact(key) if exact else table.prefix(key))(_noop)
+    return table
+
+
+def _callback(data):
+    return CallbackQuery(
+        id="1", from_user=User(id=1, is_bot=False, first_name="bench"), chat_instance="1", data=data
+    )
+
+
+def _per_call_us(func, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+async def _per_update_us(dispatcher, bot, update, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await dispatcher.feed_update(bot, update)
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def _first_match(filters, cb):
+    for check in filters:
+        if check(cb):
+            return check
+    return None
+
+
+def _report(title, before, after, routes):
+    worst = max(range(len(routes)), key=lambda i: before[i])
+    print(f"\n{title}, мкс на callback")
+    print(f"  lambda-фильтры: среднее {statistics.mean(before):.2f}, худший {before[worst]:.2f} ({routes[worst][0]})")
+    print(f"  CallbackTable:  среднее {statistics.mean(after):.2f}, худший {max(after):.2f}")
+
+
+async def main(args):
+    routes = _routes()
+    filters = _lambda_filters(routes)
+    table = _table(routes)
+    print(f"Маршрутов: {len(routes)} ({len(table._exact)} точных, {len(table._prefix)} по префиксу)")
+
+    before, after = [], []
+    for data, _, _ in routes:
+        cb = _callback(data)
+        before.append(_per_call_us(lambda: _first_match(filters, cb), args.rounds))
+        after.append(_per_call_us(lambda: table.resolve(cb.data), args.rounds))
+    _report("Выбор обработчика", before, after, routes)
+
+    old_router, new_router = Router(), Router()
+    for check in filters:
+        old_router.callback_query.register(_noop, check)
+    new_router.callback_query.register(table.dispatch, table.filter())
+    old_dispatcher, new_dispatcher = Dispatcher(), Dispatcher()
+    old_dispatcher.include_router(old_router)
+    new_dispatcher.include_router(new_router)
+    bot = Bot("123456:bench-token")
+    before, after = [], []
+    for data, _, _ in routes:
+        update = Update(update_id=1, callback_query=_callback(data))
+        before.append(await _per_update_us(old_dispatcher, bot, update, args.rounds // 10))
+        after.append(await _per_update_us(new_dispatcher, bot, update, args.rounds // 10))
+    _report("Dispatcher.feed_update целиком", before, after, routes)
+    await bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000)
+    asyncio.run(main(parser.parse_args()))
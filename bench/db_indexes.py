@@ -0,0 +1,164 @@
+"""Планы и задержки горячих запросов бота без вторичных индексов и с ними.
+
+Заполняет отдельную схему bench_indexes синтетическими данными (по умолчанию 20 000 пользователей,
+500 000 заявок, 250 000 фото, 1 500 000 записей журнала статусов), снимает EXPLAIN (ANALYZE, BUFFERS)
+и медиану/p95 времени каждого запроса, затем строит индексы из bot/models.py и повторяет замер.
+Рабочие таблицы не затрагиваются; схема удаляется в конце (--keep оставляет её).
+
+    DATABASE_DSN=postgresql+asyncpg://... python -m bench.db_indexes [--orders 500000] [--users 20000]
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.schema import CreateIndex
+
+from bot.config import DEFAULT_DATABASE_DSN
+from bot.constants import FINAL_ORDER_STATUSES, STATUS_IN_QUEUE, STATUS_LIST
+from bot.models import Base, Order, OrderPhoto, OrderStatusLog, User
+from bot.read_models import select_active_orders
+
+SCHEMA = "bench_indexes"
+TABLES = [User.__table__, Order.__table__, OrderPhoto.__table__, OrderStatusLog.__table__]
+USER_ID_BASE = 1_000_000_000
+ITERATIONS = 200
+
+# 7 из 8 заявок закрыты, как в живой базе: активные — меньшинство, поэтому частичный индекс мал
+_ACTIVE = [status for status in STATUS_LIST if status not in FINAL_ORDER_STATUSES]
+_STATUS_POOL = sorted(FINAL_ORDER_STATUSES) * 7 + _ACTIVE[:3]
+_STATUS_POOL_SQL = "ARRAY[" + ", ".join(f"'{status}'" for status in _STATUS_POOL) + "]"
+
+# Те же фильтры и сортировки, что строят app.py, services/photos.py и services/stats.py.
+# Функция вместо SQL — запрос берётся из кода бота как есть: у частичного индекса важно,
+# в каком виде приложение передаёт условие (параметрами или литералами)
+QUERIES = {
+    "user orders list": (
+        "SELECT id, user_order_number, status, product FROM orders "
+        "WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10"
+    ),
+    "user active orders": lambda params: select_active_orders(params["user_id"]),
+    "order by user number": "SELECT id FROM orders WHERE user_id = :user_id AND user_order_number = :number",
+    "orders in status": "SELECT COUNT(*) FROM orders WHERE status = :status",
+    "orders last week": "SELECT COUNT(*) FROM orders WHERE created_at >= NOW() - INTERVAL '7 days'",
+    "order photos": "SELECT id, source_path FROM order_photos WHERE order_id = :order_id",
+    "order status log": "SELECT status, ts FROM order_status_logs WHERE order_id = :order_id ORDER BY ts",
+    "blocked users": "SELECT id FROM users WHERE is_blocked IS true ORDER BY id",
+}
+
+FILL_SQL = [
+    """
+    INSERT INTO users (id, public_id, is_admin, is_blocked, first_seen, order_counter, updated_at)
+    SELECT :base + g, 'B' || g, FALSE, g % 500 = 0, NOW(), 0, NOW()
+    FROM generate_series(1, :users) g
+    """,
+    # Каждый пользователь получает номера 1, 2, ...; заявки идут раз в 30 секунд, последняя — сейчас
+    f"""
+    INSERT INTO orders (user_id, user_order_number, status, product, brand, created_at, updated_at)
+    SELECT
+        :base + (g % :users) + 1,
+        g / :users + 1,
+        ({_STATUS_POOL_SQL})[1 + (g * 7919) % {len(_STATUS_POOL)}],
+        'Кроссовки модель ' || g,
+        (ARRAY['Nike', 'Adidas', 'Puma', 'Reebok'])[1 + g % 4],
+        NOW() - (:orders - g) * INTERVAL '30 seconds',
+        NOW() - (:orders - g) * INTERVAL '30 seconds'
+    FROM generate_series(0, :orders - 1) g
+    """,
+    """
+    INSERT INTO order_photos (order_id, source_path, file_name, data, created_at)
+    SELECT id, 'photos/' || id || '.jpg', id || '.jpg', '\\x00'::bytea, created_at
+    FROM orders WHERE id % 2 = 0
+    """,
+    """
+    INSERT INTO order_status_logs (order_id, status, ts)
+    SELECT o.id, s.status, o.created_at + s.step * INTERVAL '1 hour'
+    FROM orders o CROSS JOIN (VALUES (0, 'Новая заявка'), (1, 'В обработке'), (2, 'Добавлен')) AS s(step, status)
+    """,
+]
+
+
+def _params(rng, users, orders):
+    return {
+        "user_id": USER_ID_BASE + rng.randint(1, users),
+        "number": rng.randint(1, max(orders // users, 1)),
+        "order_id": rng.randint(1, orders),
+        "status": STATUS_IN_QUEUE,
+    }
+
+
+async def _explain(conn, query, params):
+    if callable(query):
+        sql = query(params).compile(dialect=conn.dialect, compile_kwargs={"literal_binds": True})
+        return (await conn.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS) {sql}")).scalars().all()
+    return (await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"), params)).scalars().all()
+
+
+async def _run(conn, query, params):
+    if callable(query):
+        return await conn.execute(query(params))
+    return await conn.execute(text(query), params)
+
+
+async def _measure(conn, phase, users, orders):
+    rng = random.Random(42)
+    print(f"\n===== {phase} =====")
+    for name, query in QUERIES.items():
+        params = _params(rng, users, orders)
+        plan = await _explain(conn, query, params)
+        timings = []
+        for _ in range(ITERATIONS):
+            params = _params(rng, users, orders)
+            started = time.perf_counter()
+            (await _run(conn, query, params)).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        print(f"\n--- {name}: median {statistics.median(timings):.3f} ms, p95 {p95:.3f} ms")
+        print("\n".join(plan))
+
+
+async def main(args):
+    engine = create_async_engine(os.getenv("DATABASE_DSN", DEFAULT_DATABASE_DSN))
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        await conn.execute(text(f"SET search_path TO {SCHEMA}"))
+        # Таблицы и индексы из моделей, но в схеме стенда; text()-запросы находят их через search_path
+        await conn.execution_options(schema_translate_map={None: SCHEMA})
+        await conn.run_sync(Base.metadata.create_all, tables=TABLES, checkfirst=False)
+        indexes = [index for table in TABLES for index in table.indexes]
+        for index in indexes:
+            await conn.execute(text(f"DROP INDEX {index.name}"))
+
+        started = time.perf_counter()
+        fill_params = {"base": USER_ID_BASE, "users": args.users, "orders": args.orders}
+        for sql in FILL_SQL:
+            await conn.execute(text(sql), fill_params)
+        await conn.execute(text("ANALYZE"))
+        print(f"Заполнено за {time.perf_counter() - started:.1f} с: {args.users} пользователей, {args.orders} заявок")
+
+        await _measure(conn, "без вторичных индексов", args.users, args.orders)
+        started = time.perf_counter()
+        for index in indexes:
+            await conn.execute(CreateIndex(index))
+        await conn.execute(text("ANALYZE"))
+        print(f"\nИндексы построены за {time.perf_counter() - started:.1f} с")
+        await _measure(conn, "с индексами из bot/models.py", args.users, args.orders)
+
+        if not args.keep:
+            await conn.execute(text(f"DROP SCHEMA {SCHEMA} CASCADE"))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20_000)
+    parser.add_argument("--orders", type=int, default=500_000)
+    parser.add_argument("--keep", action="store_true", help="не удалять схему bench_indexes")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,75 @@
+"""Холодный старт: время `import bot.app` в новом процессе и что при этом загружается.
+
+Каждый замер — отдельный интерпретатор (после одного прогрева, чтобы не считать компиляцию .pyc).
+Печатает медиану времени процесса, кумулятивное время bot.app по `python -X importtime`,
+самые тяжёлые импорты и подгрузились ли pandas/openpyxl. С --compare REV тот же замер
+повторяется для ревизии REV (выгружается через git archive во временный каталог).
+
+    python -m bench.import_time [--runs 10] [--compare 2b12158^]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+PROBE = "import sys, bot.app; print(','.join(m for m in ('pandas', 'openpyxl', 'sqlalchemy.ext.asyncio') if m in sys.modules))"
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)$")
+
+
+def _run(root, *args):
+    # Каталоги photos/tmp старые версии создавали при импорте — пусть создают во временном каталоге
+    return subprocess.run(
+        [sys.executable, *args], cwd=root, env=dict(os.environ, PYTHONPATH=str(root)),
+        capture_output=True, text=True, check=True,
+    )
+
+
+def measure(root, runs):
+    _run(root, "-c", PROBE)
+    wall = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        _run(root, "-c", PROBE)
+        wall.append((time.perf_counter() - started) * 1000)
+    result = _run(root, "-X", "importtime", "-c", PROBE)
+    entries = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            entries.append((int(match.group(2)), match.group(3)))
+    app_us = next(cumulative for cumulative, name in entries if name == "bot.app")
+    # Сторонние пакеты верхнего уровня; cumulative каждого включает его подмодули
+    top = sorted((e for e in entries if "." not in e[1] and e[1] != "bot"), reverse=True)[:8]
+    return statistics.median(wall), app_us, result.stdout.strip(), top
+
+
+def report(title, root, runs):
+    wall, app_us, loaded, top = measure(root, runs)
+    print(f"\n{title}")
+    print(f"  процесс с import bot.app: медиана {wall:.0f} мс из {runs}")
+    print(f"  bot.app по -X importtime: {app_us / 1000:.0f} мс")
+    print(f"  загружены: {loaded or '—'}")
+    for cumulative, name in top:
+        print(f"    {cumulative / 1000:8.1f} мс  {name}")
+
+
+def main(args):
+    report("Текущее дерево", ROOT, args.runs)
+    if args.compare:
+        with tempfile.TemporaryDirectory() as tmp:
+            archive = subprocess.run(["git", "archive", args.compare, "bot"], cwd=ROOT, capture_output=True, check=True)
+            subprocess.run(["tar", "-x", "-C", tmp], input=archive.stdout, check=True)
+            report(f"Ревизия {args.compare}", Path(tmp), args.runs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--compare", metavar="REV", help="ревизия git для сравнения, например 2b12158^")
+    main(parser.parse_args())
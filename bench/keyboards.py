@@ -0,0 +1,73 @@
+"""Стоимость получения клавиатуры: копия кэшированного образца (@cached_keyboard) против сборки заново.
+
+Для каждой клавиатуры из bot/keyboards.py с @cached_keyboard замеряет вызов как в боте (копия образца
+с новыми строками и кнопками) и исходный построитель без кэша (__wrapped__), плюс main_kb для
+обычного пользователя и админа. Заодно проверяет, что правка полученной копии не доходит до образца.
+Печатает мкс на вызов по каждой клавиатуре и средние.
+
+    python -m bench.keyboards [--rounds 20000]
+"""
+import argparse
+import statistics
+import time
+
+from aiogram.types import InlineKeyboardButton
+
+from bot import context, keyboards
+
+USER_ID = 1
+ADMIN_ID = 2
+
+
+def _builders():
+    """(название, вызов с кэшем, сборка заново) для всех кэшированных клавиатур."""
+    builders = []
+    for name in sorted(vars(keyboards)):
+        func = getattr(keyboards, name)
+        wrapped = getattr(func, "__wrapped__", None)
+        if name.startswith("_") or not callable(func) or wrapped is None or func is keyboards.cached_keyboard:
+            continue
+        builders.append((name, func, wrapped))
+    # main_kb выбирает вариант по списку админов; в боте его заполняет загрузка из БД
+    context.admin_cache = {ADMIN_ID}
+    variant = keyboards._main_kb_variant.__wrapped__
+    builders.append(("main_kb (пользователь)", lambda: keyboards.main_kb(USER_ID), lambda: variant(False)))
+    builders.append(("main_kb (админ)", lambda: keyboards.main_kb(ADMIN_ID), lambda: variant(True)))
+    return builders
+
+
+def _per_call_us(func, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        func()
+    return (time.perf_counter() - started) / rounds * 1e6
+
+
+def _check_isolated(name, cached):
+    markup = cached()
+    markup.inline_keyboard.append([InlineKeyboardButton(text="bench", callback_data="bench")])
+    markup.inline_keyboard[0][0].text = "bench"
+    fresh = cached()
+    if fresh.inline_keyboard[-1][0].callback_data == "bench" or fresh.inline_keyboard[0][0].text == "bench":
+        raise SystemExit(f"{name}: правка копии изменила кэшированный образец")
+
+
+def main(args):
+    builders = _builders()
+    print(f"Клавиатур: {len(builders)}, вызовов на замер: {args.rounds}")
+    print(f"\n{'клавиатура':<34} {'копия':>8} {'сборка':>8}  мкс на вызов")
+    copies, rebuilds = [], []
+    for name, cached, rebuild in builders:
+        _check_isolated(name, cached)
+        copy_us = _per_call_us(cached, args.rounds)
+        rebuild_us = _per_call_us(rebuild, args.rounds)
+        copies.append(copy_us)
+        rebuilds.append(rebuild_us)
+        print(f"{name:<34} {copy_us:8.2f} {rebuild_us:8.2f}")
+    print(f"\nСреднее: копия {statistics.mean(copies):.2f} мкс, сборка {statistics.mean(rebuilds):.2f} мкс")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,181 @@
+"""Нагрузочный прогон webhook: записанные обновления с заданной частотой в WebhookServer.
+
+Обновления берутся из файла (JSON-массив или по одному Update на строку, например выгрузка getUpdates)
+или генерируются: сообщения /start из --chats разных чатов. Каждое отправляется POST-запросом
+с заголовком X-Telegram-Bot-Api-Secret-Token с постоянной частотой --rate, не дожидаясь ответов
+на предыдущие. Без --url поднимается WebhookServer в этом же процессе с тем же конвейером,
+что в боте (ChatSchedulerMiddleware перед роутером), а обработчик просто спит --handler-ms —
+так видно, при какой нагрузке очередь WEBHOOK_QUEUE_SIZE переполняется и отвечает 503.
+
+Печатает пропускную способность, перцентили задержки ответа, число ответов по кодам (503 — очередь
+полна) и, для встроенного сервера, сколько обновлений обработано.
+
+    python -m bench.webhook_replay [--updates updates.json] [--rate 500] [--count 5000] [--handler-ms 20]
+    python -m bench.webhook_replay --url https://bot.example/telegram/webhook --secret ... --updates updates.json
+"""
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import time
+from collections import Counter
+from dataclasses import replace
+from pathlib import Path
+
+import aiohttp
+from aiogram import Bot, Dispatcher, Router
+
+from bot.config import Settings
+from bot.middlewares import ChatSchedulerMiddleware
+from bot.webhook import SECRET_HEADER, WebhookServer
+
+BENCH_SECRET = "bench-secret"
+
+
+def load_updates(path, count, chats):
+    if path:
+        raw = Path(path).read_text(encoding="utf-8").strip()
+        updates = json.loads(raw) if raw.startswith("[") else [json.loads(line) for line in raw.splitlines() if line]
+        # Файл короче --count прокручивается заново с новыми update_id
+        return [dict(updates[i % len(updates)], update_id=i + 1) for i in range(count)]
+    return [
+        {
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": int(time.time()),
+                "chat": {"id": 1000 + i % chats, "type": "private"},
+                "from": {"id": 1000 + i % chats, "is_bot": False, "first_name": "bench"},
+                "text": "/start",
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_local_server(args, processed):
+    settings = replace(
+        Settings(),
+        webhook_host="127.0.0.1",
+        webhook_port=_free_port(),
+        webhook_secret=BENCH_SECRET,
+        webhook_url=None,
+        **({"webhook_queue_size": args.queue_size} if args.queue_size else {}),
+        **({"webhook_workers": args.workers} if args.workers else {}),
+    )
+
+    async def handle(event, **kwargs):
+        await asyncio.sleep(args.handler_ms / 1000)
+        processed.append(time.perf_counter())
+
+    router = Router()
+    router.message.register(handle)
+    router.callback_query.register(handle)
+    dispatcher = Dispatcher()
+    scheduler = ChatSchedulerMiddleware(
+        settings.scheduler_workers, settings.scheduler_chat_queue_limit, settings.scheduler_max_pending
+    )
+    dispatcher.update.outer_middleware(scheduler)
+    dispatcher.include_router(router)
+    server = WebhookServer(dispatcher, Bot("123456:bench-token"), settings)
+    url = f"http://127.0.0.1:{settings.webhook_port}{settings.webhook_path}"
+    return server, scheduler, url
+
+
+async def replay(url, secret, updates, rate, connections):
+    statuses = Counter()
+    latencies = []
+    connector = aiohttp.TCPConnector(limit=connections)
+    async with aiohttp.ClientSession(connector=connector) as session:
+
+        async def post(update):
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                    await response.read()
+                    statuses[response.status] += 1
+            except aiohttp.ClientError:
+                statuses["error"] += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        tasks = []
+        for i, update in enumerate(updates):
+            # Открытая модель нагрузки: расписание отправок не зависит от скорости ответов
+            delay = started + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    return statuses, latencies, elapsed
+
+
+def report(statuses, latencies, elapsed, count):
+    latencies.sort()
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    accepted = statuses.get(200, 0)
+    print(f"Отправлено {count} за {elapsed:.2f} с: {count / elapsed:.0f} запросов/с, принято {accepted / elapsed:.0f}/с")
+    print(f"Ответы: {', '.join(f'{code}: {n}' for code, n in sorted(statuses.items(), key=str))}")
+    print(f"503 (очередь полна): {statuses.get(503, 0)}")
+    print(
+        f"Задержка ответа, мс: p50 {pct(0.50):.1f}, p95 {pct(0.95):.1f}, p99 {pct(0.99):.1f}, "
+        f"max {latencies[-1]:.1f}, среднее {statistics.mean(latencies):.1f}"
+    )
+    return accepted
+
+
+async def main(args):
+    updates = load_updates(args.updates, args.count, args.chats)
+    if args.url:
+        statuses, latencies, elapsed = await replay(args.url, args.secret, updates, args.rate, args.connections)
+        report(statuses, latencies, elapsed, len(updates))
+        return
+
+    processed = []
+    server, scheduler, url = build_local_server(args, processed)
+    print(
+        f"Встроенный сервер: WEBHOOK_QUEUE_SIZE={server.queue.maxsize}, WEBHOOK_WORKERS={server.settings.webhook_workers}, "
+        f"SCHEDULER_MAX_PENDING={scheduler.max_pending}, обработчик {args.handler_ms} мс"
+    )
+    server_task = asyncio.create_task(server.run())
+    await asyncio.sleep(0.5)
+    started = time.perf_counter()
+    statuses, latencies, elapsed = await replay(url, BENCH_SECRET, updates, args.rate, args.connections)
+    accepted = report(statuses, latencies, elapsed, len(updates))
+    # Принятые дорабатываются уже после последнего ответа
+    deadline = time.perf_counter() + 60
+    while len(processed) < accepted and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    if processed:
+        busy = processed[-1] - started
+        print(f"Обработано {len(processed)} из {accepted} принятых за {busy:.2f} с: {len(processed) / busy:.0f}/с")
+    server_task.cancel()
+    await asyncio.gather(server_task, return_exceptions=True)
+    await scheduler.stop()
+    await server.bot.session.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", help="файл с записанными Update (JSON-массив или JSON lines)")
+    parser.add_argument("--count", type=int, default=5000, help="сколько обновлений отправить")
+    parser.add_argument("--rate", type=float, default=500, help="запросов в секунду")
+    parser.add_argument("--chats", type=int, default=200, help="разных чатов в сгенерированных обновлениях")
+    parser.add_argument("--connections", type=int, default=200, help="одновременных HTTP-соединений")
+    parser.add_argument("--url", help="внешний webhook вместо встроенного сервера")
+    parser.add_argument("--secret", default=BENCH_SECRET, help="WEBHOOK_SECRET для --url")
+    parser.add_argument("--handler-ms", type=float, default=20, help="время обработки одного обновления")
+    parser.add_argument("--queue-size", type=int, help="WEBHOOK_QUEUE_SIZE встроенного сервера")
+    parser.add_argument("--workers", type=int, help="WEBHOOK_WORKERS встроенного сервера")
+    asyncio.run(main(parser.parse_args()))
@@ -11,22 +11,26 @@ pip install aiogram sqlalchemy asyncpg pandas openpyxl
 import os
 import asyncio
 import logging
-import secrets
 from datetime import datetime, timedelta
-from collections import defaultdict
-from typing import Dict, List, Optional, Set, Tuple
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Set, Tuple
 
 from aiogram import BaseMiddleware, Bot, Dispatcher, Router
 from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
-from aiogram.filters import CommandStart, StateFilter
+from aiogram.filters import Command, CommandObject, CommandStart, StateFilter
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.exceptions import TelegramBadRequest
 
-from sqlalchemy import func, select, text
+from sqlalchemy import func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import load_only
 
 from .config import load_settings, Settings
 from .constants import (
+    FINAL_ORDER_STATUSES,
+    KIND_VALUES,
     STATUS_ADDED,
     STATUS_ANSWER_RECEIVED,
     STATUS_CLARIFY,
@@ -45,10 +49,14 @@ from .context import (
     init_context,
     refresh_admins_cache,
 )
+from .callback_routing import CallbackTable
 from .db import Database
+from .fsm_storage import build_fsm_storage
+from .webhook import WebhookServer
 from .logging_config import setup_logging
 from .metrics import setup_metrics_server
-from .middlewares import MetricsMiddleware
+from .migrations import run_migrations
+from .middlewares import ChatSchedulerMiddleware, MetricsMiddleware
 from .keyboards import (
     admin_admins_inline,
     admin_id_prompt_inline,
@@ -73,25 +81,89 @@ from .keyboards import (
     orders_list_inline,
     report_choice_inline,
     push_preview_inline,
+    search_results_inline,
     kind_list_inline,
     kind_detail_inline,
 )
 from .utils.photos import pack_photo_entry, parse_photo_entries, telegram_file_url
-from .models import AdminAction, Base, KindKeyword, MacroTemplate, Order, OrderStatusLog, User
+from .models import AdminAction, Order, OrderStatusInterval, OrderStatusLog, User
+from .read_models import (
+    ORDER_EDIT_FIELDS,
+    OrderCard,
+    OrderDigestItem,
+    OrderListItem,
+    select_active_orders,
+    select_order_card,
+    select_order_digest,
+    select_order_list,
+)
 from .services.files import safe_remove_file
+from .services.events import (
+    EVENT_ADMIN_QUESTION,
+    EVENT_ADMIN_UPDATE,
+    EVENT_CREATED,
+    EVENT_DELETED_BY_USER,
+    EVENT_STATUS_CHANGE,
+    EVENT_USER_COMMENT,
+    EVENT_USER_EDIT,
+    record_order_event,
+)
+from .services.jobs import (
+    JOB_KIND_BULK_UPLOAD,
+    JOB_KIND_DIGEST,
+    JOB_KIND_PHOTO_BACKFILL,
+    JOB_KIND_PURGE_OUTBOX,
+    JOB_KIND_PUSH,
+    JOB_KIND_RECLASSIFY_KINDS,
+    JOB_KIND_RECONCILE_STATS,
+    JOB_KIND_REFRESH_VIEWS,
+    JOB_KIND_REPORT,
+    JOB_KIND_WEEKLY_DIGEST,
+    enqueue_job,
+    job_handler,
+    run_job_consumers,
+    save_job_progress,
+)
+from .services.kinds import (
+    add_kind_keyword,
+    get_kind_classifier,
+    get_kind_dictionary,
+    reclassify_orders,
+    remove_kind_keyword,
+)
+from .services.macros import (
+    Macro,
+    create_macro_db,
+    delete_macro_db,
+    get_macro_by_id,
+    get_macro_templates,
+    load_macros,
+    update_macro_db,
+)
+from .services.outbox import enqueue_notification, outbox_relay_worker, purge_outbox, wake_outbox_relay
+from .services.public_ids import allocate_user_public_id, load_reserved_public_ids
 from .services.reports import generate_order_reports, prepare_status_updates
+from .services.search import (
+    ORDER_NUMBER_RE,
+    PG_INT_MAX,
+    SEARCH_QUERY_MAX_LENGTH,
+    OrderSearchPage,
+    find_order_by_number,
+    search_orders,
+)
+from .services.stats import (
+    brand_change_deltas,
+    bump_order_stats,
+    get_stats_snapshot,
+    order_created_deltas,
+    reconcile_order_stats,
+    status_change_deltas,
+)
+from .services.views import refresh_changed_views, refresh_materialized_views
 from .services.photos import persist_order_photos, restore_order_photos
 # from .states...
 from .states import AdminStates, OrderStates
-from .models import KindKeyword
-
-# ---------------- CONFIG / LOGGING ----------------
-setup_logging()
-settings: Settings = load_settings()
-PHOTOS_DIR = str(settings.photos_dir)
-TMP_DIR = str(settings.tmp_dir)
 
-FINAL_ORDER_STATUSES = {STATUS_ADDED, STATUS_NOT_ADDED, STATUS_DELETED_BY_USER}
 STATUS_DESCRIPTIONS = {
     STATUS_NEW: "Мы только получили заявку и уже начали поиск.",
     STATUS_IN_QUEUE: "Заявка в работе — команда мониторит наличие.",
@@ -107,331 +179,175 @@ STATUS_SHORT = {
     STATUS_NOT_ADDED: "Не будет добавлен",
     STATUS_DELETED_BY_USER: "Удалена пользователем",
 }
-KIND_VALUES = ["Одежда", "Обувь", "Инвентарь", "Аксессуары"]
-
-ADMIN_QUESTION_TEMPLATES = [
-    (
-        "Уточнить размер",
-        "Подскажите, пожалуйста, какой размер вам подойдёт? Это поможет точнее найти товар.",
-    ),
-    (
-        "Уточнить бюджет",
-        "Подтвердите, какой бюджет комфортен за этот товар, чтобы мы искали в нужном диапазоне.",
-    ),
-    (
-        "Предложить альтернативу",
-        "Нашлась похожая модель. Готовы рассмотреть альтернативу, если она появится быстрее?",
-    ),
-]
+
+# Рассылка сохраняет прогресс в задаче раз в столько получателей
+PUSH_PROGRESS_EVERY = 10
 
 logger = logging.getLogger(__name__)
 
-# ---------------- BOT / DISPATCHER / FSM / DB ----------------
-database = Database(settings)
-bot = Bot(token=settings.bot_token)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+# ---------------- ROUTER ----------------
+# Только объявления: бот, БД и диспетчер создаются в create_app, импорт модуля ничего не подключает
 router = Router()
-dp.update.middleware(MetricsMiddleware())
-
-init_context(bot, database.session_factory, settings, database)
+callbacks = CallbackTable()
+router.callback_query.register(callbacks.dispatch, callbacks.filter())
 
 # ---------------- DB HELPERS ----------------
 async def init_db():
-    db = get_database()
-    async with db.engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        try:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS public_id VARCHAR(32) UNIQUE"))
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE"))
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS block_reason TEXT"))
-            await conn.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_order_number INTEGER"))
-            await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_status_digest_at TIMESTAMP"))
-            await conn.execute(text("""
-            CREATE OR REPLACE VIEW view_orders_count_status AS
-            SELECT status, COUNT(*) AS cnt FROM orders GROUP BY status;
-            """))
-            # аналитические представления
-            await conn.execute(text("""
-            CREATE OR REPLACE VIEW v_order_status_durations AS
-            WITH ordered AS (
-                SELECT
-                    order_id,
-                    status,
-                    ts,
-                    LEAD(ts) OVER (PARTITION BY order_id ORDER BY ts) AS next_ts
-                FROM order_status_logs
-            ),
-            durations AS (
-                SELECT
-                    order_id,
-                    status,
-                    ts,
-                    next_ts,
-                    EXTRACT(EPOCH FROM (COALESCE(next_ts, NOW()) - ts)) AS seconds_in_status
-                FROM ordered
-            )
-            SELECT * FROM durations;
-            """))
-            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS mv_status_avg"))
-            await conn.execute(text("""
-            CREATE MATERIALIZED VIEW mv_status_avg AS
-            SELECT
-                status,
-                AVG(seconds_in_status) AS avg_seconds,
-                SUM(seconds_in_status) AS total_seconds,
-                COUNT(*) AS transitions,
-                NOW() AS refreshed_at
-            FROM v_order_status_durations
-            WHERE next_ts IS NOT NULL
-            GROUP BY status;
-            """))
-            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS mv_order_status_time"))
-            await conn.execute(text("""
-            CREATE MATERIALIZED VIEW mv_order_status_time AS
-            SELECT
-                order_id,
-                status,
-                SUM(seconds_in_status) AS seconds_in_status
-            FROM v_order_status_durations
-            WHERE next_ts IS NOT NULL
-            GROUP BY order_id, status;
-            """))
-            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS mv_order_stats"))
-            await conn.execute(text(f"""
-            CREATE MATERIALIZED VIEW mv_order_stats AS
-            SELECT
-                (SELECT COUNT(*) FROM orders) AS total_orders,
-                (SELECT COUNT(*) FROM orders WHERE status IN ('{STATUS_ADDED}','{STATUS_NOT_ADDED}','{STATUS_DELETED_BY_USER}')) AS closed_orders,
-                (SELECT COUNT(*) FROM orders WHERE status NOT IN ('{STATUS_ADDED}','{STATUS_NOT_ADDED}','{STATUS_DELETED_BY_USER}')) AS active_orders,
-                (SELECT COUNT(*) FROM orders WHERE status = '{STATUS_ADDED}') AS added_orders,
-                CASE WHEN (SELECT COUNT(*) FROM orders) > 0
-                     THEN (SELECT COUNT(*) FROM orders WHERE status = '{STATUS_ADDED}')::DECIMAL / (SELECT COUNT(*) FROM orders)
-                     ELSE 0 END AS conversion_added,
-                (SELECT COUNT(*) FROM users WHERE COALESCE(is_admin, FALSE) = FALSE) AS users_non_admin,
-                NOW() AS refreshed_at;
-            """))
-            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS mv_top_brands"))
-            await conn.execute(text("""
-            CREATE MATERIALIZED VIEW mv_top_brands AS
-            SELECT
-                COALESCE(NULLIF(TRIM(brand), ''), '—') AS brand,
-                COUNT(*) AS cnt,
-                NOW() AS refreshed_at
-            FROM orders
-            GROUP BY 1;
-            """))
-            await conn.execute(text("DROP MATERIALIZED VIEW IF EXISTS mv_kind_distribution"))
-            await conn.execute(text("""
-            CREATE MATERIALIZED VIEW mv_kind_distribution AS
-            SELECT
-                COALESCE(
-                    (
-                        SELECT kk.kind
-                        FROM kind_keywords kk
-                        WHERE lower(COALESCE(o.product, '')) LIKE '%' || kk.keyword || '%'
-                        LIMIT 1
-                    ),
-                    'Не определено'
-                ) AS kind,
-                COUNT(*) AS cnt,
-                NOW() AS refreshed_at
-            FROM orders o
-            GROUP BY 1;
-            """))
-        except Exception:
-            pass
+    await run_migrations()
+    # Занятые старые public_id держим в памяти процесса; для текущего ключа список считается один раз
+    await load_reserved_public_ids()
 
-async def refresh_materialized_views():
-    db = get_database()
-    async with db.engine.begin() as conn:
-        for view in [
-            "mv_status_avg",
-            "mv_order_status_time",
-            "mv_order_stats",
-            "mv_top_brands",
-            "mv_kind_distribution",
-        ]:
-            try:
-                await conn.execute(text(f"REFRESH MATERIALIZED VIEW {view};"))
-            except Exception:
-                logger.exception("Failed to refresh materialized view %s", view)
 
+@job_handler(JOB_KIND_REFRESH_VIEWS, every_seconds=lambda: get_settings().views_check_interval)
+async def job_refresh_views(payload: dict) -> None:
+    refreshed = await refresh_changed_views()
+    if refreshed:
+        logger.info("Обновлены витрины: %s", ", ".join(refreshed))
 
-async def refresh_views_periodically(interval_hours: int = 4):
-    while True:
-        try:
-            await refresh_materialized_views()
-        except Exception:
-            logger.exception("Periodic refresh failed")
-        await asyncio.sleep(interval_hours * 3600)
+
+@job_handler(JOB_KIND_RECLASSIFY_KINDS, dedupe_pending_only=True)
+async def job_reclassify_kinds(payload: dict) -> None:
+    changed = await reclassify_orders()
+    logger.info("Вид пересчитан, изменено заявок: %s", changed)
+    if changed:
+        await refresh_materialized_views(["mv_kind_distribution"])
+
+
+@job_handler(JOB_KIND_RECONCILE_STATS, every_seconds=6 * 3600)
+async def job_reconcile_stats(payload: dict) -> None:
+    rows = await reconcile_order_stats()
+    logger.info("Счётчики аналитики пересчитаны, строк: %s", rows)
+
+
+@job_handler(JOB_KIND_PURGE_OUTBOX, every_seconds=6 * 3600)
+async def job_purge_outbox(payload: dict) -> None:
+    removed = await purge_outbox()
+    if removed:
+        logger.info("Удалено старых уведомлений из outbox: %s", removed)
 
 
 # ----------- Weekly digest -------------
-async def get_active_orders(user_id: int) -> List[Order]:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(
-            select(Order)
-            .where(Order.user_id == user_id, Order.status.not_in(FINAL_ORDER_STATUSES))
-            .order_by(Order.created_at.desc())
-        )
-        orders = q.scalars().all()
-        await ensure_order_numbers(session, orders, user_id)
-        return orders
+async def get_active_orders(user_id: int) -> List[OrderDigestItem]:
+    async with get_database().replica_session(user_id) as session:
+        rows = (await session.execute(select_active_orders(user_id))).all()
+        return [OrderDigestItem(*row) for row in rows]
 
 
 async def send_status_digest(user: User, force: bool = False, update_timestamp: bool = True) -> None:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(
-            select(Order)
-            .where(Order.user_id == user.id)
-            .order_by(Order.created_at.asc())
-        )
-        orders_all = q.scalars().all()
-        await ensure_order_numbers(session, orders_all, user.id)
-        active_orders = [o for o in orders_all if o.status not in FINAL_ORDER_STATUSES]
-        if not active_orders:
+    async with get_database().replica_session(user.id) as session:
+        stmt = select_order_digest().where(Order.user_id == user.id).order_by(Order.created_at.asc())
+        rows = (await session.execute(stmt)).all()
+    orders_all = [OrderDigestItem(*row) for row in rows]
+    active_orders = [o for o in orders_all if o.status not in FINAL_ORDER_STATUSES]
+    if not active_orders:
+        return
+    first_created = min(o.created_at for o in orders_all if o.created_at) or datetime.utcnow()
+    now = datetime.utcnow()
+    last_sent = user.last_status_digest_at
+    if not force:
+        if first_created + timedelta(days=7) > now:
             return
-        first_created = min(o.created_at for o in orders_all if o.created_at) or datetime.utcnow()
-        now = datetime.utcnow()
-        last_sent = user.last_status_digest_at
-        if not force:
-            if first_created + timedelta(days=7) > now:
-                return
-            if last_sent and last_sent + timedelta(days=7) > now:
-                return
-        public_id = await ensure_user_public_id(session, user)
-        lines: List[str] = ["Обновления по вашим активным заявкам:\n"]
-        for o in active_orders:
-            num = format_order_number(o, public_id)
-            brand_size = " · ".join(
-                [part for part in [o.brand or "—", o.size or "—"] if part]
-            )
-            status = STATUS_SHORT.get(o.status, o.status)
-            lines.append(f"• Заявка #{num} · {o.product or '—'}")
-            lines.append(f"  Бренд/Размер: {brand_size}")
-            lines.append(f"  Комментарий: {o.comment or '—'}")
-            lines.append(f"  Статус: {status}")
-            lines.append("")
-        text = "\n".join(lines).strip()
-        try:
-            await get_bot().send_message(chat_id=user.id, text=text)
-        except Exception:
-            logger.exception("Не удалось отправить дайджест пользователю %s", user.id)
-        if update_timestamp:
-            user.last_status_digest_at = now
-            session.add(user)
+        if last_sent and last_sent + timedelta(days=7) > now:
+            return
+    public_id = user.public_id
+    lines: List[str] = ["Обновления по вашим активным заявкам:\n"]
+    for o in active_orders:
+        num = format_order_number(o, public_id)
+        brand_size = " · ".join(
+            [part for part in [o.brand or "—", o.size or "—"] if part]
+        )
+        status = STATUS_SHORT.get(o.status, o.status)
+        lines.append(f"• Заявка #{num} · {o.product or '—'}")
+        lines.append(f"  Бренд/Размер: {brand_size}")
+        lines.append(f"  Комментарий: {o.comment or '—'}")
+        lines.append(f"  Статус: {status}")
+        lines.append("")
+    text = "\n".join(lines).strip()
+    try:
+        await get_bot().send_message(chat_id=user.id, text=text)
+    except Exception:
+        logger.exception("Не удалось отправить дайджест пользователю %s", user.id)
+    if update_timestamp:
+        user.last_status_digest_at = now
+        session_factory = get_session_factory()
+        async with session_factory() as session:
+            await session.execute(update(User).where(User.id == user.id).values(last_status_digest_at=now))
             await session.commit()
 
 
-async def weekly_digest_worker():
-    session_factory = get_session_factory()
-    while True:
+@job_handler(JOB_KIND_WEEKLY_DIGEST, every_seconds=24 * 3600)  # check daily
+async def job_weekly_digest(payload: dict) -> None:
+    async with get_database().replica_session() as session:
+        q = await session.execute(select(User))
+        users = q.scalars().all()
+    for u in users:
         try:
-            async with session_factory() as session:
-                q = await session.execute(select(User))
-                users = q.scalars().all()
-            for u in users:
-                try:
-                    await send_status_digest(u, force=False, update_timestamp=True)
-                except Exception:
-                    logger.exception("Digest send failed for user %s", u.id)
+            await send_status_digest(u, force=False, update_timestamp=True)
         except Exception:
-            logger.exception("Weekly digest worker failure")
-        await asyncio.sleep(24 * 3600)  # check daily
-
-
-async def generate_unique_user_public_id(session) -> str:
-    while True:
-        candidate = f"{secrets.randbelow(900000) + 100000:06d}"
-        exists = await session.scalar(select(User.id).where(User.public_id == candidate))
-        if not exists:
-            return candidate
-
-
-async def get_kind_keywords() -> Dict[str, List[str]]:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(KindKeyword.kind, KindKeyword.keyword).order_by(KindKeyword.kind))
-        kinds: Dict[str, List[str]] = defaultdict(list)
-        for kind, kw in q.all():
-            kinds[kind].append(kw)
-        return kinds
-
-
-async def add_kind_keyword(kind: str, keyword: str) -> Tuple[bool, str]:
-    kind = kind.strip()
-    keyword = keyword.strip().lower()
-    if not keyword or kind not in KIND_VALUES:
-        return False, "Некорректные данные."
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        existing = await session.execute(select(KindKeyword).where(KindKeyword.keyword == keyword))
-        if existing.scalars().first():
-            return False, "Слово уже используется в другом виде."
-        session.add(KindKeyword(kind=kind, keyword=keyword))
-        await session.commit()
-    return True, "Добавлено."
-
-
-async def remove_kind_keyword(kind: str, keyword: str) -> Tuple[bool, str]:
-    keyword = keyword.strip().lower()
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(KindKeyword).where(KindKeyword.kind == kind, KindKeyword.keyword == keyword))
-        row = q.scalars().first()
-        if not row:
-            return False, "Такое слово не найдено в этом виде."
-        await session.delete(row)
-        await session.commit()
-    return True, "Удалено."
+            logger.exception("Digest send failed for user %s", u.id)
 
 
 async def ensure_user_public_id(session, user: User) -> str:
+    """Выдаёт public_id в транзакции вызывающего (только для путей записи); коммитит вызывающий."""
     if not user.public_id:
-        user.public_id = await generate_unique_user_public_id(session)
-        await session.commit()
+        user.public_id = await allocate_user_public_id(session)
     return user.public_id
 
 
 async def get_user_public_id(user_id: int) -> Optional[str]:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(User).where(User.id == user_id))
-        user = q.scalars().first()
-        if not user:
-            return None
-        return await ensure_user_public_id(session, user)
+    async with get_database().read_session() as session:
+        return await session.scalar(select(User.public_id).where(User.id == user_id))
 
 
-def format_order_number(order: Order, user_public_id: Optional[str]) -> str:
+def format_order_number(order, user_public_id: Optional[str]) -> str:
     prefix = user_public_id or str(order.user_id)
     suffix = order.user_order_number or order.id
     return f"{prefix}-{suffix}"
 
 
-async def get_order_display_number(order: Order) -> str:
+async def get_order_display_number(order) -> str:
     """Возвращает номер заказа в формате {public_id}-{user_order_number}."""
     return format_order_number(order, await get_user_public_id(order.user_id))
 
 
-async def ensure_order_numbers(session, orders: List[Order], user_id: int) -> None:
-    missing = [o for o in orders if o.user_order_number is None]
-    if not missing:
-        return
-    max_num = await session.scalar(select(func.max(Order.user_order_number)).where(Order.user_id == user_id))
-    next_num = max_num or 0
-    for order in sorted(missing, key=lambda o: (o.created_at or datetime.min, o.id)):
-        next_num += 1
-        order.user_order_number = next_num
-    await session.commit()
+async def allocate_order_numbers(session, user_id: int, count: int = 1) -> int:
+    """Атомарно резервирует count номеров заявок пользователя и возвращает последний из них.
+
+    Строка пользователя блокируется до конца транзакции, поэтому параллельные заявки
+    одного пользователя получают разные номера без MAX() по orders.
+    """
+    stmt = (
+        update(User)
+        .where(User.id == user_id)
+        .values(order_counter=User.order_counter + count)
+        .returning(User.order_counter)
+        .execution_options(synchronize_session=False)
+    )
+    last = await session.scalar(stmt)
+    if last is None:
+        # Заявки пользователя без строки в users: заводим её со счётчиком по уже выданным номерам
+        max_num = select(func.coalesce(func.max(Order.user_order_number), 0)).where(Order.user_id == user_id)
+        await session.execute(
+            pg_insert(User)
+            .values(id=user_id, is_admin=(user_id in get_admins()), order_counter=max_num.scalar_subquery())
+            .on_conflict_do_nothing(index_elements=[User.id])
+        )
+        last = await session.scalar(stmt)
+    return last
 
 
 async def log_status_change(session, order_id: int, status: str, ts: Optional[datetime] = None) -> None:
     ts = ts or datetime.utcnow()
     session.add(OrderStatusLog(order_id=order_id, status=status, ts=ts))
+    # Смены статуса одной заявки идут по очереди, иначе обе попытаются открыть новый интервал
+    await session.execute(select(Order.id).where(Order.id == order_id).with_for_update())
+    await session.execute(
+        update(OrderStatusInterval)
+        .where(OrderStatusInterval.order_id == order_id, OrderStatusInterval.ended_at.is_(None))
+        .values(ended_at=ts)
+        .execution_options(synchronize_session=False)
+    )
+    session.add(OrderStatusInterval(order_id=order_id, status=status, started_at=ts))
 
 async def add_or_update_user(user_obj):
     session_factory = get_session_factory()
@@ -439,7 +355,7 @@ async def add_or_update_user(user_obj):
         q = await session.execute(select(User).where(User.id == user_obj.id))
         u = q.scalars().first()
         if not u:
-            public_id = await generate_unique_user_public_id(session)
+            public_id = await allocate_user_public_id(session)
             u = User(id=user_obj.id, username=getattr(user_obj, "username", None),
                      full_name=getattr(user_obj, "full_name", None), is_admin=(user_obj.id in get_admins()),
                      public_id=public_id)
@@ -452,7 +368,7 @@ async def add_or_update_user(user_obj):
             if u.full_name != getattr(user_obj, "full_name", None):
                 u.full_name = getattr(user_obj, "full_name", None); changed = True
             if not u.public_id:
-                u.public_id = await generate_unique_user_public_id(session); changed = True
+                u.public_id = await allocate_user_public_id(session); changed = True
             if changed:
                 await session.commit()
 
@@ -468,9 +384,6 @@ class UserSyncMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
-dp.update.middleware(UserSyncMiddleware())
-
-
 class BlockMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
         user_obj = getattr(event, "from_user", None)
@@ -495,97 +408,117 @@ class BlockMiddleware(BaseMiddleware):
         return await handler(event, data)
 
 
-dp.update.middleware(BlockMiddleware())
-
 async def create_order_db(data: dict, user_id: int) -> Tuple[int, str]:
+    # Сверяем версию словаря с БД: задача reclassify_kinds могла уже пройти эти id,
+    # и вид, посчитанный по устаревшему кэшу, остался бы в заявке навсегда
+    kind_classifier = await get_kind_classifier(fresh=True)
     session_factory = get_session_factory()
     async with session_factory() as session:
         q = await session.execute(select(User).where(User.id == user_id))
         user = q.scalars().first()
         if not user:
-            public_id = await generate_unique_user_public_id(session)
+            public_id = await allocate_user_public_id(session)
             user = User(id=user_id, username=None, full_name=None, is_admin=(user_id in get_admins()), public_id=public_id)
             session.add(user)
         else:
             await ensure_user_public_id(session, user)
-        max_number = await session.scalar(select(func.max(Order.user_order_number)).where(Order.user_id == user_id))
-        next_number = (max_number or 0) + 1
+        next_number = await allocate_order_numbers(session, user_id)
         order = Order(
             user_id=user_id,
             status=STATUS_NEW,
             product=data.get("product"),
+            kind=kind_classifier.classify(data.get("product")) or None,
             brand=data.get("brand"),
             size=data.get("size"),
             desired_price=data.get("price"),
             comment=data.get("comment"),
-            user_comments="",
             photos=data.get("photos", ""),
             product_link="",
-            communication=f"{datetime.utcnow().isoformat()} CREATED by {user_id}",
-            internal_comments="",
             user_order_number=next_number
         )
         session.add(order)
+        await bump_order_stats(session, order_created_deltas(STATUS_NEW, order.brand, first_for_user=next_number == 1))
         await session.commit()
         await session.refresh(order)
         await log_status_change(session, order.id, STATUS_NEW, ts=order.created_at)
+        record_order_event(session, order.id, EVENT_CREATED, actor_id=user_id, ts=order.created_at)
         await session.commit()
+        get_database().mark_user_write(user_id)
         return order.id, format_order_number(order, user.public_id)
 
-async def get_orders_by_user(user_id: int):
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(Order).where(Order.user_id == user_id).order_by(Order.created_at.desc()))
-        orders = q.scalars().all()
-        await ensure_order_numbers(session, orders, user_id)
-        return orders
+async def get_orders_by_user(user_id: int) -> List[OrderListItem]:
+    async with get_database().replica_session(user_id) as session:
+        stmt = select_order_list().where(Order.user_id == user_id).order_by(Order.created_at.desc())
+        rows = (await session.execute(stmt)).all()
+        return [OrderListItem(*row) for row in rows]
 
-async def get_order_by_id(order_id: int):
+async def get_order_by_id(order_id: int) -> Optional[OrderCard]:
+    async with get_database().read_session() as session:
+        row = (await session.execute(select_order_card().where(Order.id == order_id))).first()
+        return OrderCard(*row) if row else None
+
+async def get_order_for_edit(order_id: int) -> Optional[Order]:
+    """Загружает только редактируемые поля заявки, без журнала и служебных текстов."""
     session_factory = get_session_factory()
     async with session_factory() as session:
-        q = await session.execute(select(Order).where(Order.id == order_id))
-        order = q.scalars().first()
-        if not order:
-            return None
-        await ensure_order_numbers(session, [order], order.user_id)
-        return order
+        q = await session.execute(select(Order).options(load_only(*ORDER_EDIT_FIELDS)).where(Order.id == order_id))
+        return q.scalars().first()
 
-async def update_order_status_db(order_id: int, new_status: str, product_link: str = "") -> bool:
+async def update_order_status_db(
+    order_id: int,
+    new_status: str,
+    product_link: str = "",
+    notifications: Sequence[Tuple[int, str]] = (),
+    actor_id: Optional[int] = None,
+) -> bool:
     if new_status == STATUS_ADDED:
         if not (isinstance(product_link, str) and product_link.strip().lower().startswith(("http://", "https://"))):
             return False
     session_factory = get_session_factory()
     async with session_factory() as session:
-        q = await session.execute(select(Order).where(Order.id == order_id))
+        # Строка блокируется до чтения старого статуса: иначе две параллельные смены посчитают в order_stats одну и ту же дельту
+        q = await session.execute(select(Order).where(Order.id == order_id).with_for_update())
         order = q.scalars().first()
         if not order:
             return False
         old = order.status
         order.status = new_status
+        await bump_order_stats(session, status_change_deltas(old, new_status))
         if product_link:
             order.product_link = product_link
-        order.communication = (order.communication or "") + f"\n{datetime.utcnow().isoformat()} ADMIN_STATUS_CHANGE {old} -> {new_status}"
         order.updated_at = datetime.utcnow()
         await log_status_change(session, order.id, new_status, ts=order.updated_at)
+        record_order_event(
+            session, order.id, EVENT_STATUS_CHANGE, actor_id=actor_id, payload=f"{old} -> {new_status}", ts=order.updated_at
+        )
+        for chat_id, note in notifications:
+            enqueue_notification(session, chat_id, note)
         await session.commit()
-        return True
+        get_database().mark_user_write(order.user_id)
+    if notifications:
+        wake_outbox_relay()
+    return True
 
 async def update_order_details_db(order_id: int, data: dict, actor_id: Optional[int] = None) -> bool:
+    kind_classifier = await get_kind_classifier(fresh=True)
     session_factory = get_session_factory()
     async with session_factory() as session:
-        q = await session.execute(select(Order).where(Order.id == order_id))
+        q = await session.execute(select(Order).where(Order.id == order_id).with_for_update())
         order = q.scalars().first()
         if not order:
             return False
+        await bump_order_stats(session, brand_change_deltas(order.brand, data.get("brand")))
         order.product = data.get("product")
+        order.kind = kind_classifier.classify(order.product) or None
         order.brand = data.get("brand")
         order.size = data.get("size")
         order.desired_price = data.get("price")
         order.comment = data.get("comment")
         order.photos = data.get("photos")
         order.updated_at = datetime.utcnow()
-        order.communication = ((order.communication or "") + f"\n{datetime.utcnow().isoformat()} USER_EDIT {actor_id or ''}")
+        record_order_event(session, order.id, EVENT_USER_EDIT, actor_id=actor_id, ts=order.updated_at)
         await session.commit()
+        get_database().mark_user_write(order.user_id)
         return True
 
 
@@ -596,10 +529,10 @@ async def append_user_comment_db(order_id: int, user_id: int, text: str) -> bool
         order = q.scalars().first()
         if not order:
             return False
-        order.user_comments = (order.user_comments or "") + f"\n{datetime.utcnow().isoformat()} USER({user_id}): {text}"
-        order.communication = (order.communication or "") + f"\n{datetime.utcnow().isoformat()} USER_COMMENT: {text}"
         order.updated_at = datetime.utcnow()
+        record_order_event(session, order.id, EVENT_USER_COMMENT, actor_id=user_id, payload=text, ts=order.updated_at)
         await session.commit()
+        get_database().mark_user_write(order.user_id)
         return True
 
 
@@ -607,7 +540,7 @@ async def collect_user_answer_text(message: Message) -> str:
     tg_bot = get_bot()
     if message.photo:
         file_info = await tg_bot.get_file(message.photo[-1].file_id)
-        local = os.path.join(PHOTOS_DIR, f"{message.from_user.id}_{message.photo[-1].file_unique_id}.jpg")
+        local = os.path.join(get_settings().photos_dir, f"{message.from_user.id}_{message.photo[-1].file_unique_id}.jpg")
         await tg_bot.download(file_info, local)
         return f"Фото ответа: {local}\n{message.caption or ''}"
     if message.document:
@@ -619,7 +552,7 @@ async def collect_user_answer_text(message: Message) -> str:
         if is_image:
             file_info = await tg_bot.get_file(doc.file_id)
             ext = os.path.splitext(doc.file_name or "")[1] or ".jpg"
-            local = os.path.join(PHOTOS_DIR, f"{message.from_user.id}_{doc.file_unique_id}{ext}")
+            local = os.path.join(get_settings().photos_dir, f"{message.from_user.id}_{doc.file_unique_id}{ext}")
             await tg_bot.download(file_info, local)
             return f"Фото ответа: {local}\n{message.caption or message.text or ''}"
     return message.text or ""
@@ -627,73 +560,20 @@ async def collect_user_answer_text(message: Message) -> str:
 async def mark_deleted_by_user_db(order_id: int, user_id: int) -> bool:
     session_factory = get_session_factory()
     async with session_factory() as session:
-        q = await session.execute(select(Order).where(Order.id == order_id, Order.user_id == user_id))
+        q = await session.execute(select(Order).where(Order.id == order_id, Order.user_id == user_id).with_for_update())
         order = q.scalars().first()
         if not order:
             return False
+        await bump_order_stats(session, status_change_deltas(order.status, STATUS_DELETED_BY_USER))
         order.status = STATUS_DELETED_BY_USER
-        order.internal_comments = (order.internal_comments or "") + f"\n{datetime.utcnow().isoformat()} Deleted by user {user_id}"
         order.updated_at = datetime.utcnow()
         await log_status_change(session, order.id, STATUS_DELETED_BY_USER, ts=order.updated_at)
+        record_order_event(session, order.id, EVENT_DELETED_BY_USER, actor_id=user_id, ts=order.updated_at)
         await session.commit()
+        get_database().mark_user_write(user_id)
         return True
 
 
-async def get_macro_templates() -> List[MacroTemplate]:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(MacroTemplate).order_by(MacroTemplate.id))
-        return q.scalars().all()
-
-
-async def get_macro_by_id(macro_id: int) -> Optional[MacroTemplate]:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(MacroTemplate).where(MacroTemplate.id == macro_id))
-        return q.scalars().first()
-
-
-async def create_macro_db(title: str, body: str, admin_id: int) -> int:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        macro = MacroTemplate(title=title, body=body, created_by=admin_id, updated_by=admin_id)
-        session.add(macro)
-        action = AdminAction(admin_id=admin_id, action_type="macro_create", details=f"{title}")
-        session.add(action)
-        await session.commit()
-        await session.refresh(macro)
-        return macro.id
-
-
-async def update_macro_db(macro_id: int, title: str, body: str, admin_id: int) -> bool:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(MacroTemplate).where(MacroTemplate.id == macro_id))
-        macro = q.scalars().first()
-        if not macro:
-            return False
-        macro.title = title
-        macro.body = body
-        macro.updated_by = admin_id
-        action = AdminAction(admin_id=admin_id, action_type="macro_edit", details=f"{macro_id}")
-        session.add(action)
-        await session.commit()
-        return True
-
-
-async def delete_macro_db(macro_id: int, admin_id: int) -> bool:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        q = await session.execute(select(MacroTemplate).where(MacroTemplate.id == macro_id))
-        macro = q.scalars().first()
-        if not macro:
-            return False
-        await session.delete(macro)
-        action = AdminAction(admin_id=admin_id, action_type="macro_delete", details=f"{macro_id}")
-        session.add(action)
-        await session.commit()
-        return True
-
 # ---------------- UTILITIES ----------------
 async def delete_message_later(chat_id: int, message_id: int, delay: int = 5):
     await asyncio.sleep(delay)
@@ -706,7 +586,7 @@ async def delete_message_later(chat_id: int, message_id: int, delay: int = 5):
 
 def validate_config() -> None:
     """Проверяет минимальную конфигурацию и логирует предупреждения."""
-    cfg = settings
+    cfg = get_settings()
     if not cfg.bot_token:
         logger.error("BOT_TOKEN is not set. Set BOT_TOKEN env var before running the bot.")
         raise RuntimeError("BOT_TOKEN is not configured")
@@ -855,9 +735,8 @@ async def send_user_orders_list(user_id: int) -> None:
         line_parts: List[str] = [f"{order_number_full}", title]
         if order.brand or order.size:
             line_parts.append(f"{order.brand or '—'} · {order.size or '—'}")
-        photos = parse_photo_entries(order.photos, settings)
-        if photos:
-            line_parts.append(f"📷{len(photos)}")
+        if order.photos_count:
+            line_parts.append(f"📷{order.photos_count}")
         line = " · ".join(line_parts)
         line = f"- {line}"
 
@@ -915,36 +794,20 @@ async def prompt_status_upload(user_id: int, state: FSMContext) -> None:
 
 
 async def build_basic_analytics_text() -> str:
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        total = await session.scalar(select(func.count(Order.id)))
-        horizon = datetime.utcnow() - timedelta(days=7)
-        last_week = await session.scalar(
-            select(func.count(Order.id)).where(Order.created_at >= horizon)
-        )
-        active_users = await session.scalar(select(func.count(func.distinct(Order.user_id))))
-        status_rows = await session.execute(select(Order.status, func.count(Order.id)).group_by(Order.status))
-        brand_rows = await session.execute(
-            select(Order.brand, func.count(Order.id))
-            .where(Order.brand.isnot(None))
-            .group_by(Order.brand)
-            .order_by(func.count(Order.id).desc())
-            .limit(3)
-        )
-    status_counts = {row[0]: row[1] for row in status_rows}
+    stats = await get_stats_snapshot()
     lines = [
         "📊 Базовая аналитика",
-        f"Всего заявок: {total or 0}",
-        f"За последние 7 дней: {last_week or 0}",
-        f"Уникальных пользователей: {active_users or 0}",
+        f"Всего заявок: {stats.total}",
+        f"За последние 7 дней: {stats.last_week}",
+        f"Уникальных пользователей: {stats.users}",
         "",
         "По статусам:",
     ]
     for status in STATUS_LIST:
-        cnt = status_counts.get(status)
+        cnt = stats.by_status.get(status)
         if cnt:
             lines.append(f"• {status}: {cnt}")
-    top_brands = [row[0] for row in brand_rows if row[0]]
+    top_brands = stats.top_brands
     if top_brands:
         lines.append("")
         lines.append("Популярные бренды: " + ", ".join(top_brands))
@@ -974,30 +837,32 @@ async def deliver_admin_question(order_id: int, admin_id: int, text: str) -> boo
     order = await get_order_by_id(order_id)
     if not order:
         return False
+    order_number = await get_order_display_number(order)
     session_factory = get_session_factory()
     async with session_factory() as session:
         user_row = await session.get(User, order.user_id)
         if user_row and user_row.is_blocked:
             return False
-    order_number = await get_order_display_number(order)
-    tg_bot = get_bot()
-    try:
-        await tg_bot.send_message(chat_id=order.user_id, text=f"🔔 Вопрос по заявке #{order_number}:\n\n{text}")
-        async with session_factory() as session:
-            q = await session.execute(select(Order).where(Order.id == order_id))
-            ord_obj = q.scalars().first()
-            if not ord_obj:
-                return False
-            ord_obj.communication = (ord_obj.communication or "") + f"\n{datetime.utcnow().isoformat()} ADMIN_QUESTION: {text}"
-            ord_obj.status = STATUS_CLARIFY
-            action = AdminAction(admin_id=admin_id, action_type="question", details=f"{order_id}")
-            session.add(action)
-            await log_status_change(session, ord_obj.id, STATUS_CLARIFY, ts=ord_obj.updated_at or datetime.utcnow())
-            await session.commit()
-        return True
-    except Exception:
-        logger.exception("Не удалось отправить сообщение пользователю %s", order.user_id)
-        return False
+        q = await session.execute(select(Order).where(Order.id == order_id).with_for_update())
+        ord_obj = q.scalars().first()
+        if not ord_obj:
+            return False
+        now = datetime.utcnow()
+        await bump_order_stats(session, status_change_deltas(ord_obj.status, STATUS_CLARIFY))
+        if ord_obj.status != STATUS_CLARIFY:
+            # Интервал «Нужно уточнение» начинается сейчас, а не с прошлой правки заявки
+            await log_status_change(session, ord_obj.id, STATUS_CLARIFY, ts=now)
+        ord_obj.status = STATUS_CLARIFY
+        ord_obj.updated_at = now
+        action = AdminAction(admin_id=admin_id, action_type="question", details=f"{order_id}")
+        session.add(action)
+        record_order_event(session, ord_obj.id, EVENT_ADMIN_QUESTION, actor_id=admin_id, payload=text, ts=now)
+        # Вопрос уходит пользователю через outbox только после фиксации смены статуса
+        enqueue_notification(session, ord_obj.user_id, f"🔔 Вопрос по заявке #{order_number}:\n\n{text}")
+        await session.commit()
+        get_database().mark_user_write(ord_obj.user_id)
+    wake_outbox_relay()
+    return True
 
 
 async def start_admin_question_flow(user_id: int, state: FSMContext) -> None:
@@ -1012,7 +877,7 @@ async def start_admin_question_flow(user_id: int, state: FSMContext) -> None:
     tg_bot = get_bot()
     sent = await tg_bot.send_message(
         chat_id=user_id,
-        text="Введите ID заявки (номер из таблицы), по которой хотите задать вопрос:",
+        text="Введите ID заявки (номер из таблицы) или её номер вида 123456-7, по которой хотите задать вопрос:",
         reply_markup=compact_inline_cancel_back(prev=None, skip=False),
     )
     await state.update_data(question_prompt_msg_id=sent.message_id)
@@ -1070,7 +935,7 @@ async def show_macros_menu(user_id: int, notice: Optional[str] = None) -> None:
     )
 
 
-async def show_macro_detail(user_id: int, macro: MacroTemplate) -> None:
+async def show_macro_detail(user_id: int, macro: Macro) -> None:
     text = f"Макрос #{macro.id}\nЗаголовок: {macro.title}\n\nТекст:\n{macro.body}"
     await get_bot().send_message(
         chat_id=user_id,
@@ -1218,8 +1083,64 @@ async def cmd_digest_test(message: Message):
     await message.answer("Пробный дайджест отправлен, если есть активные заявки.")
 
 
+def build_search_results_text(query: str, result: OrderSearchPage) -> str:
+    if not result.hits:
+        return f"По запросу «{query}» ничего не найдено." if result.page == 0 else "Больше результатов нет."
+    lines = [f"Поиск: «{query}» · страница {result.page + 1}", ""]
+    for hit in result.hits:
+        lines.append(f"• #{format_order_number(hit, hit.public_id)} (ID {hit.id}) · {hit.status}")
+        lines.append(f"  {hit.product or '—'} · {hit.brand or '—'} · {hit.size or '—'}")
+        if hit.comment:
+            comment = hit.comment if len(hit.comment) <= 80 else hit.comment[:79] + "…"
+            lines.append(f"  Комментарий: {comment}")
+    return "\n".join(lines)
+
+
+async def send_search_results(user_id: int, query: str, page: int = 0) -> None:
+    # Публичный номер заявки ищем точно, по индексам; не нашли — ищем как обычный текст
+    hit = await find_order_by_number(query) if page == 0 else None
+    result = OrderSearchPage([hit], 0, False) if hit else await search_orders(query, page)
+    await get_bot().send_message(
+        chat_id=user_id,
+        text=build_search_results_text(query, result),
+        reply_markup=search_results_inline(result.page, result.has_next),
+    )
+
+
+# Команда стоит раньше обработчиков состояний, чтобы срабатывать посреди любого сценария
+@router.message(Command("find"))
+async def cmd_find(message: Message, command: CommandObject, state: FSMContext):
+    if message.from_user.id not in get_admins():
+        await message.answer("Нет доступа.")
+        return
+    query = " ".join((command.args or "").split())[:SEARCH_QUERY_MAX_LENGTH]
+    if not query:
+        await message.answer(
+            "Поиск заявок: /find <запрос>\n"
+            "Например: /find nike air max 44 — по товару, бренду, размеру и комментарию, с учётом опечаток; "
+            "/find 123456-7 — по номеру заявки."
+        )
+        return
+    await state.update_data(search_query=query)
+    await send_search_results(message.from_user.id, query)
+
+
+@callbacks.prefix("search:page:")
+async def cb_search_page(cb: CallbackQuery, state: FSMContext, payload: str):
+    if cb.from_user.id not in get_admins():
+        await cb.answer("Нет доступа.", show_alert=True)
+        return
+    query = (await state.get_data()).get("search_query")
+    if not query or not (payload.isascii() and payload.isdigit()) or len(payload) > 6:
+        await cb.answer("Запрос устарел — повторите /find.", show_alert=True)
+        return
+    await cb.answer()
+    await delete_callback_message(cb.message)
+    await send_search_results(cb.from_user.id, query, int(payload))
+
+
 
-@router.callback_query(lambda c: c.data == "menu:create")
+@callbacks.exact("menu:create")
 async def cb_menu_create(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
     await delete_callback_message(cb.message)
@@ -1227,26 +1148,26 @@ async def cb_menu_create(cb: CallbackQuery, state: FSMContext):
 
 
 
-@router.callback_query(lambda c: c.data == "menu:info")
+@callbacks.exact("menu:info")
 async def cb_menu_info(cb: CallbackQuery):
     await cb.answer()
     await delete_callback_message(cb.message)
     await send_info_message(cb.from_user.id)
 
-@router.callback_query(lambda c: c.data == "menu:home")
+@callbacks.exact("menu:home")
 async def cb_menu_home(cb: CallbackQuery):
     await cb.answer()
     await delete_callback_message(cb.message)
     await send_main_menu(cb.from_user.id)
 
 
-@router.callback_query(lambda c: c.data == "menu:orders")
+@callbacks.exact("menu:orders")
 async def cb_menu_orders(cb: CallbackQuery):
     await cb.answer()
     await delete_callback_message(cb.message)
     await send_user_orders_list(cb.from_user.id)
 
-@router.callback_query(lambda c: c.data == "cancel")
+@callbacks.exact("cancel")
 async def cb_cancel_create(cb: CallbackQuery, state: FSMContext):
     await cb.answer("Возвращаю в главное меню.")
     await state.clear()
@@ -1257,9 +1178,9 @@ async def cb_cancel_create(cb: CallbackQuery, state: FSMContext):
     await send_main_menu(cb.from_user.id)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("back:"))
-async def cb_back_to_stage(cb: CallbackQuery, state: FSMContext):
-    stage = cb.data.split(":", 1)[1]
+@callbacks.prefix("back:")
+async def cb_back_to_stage(cb: CallbackQuery, state: FSMContext, payload: str):
+    stage = payload
     await cb.answer()
     await delete_callback_message(cb.message)
     await state.update_data(prompt_msg_id=None)
@@ -1279,19 +1200,19 @@ async def brand_handler(message: Message, state: FSMContext):
     await prompt_stage(message.from_user.id, state, "size")
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("brand_suggest:"))
-async def cb_brand_suggest(cb: CallbackQuery, state: FSMContext):
-    value = cb.data.split(":", 1)[1]
+@callbacks.prefix("brand_suggest:")
+async def cb_brand_suggest(cb: CallbackQuery, state: FSMContext, payload: str):
+    value = payload
     await safe_answer_callback(cb)
     await delete_callback_message(cb.message)
     await state.update_data(brand=value)
     await prompt_stage(cb.from_user.id, state, "size")
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("brand_suggest_edit:"))
-async def cb_brand_suggest_edit(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("brand_suggest_edit:")
+async def cb_brand_suggest_edit(cb: CallbackQuery, state: FSMContext, payload: str):
     tg_bot = get_bot()
-    value = cb.data.split(":", 1)[1]
+    value = payload
     await safe_answer_callback(cb)
     data = await state.get_data()
     last_msg_id = data.get("last_msg_id")
@@ -1322,7 +1243,7 @@ async def price_handler(message: Message, state: FSMContext):
     await state.update_data(price="")
     await prompt_stage(message.from_user.id, state, "comment")
 
-@router.callback_query(lambda c: c.data == "skip")
+@callbacks.exact("skip")
 async def cb_skip_comment(cb: CallbackQuery, state: FSMContext):
     tg_bot = get_bot()
     await cb.answer()
@@ -1353,10 +1274,10 @@ async def comment_photo_handler(message: Message, state: FSMContext):
     comment = None
     if message.photo:
         file_info = await tg_bot.get_file(message.photo[-1].file_id)
-        local = os.path.join(PHOTOS_DIR, f"{message.from_user.id}_{message.photo[-1].file_unique_id}.jpg")
+        local = os.path.join(get_settings().photos_dir, f"{message.from_user.id}_{message.photo[-1].file_unique_id}.jpg")
         await tg_bot.download(file_info, local)
-        public_url = telegram_file_url(file_info.file_path, settings)
-        photos.append(pack_photo_entry(local, settings, public_url=public_url))
+        public_url = telegram_file_url(file_info.file_path, get_settings())
+        photos.append(pack_photo_entry(local, get_settings(), public_url=public_url))
         comment = message.caption or ""
     elif message.document:
         doc = message.document
@@ -1367,10 +1288,10 @@ async def comment_photo_handler(message: Message, state: FSMContext):
         if is_image:
             file_info = await tg_bot.get_file(doc.file_id)
             ext = os.path.splitext(doc.file_name or "")[1] or ".jpg"
-            local = os.path.join(PHOTOS_DIR, f"{message.from_user.id}_{doc.file_unique_id}{ext}")
+            local = os.path.join(get_settings().photos_dir, f"{message.from_user.id}_{doc.file_unique_id}{ext}")
             await tg_bot.download(file_info, local)
-            public_url = telegram_file_url(file_info.file_path, settings)
-            photos.append(pack_photo_entry(local, settings, public_url=public_url))
+            public_url = telegram_file_url(file_info.file_path, get_settings())
+            photos.append(pack_photo_entry(local, get_settings(), public_url=public_url))
             comment = message.caption or message.text or ""
     else:
         if message.text and message.text.strip().lower() != "пропустить":
@@ -1392,10 +1313,10 @@ async def comment_photo_handler(message: Message, state: FSMContext):
     await state.update_data(last_msg_id=sent.message_id)
     await state.set_state(OrderStates.confirm)
 
-@router.callback_query(lambda c: c.data and c.data.startswith("confirm:"))
-async def cb_confirm(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("confirm:")
+async def cb_confirm(cb: CallbackQuery, state: FSMContext, payload: str):
     tg_bot = get_bot()
-    action = cb.data.split(":", 1)[1]
+    action = payload
     data = await state.get_data()
     if action == "yes":
         edit_id = data.get("edit_order_id")
@@ -1410,12 +1331,12 @@ async def cb_confirm(cb: CallbackQuery, state: FSMContext):
             if not updated:
                 await cb.answer("Не удалось обновить заявку.", show_alert=True)
                 return
-            await persist_order_photos(edit_id, parse_photo_entries(data.get("photos"), settings))
+            await persist_order_photos(edit_id, parse_photo_entries(data.get("photos"), get_settings()))
             await send_user_orders_list(cb.from_user.id)
             await cb.answer("Заявка обновлена.")
         else:
             order_id, public_order_number = await create_order_db(data, cb.from_user.id)
-            await persist_order_photos(order_id, parse_photo_entries(data.get("photos"), settings))
+            await persist_order_photos(order_id, parse_photo_entries(data.get("photos"), get_settings()))
             await tg_bot.send_message(
                 chat_id=cb.from_user.id,
                 text=(
@@ -1457,10 +1378,10 @@ async def cb_confirm(cb: CallbackQuery, state: FSMContext):
         await state.clear()
         await cb.answer()
 
-@router.callback_query(lambda c: c.data and c.data.startswith("edit_field:"))
-async def cb_edit_field(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("edit_field:")
+async def cb_edit_field(cb: CallbackQuery, state: FSMContext, payload: str):
     tg_bot = get_bot()
-    field = cb.data.split(":", 1)[1]
+    field = payload
     data = await state.get_data()
     if field == "back":
         # вернуть карточку заявки
@@ -1546,7 +1467,7 @@ async def process_edit_field(message: Message, state: FSMContext):
     await state.set_state(OrderStates.confirm)
 
 
-@router.callback_query(lambda c: c.data == "edit_preview")
+@callbacks.exact("edit_preview")
 async def cb_edit_preview(cb: CallbackQuery, state: FSMContext):
     tg_bot = get_bot()
     data = await state.get_data()
@@ -1556,13 +1477,6 @@ async def cb_edit_preview(cb: CallbackQuery, state: FSMContext):
             await tg_bot.delete_message(chat_id=cb.from_user.id, message_id=last_msg_id)
         except Exception:
             pass
-    session_factory = get_session_factory()
-    async with session_factory() as session:
-        existing = await session.scalar(select(func.count(MacroTemplate.id)))
-        if not existing:
-            for title, body in ADMIN_QUESTION_TEMPLATES:
-                session.add(MacroTemplate(title=title, body=body, created_by=0, updated_by=0))
-            await session.commit()
     sent = await tg_bot.send_message(
         chat_id=cb.from_user.id,
         text=(
@@ -1576,22 +1490,23 @@ async def cb_edit_preview(cb: CallbackQuery, state: FSMContext):
     await state.set_state(OrderStates.edit_field)
     await cb.answer()
 
-@router.callback_query(lambda c: c.data == "user_back")
+@callbacks.exact("user_back")
 async def cb_user_back(cb: CallbackQuery):
     await safe_answer_callback(cb)
     await delete_callback_message(cb.message)
     await send_main_menu(cb.from_user.id)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("show_order:"))
-async def cb_show_order(cb: CallbackQuery):
-    oid = int(cb.data.split(":", 1)[1])
+@callbacks.prefix("show_order:")
+async def cb_show_order(cb: CallbackQuery, payload: str):
+    oid = int(payload)
     ord_obj = await get_order_by_id(oid)
     if not ord_obj:
         await cb.answer("Заявка не найдена.", show_alert=True)
         return
     await delete_callback_message(cb.message)
     order_number = await get_order_display_number(ord_obj)
+    status_short = STATUS_SHORT.get(ord_obj.status, ord_obj.status)
     text = (
         f"📦 Заявка #{order_number}\n"
         f"Товар: {ord_obj.product or '—'}\n"
@@ -1605,10 +1520,10 @@ async def cb_show_order(cb: CallbackQuery):
     await cb.message.answer(text, reply_markup=order_actions_user_inline(ord_obj.id, allow_actions))
     await cb.answer()
 
-@router.callback_query(lambda c: c.data and c.data.startswith("user_delete:"))
-async def cb_user_delete(cb: CallbackQuery):
+@callbacks.prefix("user_delete:")
+async def cb_user_delete(cb: CallbackQuery, payload: str):
     tg_bot = get_bot()
-    oid = int(cb.data.split(":", 1)[1])
+    oid = int(payload)
     ok = await mark_deleted_by_user_db(oid, cb.from_user.id)
     if ok:
         await cb.answer("Заявка отменена.")
@@ -1624,11 +1539,11 @@ async def cb_user_delete(cb: CallbackQuery):
     else:
         await cb.answer("Не удалось отменить заявку.", show_alert=True)
 
-@router.callback_query(lambda c: c.data and c.data.startswith("user_edit:"))
-async def cb_user_edit(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("user_edit:")
+async def cb_user_edit(cb: CallbackQuery, state: FSMContext, payload: str):
     tg_bot = get_bot()
-    oid = int(cb.data.split(":", 1)[1])
-    order = await get_order_by_id(oid)
+    oid = int(payload)
+    order = await get_order_for_edit(oid)
     if not order or order.user_id != cb.from_user.id:
         await cb.answer("Не ваша заявка.", show_alert=True)
         return
@@ -1647,41 +1562,51 @@ async def cb_user_edit(cb: CallbackQuery, state: FSMContext):
     await state.set_state(OrderStates.edit_field)
     await cb.answer()
 
-@router.callback_query(lambda c: c.data and c.data.startswith("report:"))
-async def cb_send_report(cb: CallbackQuery):
+@callbacks.prefix("report:")
+async def cb_send_report(cb: CallbackQuery, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    action = cb.data.split(":", 1)[1]
+    action = payload
     if action == "back":
         await cb.answer()
         await delete_callback_message(cb.message)
         await send_main_menu(cb.from_user.id, "Вернул главное меню.")
         return
-    full_path, work_path = await generate_order_reports(TMP_DIR)
+    if action not in ("full", "work"):
+        await cb.answer("Неизвестный вариант.", show_alert=True)
+        return
+    # Выгрузку собирает фоновый воркер и сам присылает файл
+    await enqueue_job(JOB_KIND_REPORT, {"chat_id": cb.from_user.id, "variant": action})
+    await delete_callback_message(cb.message)
+    await cb.answer("Готовлю файл…")
+    await get_bot().send_message(chat_id=cb.from_user.id, text="Формирую файл, пришлю его сюда, как только он будет готов.")
+
+
+@job_handler(JOB_KIND_REPORT)
+async def job_send_report(payload: dict) -> None:
+    chat_id = payload["chat_id"]
+    full_path, work_path = await generate_order_reports(str(get_settings().tmp_dir))
     try:
-        if action == "full":
-            await cb.message.answer_document(
+        if payload.get("variant") == "full":
+            await get_bot().send_document(
+                chat_id=chat_id,
                 document=FSInputFile(full_path),
                 caption="Полный файл заявок (архив).",
             )
-        elif action == "work":
-            await cb.message.answer_document(
+        else:
+            await get_bot().send_document(
+                chat_id=chat_id,
                 document=FSInputFile(work_path),
                 caption="Рабочий файл — редактируйте статусы (выпадающий список).",
             )
-        else:
-            await cb.answer("Неизвестный вариант.", show_alert=True)
-            return
-        await delete_callback_message(cb.message)
-        await send_main_menu(cb.from_user.id, "Файл отправлен. Главное меню ниже.")
-        await cb.answer("Файл отправлен.")
+        await send_main_menu(chat_id, "Файл отправлен. Главное меню ниже.")
     finally:
         safe_remove_file(full_path)
         safe_remove_file(work_path)
 
 
-@router.callback_query(lambda c: c.data == "menu:admin_reports")
+@callbacks.exact("menu:admin_reports")
 async def cb_menu_admin_reports(cb: CallbackQuery):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1691,7 +1616,7 @@ async def cb_menu_admin_reports(cb: CallbackQuery):
     await prompt_report_choice(cb.from_user.id)
 
 
-@router.callback_query(lambda c: c.data == "menu:admin_status")
+@callbacks.exact("menu:admin_status")
 async def cb_menu_admin_status(cb: CallbackQuery, state: FSMContext):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1701,7 +1626,7 @@ async def cb_menu_admin_status(cb: CallbackQuery, state: FSMContext):
     await prompt_status_upload(cb.from_user.id, state)
 
 
-@router.callback_query(lambda c: c.data == "menu:admin_push")
+@callbacks.exact("menu:admin_push")
 async def cb_menu_admin_push(cb: CallbackQuery, state: FSMContext):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1711,7 +1636,7 @@ async def cb_menu_admin_push(cb: CallbackQuery, state: FSMContext):
     await start_push_flow(cb.from_user.id, state)
 
 
-@router.callback_query(lambda c: c.data == "menu:admin_question")
+@callbacks.exact("menu:admin_question")
 async def cb_menu_admin_question(cb: CallbackQuery, state: FSMContext):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1721,7 +1646,7 @@ async def cb_menu_admin_question(cb: CallbackQuery, state: FSMContext):
     await start_admin_question_flow(cb.from_user.id, state)
 
 
-@router.callback_query(lambda c: c.data == "settings:digest" or c.data == "menu:admin_digest")
+@callbacks.exact("settings:digest", "menu:admin_digest")
 async def cb_menu_admin_digest(cb: CallbackQuery):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1733,6 +1658,12 @@ async def cb_menu_admin_digest(cb: CallbackQuery):
         chat_id=cb.from_user.id,
         text="Запускаю внеплановый дайджест — проверяю активные заявки у всех пользователей.",
     )
+    await enqueue_job(JOB_KIND_DIGEST, {"admin_id": cb.from_user.id})
+
+
+@job_handler(JOB_KIND_DIGEST)
+async def job_manual_digest(payload: dict) -> None:
+    admin_id = payload["admin_id"]
     session_factory = get_session_factory()
     async with session_factory() as session:
         q = await session.execute(select(User).where(User.is_blocked.is_(False)))
@@ -1749,19 +1680,19 @@ async def cb_menu_admin_digest(cb: CallbackQuery):
     async with session_factory() as session:
         session.add(
             AdminAction(
-                admin_id=cb.from_user.id,
+                admin_id=admin_id,
                 action_type="digest_manual",
                 details=f"checked={checked}, sent={sent}",
             )
         )
         await session.commit()
     await send_main_menu(
-        cb.from_user.id,
+        admin_id,
         f"Готово. Проверили {checked} пользователей, отправили дайджест тем, у кого есть активные заявки ({sent} сообщений).",
     )
 
 
-@router.callback_query(lambda c: c.data == "menu:admin_settings")
+@callbacks.exact("menu:admin_settings")
 async def cb_menu_admin_settings(cb: CallbackQuery):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1772,8 +1703,8 @@ async def cb_menu_admin_settings(cb: CallbackQuery):
 
 
 async def show_kind_detail(user_id: int, kind: str, notice: Optional[str] = None) -> None:
-    keywords = await get_kind_keywords()
-    words = ", ".join(sorted(keywords.get(kind, []))) or "—"
+    dictionary = await get_kind_dictionary()
+    words = ", ".join(dictionary.keywords.get(kind, ())) or "—"
     lines = []
     if notice:
         lines.append(notice)
@@ -1784,7 +1715,7 @@ async def show_kind_detail(user_id: int, kind: str, notice: Optional[str] = None
     await get_bot().send_message(chat_id=user_id, text=text, reply_markup=kind_detail_inline(kind))
 
 
-@router.callback_query(lambda c: c.data == "settings:kinds")
+@callbacks.exact("settings:kinds")
 async def cb_settings_kinds(cb: CallbackQuery):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1798,23 +1729,23 @@ async def cb_settings_kinds(cb: CallbackQuery):
     )
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("kind:open:"))
-async def cb_kind_open(cb: CallbackQuery):
+@callbacks.prefix("kind:open:")
+async def cb_kind_open(cb: CallbackQuery, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    kind = cb.data.split(":", 2)[2]
+    kind = payload
     await cb.answer()
     await delete_callback_message(cb.message)
     await show_kind_detail(cb.from_user.id, kind)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("kind:add:"))
-async def cb_kind_add(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("kind:add:")
+async def cb_kind_add(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    kind = cb.data.split(":", 2)[2]
+    kind = payload
     await state.set_state(AdminStates.waiting_kind_keyword_add)
     await state.update_data(kind_selected=kind)
     await cb.answer()
@@ -1826,12 +1757,12 @@ async def cb_kind_add(cb: CallbackQuery, state: FSMContext):
     )
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("kind:remove:"))
-async def cb_kind_remove(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("kind:remove:")
+async def cb_kind_remove(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    kind = cb.data.split(":", 2)[2]
+    kind = payload
     await state.set_state(AdminStates.waiting_kind_keyword_remove)
     await state.update_data(kind_selected=kind)
     await cb.answer()
@@ -1876,7 +1807,7 @@ async def process_kind_keyword_remove(message: Message, state: FSMContext):
     await state.clear()
     await show_kind_detail(message.from_user.id, kind, notice="Слово удалено.")
 
-@router.callback_query(lambda c: c.data == "menu:analytics")
+@callbacks.exact("menu:analytics")
 async def cb_menu_analytics(cb: CallbackQuery):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
@@ -1886,12 +1817,12 @@ async def cb_menu_analytics(cb: CallbackQuery):
     await send_analytics_report(cb.from_user.id)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("analytics:"))
-async def cb_analytics_actions(cb: CallbackQuery):
+@callbacks.prefix("analytics:")
+async def cb_analytics_actions(cb: CallbackQuery, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    action = cb.data.split(":", 1)[1]
+    action = payload
     if action == "refresh":
         await delete_callback_message(cb.message)
         await send_analytics_report(cb.from_user.id, "Обновлённые данные:")
@@ -1912,30 +1843,56 @@ async def admin_handle_excel_upload(message: Message, state: FSMContext):
     if not message.document.file_name.endswith(".xlsx"):
         await message.answer("Файл должен иметь расширение .xlsx")
         return
-    tmp_path = os.path.join(TMP_DIR, f"upload_{message.document.file_unique_id}.xlsx")
-    file = await tg_bot.get_file(message.document.file_id)
-    await tg_bot.download(file, tmp_path)
+    # Скачивание, разбор и применение статусов выполняет фоновый воркер
+    await enqueue_job(
+        JOB_KIND_BULK_UPLOAD,
+        {
+            "admin_id": message.from_user.id,
+            "file_id": message.document.file_id,
+            "file_unique_id": message.document.file_unique_id,
+        },
+    )
+    await state.clear()
+    await message.answer("Файл принят, обрабатываю. Пришлю результат отдельным сообщением.")
 
-    errors, updates = await prepare_status_updates(tmp_path)
-    if errors:
-        await message.answer("Ошибки:\n" + "\n".join(errors))
+
+@job_handler(JOB_KIND_BULK_UPLOAD)
+async def job_bulk_upload(payload: dict) -> None:
+    tg_bot = get_bot()
+    admin_id = payload["admin_id"]
+    tmp_path = os.path.join(get_settings().tmp_dir, f"upload_{payload['file_unique_id']}.xlsx")
+    file = await tg_bot.get_file(payload["file_id"])
+    await tg_bot.download(file, tmp_path)
+    try:
+        errors, updates = await prepare_status_updates(tmp_path)
+    finally:
         safe_remove_file(tmp_path)
-        await state.clear()
+    if errors:
+        await tg_bot.send_message(chat_id=admin_id, text="Ошибки:\n" + "\n".join(errors))
         return
+    updated = await apply_bulk_status_updates(admin_id, updates)
+    await tg_bot.send_message(chat_id=admin_id, text=f"Обновлено: {updated}", reply_markup=main_kb(admin_id))
+
 
+async def apply_bulk_status_updates(admin_id: int, updates: dict) -> int:
     session_factory = get_session_factory()
     notify = defaultdict(list)
+    touched_users: Set[int] = set()
+    stat_deltas: Counter = Counter()
     updated = 0
     async with session_factory() as session:
         for oid, payload in updates.items():
-            q = await session.execute(select(Order).where(Order.id == oid))
+            q = await session.execute(select(Order).where(Order.id == oid).with_for_update())
             ord_obj = q.scalars().first()
             if not ord_obj:
                 continue
             new_status = payload["status"]
             link = payload.get("product_link", "")
+            now = datetime.utcnow()
             changed = False
             if new_status != ord_obj.status:
+                stat_deltas.update(status_change_deltas(ord_obj.status, new_status))
+                await log_status_change(session, ord_obj.id, new_status, ts=now)
                 ord_obj.status = new_status
                 changed = True
             if link and link != (ord_obj.product_link or ""):
@@ -1943,13 +1900,14 @@ async def admin_handle_excel_upload(message: Message, state: FSMContext):
                 changed = True
             if not changed:
                 continue
-            await ensure_order_numbers(session, [ord_obj], ord_obj.user_id)
-            user = await session.get(User, ord_obj.user_id)
-            public_id = await ensure_user_public_id(session, user) if user else None
+            public_id = await session.scalar(select(User.public_id).where(User.id == ord_obj.user_id))
             order_number = format_order_number(ord_obj, public_id)
-            ord_obj.communication = (ord_obj.communication or "") + f"\n{datetime.utcnow().isoformat()} ADMIN_UPDATE: {new_status}"
-            ord_obj.updated_at = datetime.utcnow()
+            ord_obj.updated_at = now
+            record_order_event(
+                session, ord_obj.id, EVENT_ADMIN_UPDATE, actor_id=admin_id, payload=new_status, ts=ord_obj.updated_at
+            )
             updated += 1
+            touched_users.add(ord_obj.user_id)
             if new_status == STATUS_ADDED:
                 notify[ord_obj.user_id].append(f"🎉 Заявка #{order_number}: товар найден. Ссылка: {link or '—'}")
             elif new_status == STATUS_NOT_ADDED:
@@ -1958,28 +1916,23 @@ async def admin_handle_excel_upload(message: Message, state: FSMContext):
                 notify[ord_obj.user_id].append(f"🔍 Заявка #{order_number}: требуется уточнение.")
             elif new_status == STATUS_ANSWER_RECEIVED:
                 notify[ord_obj.user_id].append(f"✅ Заявка #{order_number}: получили ваш ответ.")
-        await session.commit()
-
-    blocked_ids: Set[int] = set()
-    if notify:
-        async with session_factory() as session_check:
-            q_blocked = await session_check.execute(
+        blocked_ids: Set[int] = set()
+        if notify:
+            q_blocked = await session.execute(
                 select(User.id).where(User.id.in_(list(notify.keys())), User.is_blocked.is_(True))
             )
             blocked_ids = {row[0] for row in q_blocked.all()}
-
-    for uid, msgs in notify.items():
-        if uid in blocked_ids:
-            continue
-        text = "Обновления по вашим заявкам:\n\n" + "\n".join(msgs)
-        try:
-            await tg_bot.send_message(chat_id=int(uid), text=text)
-        except Exception:
-            logger.exception("Не удалось уведомить пользователя %s", uid)
-
-    await message.answer(f"Обновлено: {updated}", reply_markup=main_kb(message.from_user.id))
-    safe_remove_file(tmp_path)
-    await state.clear()
+        for uid, msgs in notify.items():
+            if uid in blocked_ids:
+                continue
+            enqueue_notification(session, int(uid), "Обновления по вашим заявкам:\n\n" + "\n".join(msgs))
+        await bump_order_stats(session, stat_deltas)
+        await session.commit()
+    for uid in touched_users:
+        get_database().mark_user_write(uid)
+    if notify:
+        wake_outbox_relay()
+    return updated
 
 @router.message(AdminStates.waiting_push_ids)
 async def admin_receive_push_ids(message: Message, state: FSMContext):
@@ -2016,10 +1969,10 @@ async def admin_send_push_text(message: Message, state: FSMContext):
     await state.set_state(AdminStates.waiting_push_confirm)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("push_confirm:"))
-async def cb_push_confirm(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("push_confirm:")
+async def cb_push_confirm(cb: CallbackQuery, state: FSMContext, payload: str):
     tg_bot = get_bot()
-    action = cb.data.split(":", 1)[1]
+    action = payload
     data = await state.get_data()
     preview_id = data.get("push_preview_msg_id")
     if preview_id:
@@ -2028,20 +1981,13 @@ async def cb_push_confirm(cb: CallbackQuery, state: FSMContext):
         except Exception:
             pass
     if action == "send":
-        ids = data.get("push_ids", [])
-        text = data.get("push_text", "")
-        success = 0
-        fail = 0
-        for uid in ids:
-            try:
-                await tg_bot.send_message(chat_id=int(uid), text=text)
-                success += 1
-            except Exception:
-                logger.exception("Push failed for %s", uid)
-                fail += 1
-        await send_main_menu(cb.from_user.id, f"Рассылка завершена. Успех: {success}, Ошибок: {fail}")
+        await enqueue_job(
+            JOB_KIND_PUSH,
+            {"admin_id": cb.from_user.id, "ids": data.get("push_ids", []), "text": data.get("push_text", "")},
+        )
         await state.clear()
-        await safe_answer_callback(cb, text="Отправлено")
+        await tg_bot.send_message(chat_id=cb.from_user.id, text="Рассылка запущена, пришлю итог по завершении.")
+        await safe_answer_callback(cb, text="Отправляется")
     elif action == "edit":
         await state.set_state(AdminStates.waiting_push_text)
         await state.update_data(push_preview_msg_id=None)
@@ -2057,19 +2003,45 @@ async def cb_push_confirm(cb: CallbackQuery, state: FSMContext):
         await safe_answer_callback(cb, text="Отменено")
 
 
+@job_handler(JOB_KIND_PUSH)
+async def job_push(payload: dict) -> None:
+    tg_bot = get_bot()
+    ids = payload.get("ids", [])
+    # Повторная попытка (после падения воркера) продолжает с сохранённого получателя, а не шлёт всем заново;
+    # повторно может уйти не больше PUSH_PROGRESS_EVERY сообщений
+    done = payload.get("done", 0)
+    success = payload.get("success", 0)
+    fail = payload.get("fail", 0)
+    for uid in ids[done:]:
+        try:
+            await tg_bot.send_message(chat_id=int(uid), text=payload.get("text", ""))
+            success += 1
+        except Exception:
+            logger.exception("Push failed for %s", uid)
+            fail += 1
+        done += 1
+        if done % PUSH_PROGRESS_EVERY == 0 or done == len(ids):
+            await save_job_progress({**payload, "done": done, "success": success, "fail": fail})
+    await send_main_menu(payload["admin_id"], f"Рассылка завершена. Успех: {success}, Ошибок: {fail}")
+
+
 @router.message(AdminStates.waiting_order_id)
 async def admin_receive_order_id(message: Message, state: FSMContext):
     data = await state.get_data()
     prompt_id = data.get("question_prompt_msg_id")
-    try:
-        oid = int(message.text.strip())
-    except Exception:
-        await message.answer("ID должен быть числом.")
+    raw = (message.text or "").strip()
+    if raw.isascii() and raw.isdigit():
+        order = await get_order_by_id(int(raw)) if int(raw) <= PG_INT_MAX else None
+    elif ORDER_NUMBER_RE.match(raw):
+        hit = await find_order_by_number(raw)
+        order = await get_order_by_id(hit.id) if hit else None
+    else:
+        await message.answer("Введите ID заявки числом или её номер вида 123456-7.")
         return
-    order = await get_order_by_id(oid)
     if not order:
         await message.answer("Заявка не найдена. Попробуйте ввести другой номер.")
         return
+    oid = order.id
     order_number = await get_order_display_number(order)
     if prompt_id:
         try:
@@ -2107,12 +2079,12 @@ async def admin_send_question(message: Message, state: FSMContext):
     await state.clear()
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("question_template:"))
-async def cb_question_template(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("question_template:")
+async def cb_question_template(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    action = cb.data.split(":", 1)[1]
+    action = payload
     if action == "custom":
         await safe_answer_callback(cb, text="Введите свой вопрос текстом.")
         return
@@ -2156,13 +2128,13 @@ async def cb_question_template(cb: CallbackQuery, state: FSMContext):
         await safe_answer_callback(cb, text="Отправлено")
     else:
         await safe_answer_callback(cb, text="Ошибка")
-@router.callback_query(lambda c: c.data and c.data.startswith("settings:"))
-async def cb_settings(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("settings:")
+async def cb_settings(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
     tg_bot = get_bot()
-    action = cb.data.split(":", 1)[1]
+    action = payload
     if action == "admins":
         await delete_callback_message(cb.message)
         await show_admins_overview(cb.from_user.id)
@@ -2210,12 +2182,12 @@ async def cb_settings(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("block:"))
-async def cb_block_actions(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("block:")
+async def cb_block_actions(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    action = cb.data.split(":", 1)[1]
+    action = payload
     if action == "add":
         await state.set_state(AdminStates.waiting_block_user_id)
         await delete_callback_message(cb.message)
@@ -2251,13 +2223,12 @@ async def cb_block_actions(cb: CallbackQuery, state: FSMContext):
         await cb.answer("Неизвестное действие.", show_alert=True)
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("macro:"))
-async def cb_macro_actions(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("macro:")
+async def cb_macro_actions(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    parts = cb.data.split(":")
-    action = parts[1] if len(parts) > 1 else ""
+    action, _, macro_ref = payload.partition(":")
     tg_bot = get_bot()
     if action == "create":
         await state.clear()
@@ -2276,11 +2247,11 @@ async def cb_macro_actions(cb: CallbackQuery, state: FSMContext):
             reply_markup=macro_input_inline(),
         )
     elif action == "edit":
-        if len(parts) < 3:
+        if not macro_ref:
             await cb.answer("Не указан ID макроса.", show_alert=True)
             return
         try:
-            macro_id = int(parts[2])
+            macro_id = int(macro_ref)
         except ValueError:
             await cb.answer("Некорректный ID макроса.", show_alert=True)
             return
@@ -2305,11 +2276,11 @@ async def cb_macro_actions(cb: CallbackQuery, state: FSMContext):
             reply_markup=macro_input_inline(),
         )
     elif action == "open":
-        if len(parts) < 3:
+        if not macro_ref:
             await cb.answer("Не указан ID макроса.", show_alert=True)
             return
         try:
-            macro_id = int(parts[2])
+            macro_id = int(macro_ref)
         except ValueError:
             await cb.answer("Некорректный ID макроса.", show_alert=True)
             return
@@ -2330,11 +2301,11 @@ async def cb_macro_actions(cb: CallbackQuery, state: FSMContext):
         await delete_callback_message(cb.message)
         await show_macros_menu(cb.from_user.id)
     elif action == "delete":
-        if len(parts) < 3:
+        if not macro_ref:
             await cb.answer("Не указан ID макроса.", show_alert=True)
             return
         try:
-            macro_id = int(parts[2])
+            macro_id = int(macro_ref)
         except ValueError:
             await cb.answer("Некорректный ID макроса.", show_alert=True)
             return
@@ -2358,12 +2329,12 @@ async def cb_macro_actions(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("macro_input:"))
-async def cb_macro_input(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("macro_input:")
+async def cb_macro_input(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    target = cb.data.split(":", 1)[1]
+    target = payload
     await clear_macro_preview(cb.from_user.id, state)
     await delete_callback_message(cb.message)
     if target == "list":
@@ -2375,12 +2346,12 @@ async def cb_macro_input(cb: CallbackQuery, state: FSMContext):
     await cb.answer()
 
 
-@router.callback_query(lambda c: c.data and c.data.startswith("macro_confirm:"))
-async def cb_macro_confirm(cb: CallbackQuery, state: FSMContext):
+@callbacks.prefix("macro_confirm:")
+async def cb_macro_confirm(cb: CallbackQuery, state: FSMContext, payload: str):
     if cb.from_user.id not in get_admins():
         await cb.answer("Нет доступа.", show_alert=True)
         return
-    action = cb.data.split(":", 1)[1]
+    action = payload
     data = await state.get_data()
     tg_bot = get_bot()
     if action == "save":
@@ -2544,7 +2515,7 @@ async def process_block_user(message: Message, state: FSMContext):
     async with session_factory() as session:
         user = await session.get(User, target_id)
         if not user:
-            public_id = await generate_unique_user_public_id(session)
+            public_id = await allocate_user_public_id(session)
             user = User(id=target_id, username=None, full_name=None, is_admin=False, public_id=public_id)
             session.add(user)
         else:
@@ -2621,9 +2592,9 @@ async def catch_user_answers(message: Message, state: FSMContext):
         reply_markup=main_kb(message.from_user.id),
     )
 
-@router.callback_query(lambda c: c.data and c.data.startswith("answer_confirm:"))
-async def cb_answer_confirm(cb: CallbackQuery, state: FSMContext):
-    oid = int(cb.data.split(":", 1)[1])
+@callbacks.prefix("answer_confirm:")
+async def cb_answer_confirm(cb: CallbackQuery, state: FSMContext, payload: str):
+    oid = int(payload)
     data = await state.get_data()
     if data.get("answer_order_id") != oid:
         await cb.answer("Нет черновика ответа для этой заявки.", show_alert=True)
@@ -2635,15 +2606,13 @@ async def cb_answer_confirm(cb: CallbackQuery, state: FSMContext):
     order = await get_order_by_id(oid)
     order_number = format_order_number(order, await get_user_public_id(order.user_id)) if order else oid
     await append_user_comment_db(oid, cb.from_user.id, txt)
-    await update_order_status_db(oid, STATUS_ANSWER_RECEIVED)
-    for a in get_admins():
-        try:
-            await get_bot().send_message(
-                chat_id=a,
-                text=f"Ответ от пользователя {cb.from_user.id} по заявке #{order_number}:\n\n{txt}",
-            )
-        except Exception:
-            logger.exception("Не удалось отправить администратору")
+    admin_note = f"Ответ от пользователя {cb.from_user.id} по заявке #{order_number}:\n\n{txt}"
+    await update_order_status_db(
+        oid,
+        STATUS_ANSWER_RECEIVED,
+        notifications=[(a, admin_note) for a in get_admins()],
+        actor_id=cb.from_user.id,
+    )
     await state.clear()
     preview_id = data.get("answer_preview_msg_id")
     if preview_id:
@@ -2654,9 +2623,9 @@ async def cb_answer_confirm(cb: CallbackQuery, state: FSMContext):
     await safe_answer_callback(cb)
     await send_main_menu(cb.from_user.id, "Ответ отправлен администратору.\n\n" + MAIN_MENU_TEXT)
 
-@router.callback_query(lambda c: c.data and c.data.startswith("answer_edit_back:"))
-async def cb_answer_edit_back(cb: CallbackQuery, state: FSMContext):
-    oid = int(cb.data.split(":", 1)[1])
+@callbacks.prefix("answer_edit_back:")
+async def cb_answer_edit_back(cb: CallbackQuery, state: FSMContext, payload: str):
+    oid = int(payload)
     data = await state.get_data()
     draft = data.get("answer_draft") or "—"
     preview_id = data.get("answer_preview_msg_id")
@@ -2668,9 +2637,9 @@ async def cb_answer_edit_back(cb: CallbackQuery, state: FSMContext):
     await safe_answer_callback(cb)
     await send_answer_preview(cb.from_user.id, oid, draft, state)
 
-@router.callback_query(lambda c: c.data and c.data.startswith("answer_edit:"))
-async def cb_answer_edit(cb: CallbackQuery, state: FSMContext):
-    oid = int(cb.data.split(":", 1)[1])
+@callbacks.prefix("answer_edit:")
+async def cb_answer_edit(cb: CallbackQuery, state: FSMContext, payload: str):
+    oid = int(payload)
     data = await state.get_data()
     draft = data.get("answer_draft") or "—"
     preview_id = data.get("answer_preview_msg_id")
@@ -2693,41 +2662,83 @@ async def cb_answer_edit(cb: CallbackQuery, state: FSMContext):
     )
     await state.update_data(answer_preview_msg_id=sent.message_id)
 
+# ---------------- APP ----------------
+@dataclass
+class BotApp:
+    settings: Settings
+    database: Database
+    bot: Bot
+    storage: BaseStorage
+    dp: Dispatcher
+    chat_scheduler: ChatSchedulerMiddleware
+
+
+def create_app(settings: Optional[Settings] = None) -> BotApp:
+    """Собирает бота, БД, FSM и диспетчер и регистрирует их в context; вызывается один раз на процесс."""
+    setup_logging()
+    settings = settings or load_settings()
+    database = Database(settings)
+    tg_bot = Bot(token=settings.bot_token)
+    storage = build_fsm_storage(settings, database)
+    dp = Dispatcher(storage=storage)
+    chat_scheduler = ChatSchedulerMiddleware(
+        settings.scheduler_workers, settings.scheduler_chat_queue_limit, settings.scheduler_max_pending
+    )
+    dp.update.outer_middleware(chat_scheduler)
+    dp.update.middleware(MetricsMiddleware())
+    dp.update.middleware(UserSyncMiddleware())
+    dp.update.middleware(BlockMiddleware())
+    dp.include_router(router)
+    init_context(tg_bot, database.session_factory, settings, database)
+    return BotApp(settings, database, tg_bot, storage, dp, chat_scheduler)
+
+
 # ---------------- START/STOP ----------------
-async def on_startup():
+async def on_startup(app: BotApp):
     await init_db()
     await refresh_admins_cache()
-    # первичное обновление аналитических представлений и фоновой refresh
-    try:
-        await refresh_materialized_views()
-    except Exception:
-        logger.exception("Initial refresh of materialized views failed")
-    asyncio.create_task(refresh_views_periodically(4))
-    asyncio.create_task(weekly_digest_worker())
+    await load_macros()
+    asyncio.create_task(outbox_relay_worker())
+    if hasattr(app.storage, "cleanup_worker"):
+        asyncio.create_task(app.storage.cleanup_worker())
     setup_metrics_server()
+    await enqueue_job(JOB_KIND_PHOTO_BACKFILL, dedupe_key=JOB_KIND_PHOTO_BACKFILL)
+    if app.settings.jobs_in_bot:
+        asyncio.create_task(run_job_consumers())
+    logger.info("Бот запущен. Таблицы проверены/созданы.")
+
+async def on_shutdown(app: BotApp):
+    await app.chat_scheduler.stop()
+    await app.bot.session.close()
+    await app.storage.close()
+    await app.database.dispose()
+    logger.info("Бот остановлен.")
+
+@job_handler(JOB_KIND_PHOTO_BACKFILL)
+async def job_photo_backfill(payload: dict) -> None:
     session_factory = get_session_factory()
     async with session_factory() as session:
         q = await session.execute(select(Order.id, Order.photos))
         orders = q.all()
     for oid, raw in orders:
-        await persist_order_photos(oid, parse_photo_entries(raw, settings))
-    logger.info("Бот запущен. Таблицы проверены/созданы.")
+        await persist_order_photos(oid, parse_photo_entries(raw, get_settings()))
 
-async def on_shutdown():
-    tg_bot = get_bot()
-    await tg_bot.session.close()
-    await get_database().dispose()
-    logger.info("Бот остановлен.")
 
 # ---------------- RUN ----------------
 async def main():
-    dp.include_router(router)
-    await on_startup()
+    app = create_app()
+    webhook_server = WebhookServer(app.dp, app.bot, app.settings) if app.settings.bot_mode == "webhook" else None
+    await on_startup(app)
     try:
-        logger.info("Start polling")
-        await dp.start_polling(bot)
+        if webhook_server:
+            await webhook_server.run()
+        else:
+            logger.info("Start polling")
+            # Переход с webhook обратно на polling: getUpdates не работает, пока webhook зарегистрирован
+            await app.bot.delete_webhook()
+            await app.dp.start_polling(app.bot)
     finally:
-        await on_shutdown()
+        await on_shutdown(app)
 
 if __name__ == "__main__":
     try:
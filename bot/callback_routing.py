@@ -0,0 +1,89 @@
+import inspect
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from aiogram.filters import Filter
+from aiogram.types import CallbackQuery
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+
+class _Route:
+    __slots__ = ("handler", "params", "accepts_any")
+
+    def __init__(self, handler: CallbackHandler) -> None:
+        self.handler = handler
+        signature = inspect.signature(handler)
+        self.params = frozenset(list(signature.parameters)[1:])
+        self.accepts_any = any(p.kind is inspect.Parameter.VAR_KEYWORD for p in signature.parameters.values())
+
+
+class CallbackTable:
+    """Таблица callback-обработчиков: точное совпадение или префикс до «:», поиск по словарю.
+
+    Вместо цепочки lambda-фильтров, которые aiogram проверяет по очереди, в роутере
+    регистрируется один обработчик. Он находит цель за несколько обращений к dict
+    (полная строка, затем префиксы от длинного к короткому) и передаёт ей остаток
+    после префикса в аргументе payload.
+    """
+
+    def __init__(self) -> None:
+        self._exact: Dict[str, _Route] = {}
+        self._prefix: Dict[str, _Route] = {}
+
+    def exact(self, *values: str) -> Callable[[CallbackHandler], CallbackHandler]:
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            route = _Route(handler)
+            for value in values:
+                self._exact[value] = route
+            return handler
+
+        return decorator
+
+    def prefix(self, value: str) -> Callable[[CallbackHandler], CallbackHandler]:
+        """Prefix must end with ':'; the rest of callback data becomes payload."""
+        if not value.endswith(":"):
+            raise ValueError(f"Callback prefix must end with ':': {value}")
+
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            self._prefix[value] = _Route(handler)
+            return handler
+
+        return decorator
+
+    def resolve(self, data: str) -> Optional[Tuple[_Route, str]]:
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ""
+        end = data.rfind(":")
+        while end != -1:
+            route = self._prefix.get(data[: end + 1])
+            if route is not None:
+                return route, data[end + 1:]
+            end = data.rfind(":", 0, end)
+        return None
+
+    def filter(self) -> Filter:
+        return _CallbackTableFilter(self)
+
+    async def dispatch(self, cb: CallbackQuery, callback_route: Tuple[_Route, str], **kwargs: Any) -> Any:
+        route, payload = callback_route
+        kwargs["payload"] = payload
+        if not route.accepts_any:
+            kwargs = {name: value for name, value in kwargs.items() if name in route.params}
+        return await route.handler(cb, **kwargs)
+
+
+class _CallbackTableFilter(Filter):
+    def __init__(self, table: CallbackTable) -> None:
+        self.table = table
+
+    async def __call__(self, cb: CallbackQuery) -> Union[bool, Dict[str, Any]]:
+        if not cb.data:
+            return False
+        resolved = self.table.resolve(cb.data)
+        if resolved is None:
+            return False
+        return {"callback_route": resolved}
+
+
+__all__ = ["CallbackTable"]
@@ -1,7 +1,7 @@
 import os
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Optional, Set
+from typing import List, Optional, Set
 
 from dotenv import load_dotenv
 
@@ -26,6 +26,10 @@ def _parse_admins(raw: str) -> Set[int]:
     return result or {1279907773}
 
 
+def _parse_dsn_list(raw: str) -> List[str]:
+    return [chunk.strip() for chunk in raw.split(",") if chunk.strip()]
+
+
 @dataclass
 class Settings:
     bot_token: str = field(default_factory=lambda: os.getenv("BOT_TOKEN", DEFAULT_BOT_TOKEN))
@@ -34,6 +38,53 @@ class Settings:
     tmp_dir: Path = field(default_factory=lambda: Path(os.getenv("TMP_DIR", "tmp")))
     photo_cdn_base: Optional[str] = field(default_factory=lambda: os.getenv("PHOTO_CDN_BASE"))
     admins: Set[int] = field(default_factory=set)
+    outbox_batch_size: int = field(default_factory=lambda: int(os.getenv("OUTBOX_BATCH_SIZE", "50")))
+    outbox_concurrency: int = field(default_factory=lambda: int(os.getenv("OUTBOX_CONCURRENCY", "8")))
+    outbox_poll_interval: float = field(default_factory=lambda: float(os.getenv("OUTBOX_POLL_INTERVAL", "2")))
+    # Отправленные и окончательно неудачные уведомления старше этого срока удаляются
+    outbox_retention_days: int = field(default_factory=lambda: int(os.getenv("OUTBOX_RETENTION_DAYS", "7")))
+    # Ключ перестановки public_id; пустой — используется BOT_TOKEN
+    public_id_key: str = field(default_factory=lambda: os.getenv("PUBLIC_ID_KEY", ""))
+    # Реплики для тяжёлых чтений (отчёты, аналитика, списки); пусто — всё читается с основной БД
+    database_replica_dsns: List[str] = field(
+        default_factory=lambda: _parse_dsn_list(os.getenv("DATABASE_REPLICA_DSNS", ""))
+    )
+    # Сколько секунд после записи пользователя его чтения идут на основную БД
+    replica_staleness_seconds: float = field(
+        default_factory=lambda: float(os.getenv("REPLICA_STALENESS_SECONDS", "5"))
+    )
+    # Хранилище FSM: memory (по умолчанию), postgres или redis
+    fsm_storage: str = field(default_factory=lambda: os.getenv("FSM_STORAGE", "memory").strip().lower())
+    fsm_redis_url: str = field(default_factory=lambda: os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0"))
+    fsm_state_ttl: int = field(default_factory=lambda: int(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600))))
+    fsm_cache_ttl: float = field(default_factory=lambda: float(os.getenv("FSM_CACHE_TTL", "0")))
+    # Режим получения обновлений: polling (по умолчанию) или webhook
+    bot_mode: str = field(default_factory=lambda: os.getenv("BOT_MODE", "polling").strip().lower())
+    webhook_url: Optional[str] = field(default_factory=lambda: os.getenv("WEBHOOK_URL"))
+    webhook_path: str = field(default_factory=lambda: os.getenv("WEBHOOK_PATH", "/telegram/webhook"))
+    webhook_host: str = field(default_factory=lambda: os.getenv("WEBHOOK_HOST", "0.0.0.0"))
+    webhook_port: int = field(default_factory=lambda: int(os.getenv("WEBHOOK_PORT", "8080")))
+    webhook_secret: str = field(default_factory=lambda: os.getenv("WEBHOOK_SECRET", ""))
+    webhook_queue_size: int = field(default_factory=lambda: int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")))
+    webhook_workers: int = field(default_factory=lambda: int(os.getenv("WEBHOOK_WORKERS", "16")))
+    # Планировщик обновлений: общий пул обработчиков и предел очереди одного чата
+    scheduler_workers: int = field(default_factory=lambda: int(os.getenv("SCHEDULER_WORKERS", "32")))
+    scheduler_chat_queue_limit: int = field(default_factory=lambda: int(os.getenv("SCHEDULER_CHAT_QUEUE_LIMIT", "20")))
+    # Всего обновлений в очередях чатов; сверх этого приём ждёт и нагрузка упирается в очередь webhook (503)
+    scheduler_max_pending: int = field(default_factory=lambda: int(os.getenv("SCHEDULER_MAX_PENDING", "1000")))
+    # Фоновые задачи (таблица jobs): выполняются процессом order-bot-worker
+    jobs_concurrency: int = field(default_factory=lambda: int(os.getenv("JOBS_CONCURRENCY", "2")))
+    jobs_poll_interval: float = field(default_factory=lambda: float(os.getenv("JOBS_POLL_INTERVAL", "2")))
+    jobs_stale_seconds: int = field(default_factory=lambda: int(os.getenv("JOBS_STALE_SECONDS", "300")))
+    # Выполненные и упавшие задачи старше этого срока удаляются задачей purge_jobs
+    jobs_retention_days: int = field(default_factory=lambda: int(os.getenv("JOBS_RETENTION_DAYS", "7")))
+    # Без отдельного воркера задачи выполняет сам бот (одиночная установка)
+    jobs_in_bot: bool = field(default_factory=lambda: os.getenv("JOBS_IN_BOT", "0").strip().lower() in {"1", "true", "yes"})
+    # Витрины: проверка изменений, не чаще min, не реже max, debounce — тишина после последнего изменения
+    views_check_interval: int = field(default_factory=lambda: int(os.getenv("VIEWS_CHECK_INTERVAL", "60")))
+    views_min_interval: int = field(default_factory=lambda: int(os.getenv("VIEWS_MIN_INTERVAL", "300")))
+    views_max_interval: int = field(default_factory=lambda: int(os.getenv("VIEWS_MAX_INTERVAL", "14400")))
+    views_debounce: int = field(default_factory=lambda: int(os.getenv("VIEWS_DEBOUNCE", "60")))
 
     def __post_init__(self) -> None:
         raw_admins = os.getenv("ADMINS", DEFAULT_ADMINS)
@@ -16,3 +16,9 @@ STATUS_LIST = [
     STATUS_ADDED,
     STATUS_DELETED_BY_USER,
 ]
+
+# Виды товаров; слова для их определения хранятся в kind_keywords
+KIND_VALUES = ["Одежда", "Обувь", "Инвентарь", "Аксессуары"]
+
+# Терминальные статусы: заявка закрыта и недоступна для редактирования
+FINAL_ORDER_STATUSES = {STATUS_ADDED, STATUS_NOT_ADDED, STATUS_DELETED_BY_USER}
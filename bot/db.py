@@ -1,3 +1,7 @@
+import itertools
+import time
+from typing import Dict, Optional
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
@@ -10,6 +14,44 @@ class Database:
         self.settings = settings
         self.engine = create_async_engine(settings.database_dsn, future=True, echo=False)
         self.session_factory = sessionmaker(bind=self.engine, class_=AsyncSession, expire_on_commit=False)
+        # Чтения без побочных записей: транзакция открывается как READ ONLY
+        self.read_engine = self.engine.execution_options(postgresql_readonly=True)
+        self.read_session_factory = sessionmaker(bind=self.read_engine, class_=AsyncSession, expire_on_commit=False)
+        self.replica_engines = [
+            create_async_engine(dsn, future=True, echo=False) for dsn in settings.database_replica_dsns
+        ]
+        self.replica_session_factories = [
+            sessionmaker(
+                bind=engine.execution_options(postgresql_readonly=True), class_=AsyncSession, expire_on_commit=False
+            )
+            for engine in self.replica_engines
+        ]
+        self._replica_cycle = itertools.cycle(self.replica_session_factories) if self.replica_session_factories else None
+        # user_id -> monotonic-время последней записи; реплика может ещё не догнать эти изменения
+        self._recent_writes: Dict[int, float] = {}
+
+    def read_session(self) -> AsyncSession:
+        return self.read_session_factory()
+
+    def mark_user_write(self, user_id: Optional[int]) -> None:
+        """Remember that the user's data just changed, so their next reads skip replicas."""
+        if user_id is None or self._replica_cycle is None:
+            return
+        now = time.monotonic()
+        self._recent_writes[int(user_id)] = now
+        if len(self._recent_writes) > 10000:
+            horizon = now - self.settings.replica_staleness_seconds
+            self._recent_writes = {uid: ts for uid, ts in self._recent_writes.items() if ts >= horizon}
+
+    def replica_session(self, user_id: Optional[int] = None) -> AsyncSession:
+        """Read-only session on a replica; falls back to the primary without replicas or right after the user wrote."""
+        if self._replica_cycle is None:
+            return self.read_session()
+        if user_id is not None:
+            last_write = self._recent_writes.get(int(user_id))
+            if last_write is not None and time.monotonic() - last_write < self.settings.replica_staleness_seconds:
+                return self.read_session()
+        return next(self._replica_cycle)()
 
     async def init_models(self) -> None:
         async with self.engine.begin() as conn:
@@ -17,6 +59,8 @@ class Database:
 
     async def dispose(self) -> None:
         await self.engine.dispose()
+        for engine in self.replica_engines:
+            await engine.dispose()
 
 
 __all__ = ["Database"]
@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import case, delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from .config import Settings
+from .db import Database
+from .models import FsmState
+
+logger = logging.getLogger(__name__)
+
+FSM_CLEANUP_INTERVAL_SECONDS = 3600
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class PostgresStorage(BaseStorage):
+    """FSM в таблице fsm_state: одна строка на ключ, состояние и данные вместе, просроченные строки чистятся фоном."""
+
+    def __init__(self, database: Database, ttl_seconds: int) -> None:
+        self.database = database
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def _upsert(self, key: StorageKey, **values: Any) -> None:
+        now = datetime.utcnow()
+        values["expires_at"] = now + self.ttl
+        set_ = dict(values)
+        # Просроченная строка, которую ещё не удалила чистка, не должна воскрешать вторую колонку
+        for column in ("state", "data"):
+            if column not in values:
+                set_[column] = case((FsmState.expires_at <= now, None), else_=getattr(FsmState, column))
+        stmt = pg_insert(FsmState).values(key=self.key_builder.build(key), **values)
+        stmt = stmt.on_conflict_do_update(index_elements=[FsmState.key], set_=set_)
+        async with self.database.session_factory() as session:
+            await session.execute(stmt)
+            await session.commit()
+
+    async def _load(self, key: StorageKey) -> Tuple[Optional[str], Dict[str, Any]]:
+        async with self.database.session_factory() as session:
+            row = (
+                await session.execute(
+                    select(FsmState.state, FsmState.data).where(
+                        FsmState.key == self.key_builder.build(key), FsmState.expires_at > datetime.utcnow()
+                    )
+                )
+            ).first()
+        if not row:
+            return None, {}
+        return row.state, json.loads(row.data) if row.data else {}
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._upsert(key, state=_state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._load(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._upsert(key, data=json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._load(key)
+        return data
+
+    async def cleanup_expired(self) -> int:
+        async with self.database.session_factory() as session:
+            result = await session.execute(delete(FsmState).where(FsmState.expires_at <= datetime.utcnow()))
+            await session.commit()
+        return result.rowcount or 0
+
+    async def cleanup_worker(self) -> None:
+        while True:
+            try:
+                removed = await self.cleanup_expired()
+                if removed:
+                    logger.info("Удалено %s просроченных FSM-записей", removed)
+            except Exception:
+                logger.exception("FSM cleanup failure")
+            await asyncio.sleep(FSM_CLEANUP_INTERVAL_SECONDS)
+
+    async def close(self) -> None:
+        pass
+
+
+class CachedStorage(BaseStorage):
+    """Локальный кэш поверх удалённого хранилища: чтения горячих ключей без похода в сеть, запись сквозная.
+
+    Записи других процессов кэш не видит, поэтому включать его (FSM_CACHE_TTL > 0) можно только при одной реплике бота.
+    """
+
+    def __init__(self, backend: BaseStorage, ttl_seconds: float, max_keys: int = 10000) -> None:
+        self.backend = backend
+        self.ttl = ttl_seconds
+        self.max_keys = max_keys
+        self._states: Dict[StorageKey, Tuple[float, Optional[str]]] = {}
+        self._data: Dict[StorageKey, Tuple[float, Dict[str, Any]]] = {}
+
+    def _fresh(self, entry: Optional[Tuple[float, Any]]) -> bool:
+        return entry is not None and time.monotonic() - entry[0] < self.ttl
+
+    def _remember(self, cache: Dict[StorageKey, Tuple[float, Any]], key: StorageKey, value: Any) -> None:
+        if len(cache) >= self.max_keys:
+            cache.clear()
+        cache[key] = (time.monotonic(), value)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self.backend.set_state(key, state)
+        self._remember(self._states, key, _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        entry = self._states.get(key)
+        if self._fresh(entry):
+            return entry[1]
+        state = await self.backend.get_state(key)
+        self._remember(self._states, key, state)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self.backend.set_data(key, data)
+        self._remember(self._data, key, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        entry = self._data.get(key)
+        if self._fresh(entry):
+            return dict(entry[1])
+        data = await self.backend.get_data(key)
+        self._remember(self._data, key, dict(data))
+        return dict(data)
+
+    async def cleanup_worker(self) -> None:
+        worker = getattr(self.backend, "cleanup_worker", None)
+        if worker is not None:
+            await worker()
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+
+def build_fsm_storage(settings: Settings, database: Database) -> BaseStorage:
+    """FSM_STORAGE=memory|postgres|redis; для внешних хранилищ добавляется локальный кэш."""
+    kind = settings.fsm_storage
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "postgres":
+        backend: BaseStorage = PostgresStorage(database, settings.fsm_state_ttl)
+    elif kind == "redis":
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError as exc:
+            raise RuntimeError("FSM_STORAGE=redis требует пакет redis (pip install order-bot[redis])") from exc
+        backend = RedisStorage.from_url(
+            settings.fsm_redis_url,
+            key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+            state_ttl=settings.fsm_state_ttl,
+            data_ttl=settings.fsm_state_ttl,
+        )
+    else:
+        raise ValueError(f"Unknown FSM_STORAGE: {kind}")
+    if settings.fsm_cache_ttl > 0:
+        return CachedStorage(backend, settings.fsm_cache_ttl)
+    return backend
+
+
+__all__ = ["CachedStorage", "PostgresStorage", "build_fsm_storage"]
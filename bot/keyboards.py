@@ -1,4 +1,5 @@
-﻿from typing import List, Optional, Tuple
+﻿from functools import lru_cache, wraps
+from typing import List, Optional, Tuple
 
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
@@ -7,7 +8,30 @@ from .context import get_admins
 BRAND_SUGGESTIONS = ["Nike", "Adidas", "Jordan", "Puma", "New Balance", "Reebok"]
 
 
-def main_kb(user_id: int) -> InlineKeyboardMarkup:
+# Клавиатуры без параметров (и с малым числом вариантов) строятся один раз. Модели aiogram изменяемы,
+# поэтому кэш хранит образец, а каждый вызов получает копию с новыми строками и кнопками:
+# правка клавиатуры в одном обработчике не достаётся другим пользователям.
+
+
+def cached_keyboard(builder):
+    cached = lru_cache(maxsize=None)(builder)
+
+    @wraps(builder)
+    def wrapper(*args, **kwargs) -> InlineKeyboardMarkup:
+        markup = cached(*args, **kwargs)
+        rows = [[button.model_copy() for button in row] for row in markup.inline_keyboard]
+        return markup.model_copy(update={"inline_keyboard": rows})
+
+    return wrapper
+
+
+def main_kb(user_id: int) -> InlineKeyboardMarkup:
+    """Главное меню: два готовых варианта, выбор по текущему списку админов при каждом вызове."""
+    return _main_kb_variant(user_id in get_admins())
+
+
+@cached_keyboard
+def _main_kb_variant(is_admin: bool) -> InlineKeyboardMarkup:
     buttons = [
         [
             InlineKeyboardButton(text="📝 Создать заявку", callback_data="menu:create"),
@@ -15,8 +39,7 @@ def main_kb(user_id: int) -> InlineKeyboardMarkup:
         ],
         [InlineKeyboardButton(text="ℹ️ Как это работает", callback_data="menu:info")],
     ]
-    admins = get_admins()
-    if user_id in admins:
+    if is_admin:
         buttons.append(
             [
                 InlineKeyboardButton(text="📊 Отчёты", callback_data="menu:admin_reports"),
@@ -38,6 +61,7 @@ def main_kb(user_id: int) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@cached_keyboard
 def compact_inline_cancel_back(prev: Optional[str] = None, skip: bool = False) -> InlineKeyboardMarkup:
     row: List[InlineKeyboardButton] = []
     if prev:
@@ -48,6 +72,7 @@ def compact_inline_cancel_back(prev: Optional[str] = None, skip: bool = False) -
     return InlineKeyboardMarkup(inline_keyboard=[row])
 
 
+@cached_keyboard
 def brand_prompt_keyboard() -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
     row: List[InlineKeyboardButton] = []
@@ -67,6 +92,7 @@ def brand_prompt_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@cached_keyboard
 def brand_prompt_edit_keyboard() -> InlineKeyboardMarkup:
     rows: List[List[InlineKeyboardButton]] = []
     row: List[InlineKeyboardButton] = []
@@ -86,6 +112,7 @@ def brand_prompt_edit_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@cached_keyboard
 def confirm_edit_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -98,6 +125,7 @@ def confirm_edit_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def edit_fields_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -117,6 +145,7 @@ def edit_fields_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def edit_value_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -163,6 +192,7 @@ def orders_list_inline(order_items: List[Tuple[int, str]]) -> Optional[InlineKey
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@cached_keyboard
 def admin_settings_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -186,6 +216,7 @@ def admin_settings_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def admin_admins_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -201,6 +232,7 @@ def admin_admins_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def admin_id_prompt_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -210,6 +242,7 @@ def admin_id_prompt_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def blocklist_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -225,6 +258,7 @@ def blocklist_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def block_prompt_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -262,6 +296,7 @@ def macros_list_inline(items: List[Tuple[int, str]]) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
+@cached_keyboard
 def macro_input_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -286,6 +321,7 @@ def macro_detail_inline(macro_id: int) -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def macro_confirm_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -302,6 +338,7 @@ def macro_confirm_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def report_choice_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -314,12 +351,14 @@ def report_choice_inline() -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def cancel_only_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[[InlineKeyboardButton(text="🏠 Меню", callback_data="cancel")]]
     )
 
 
+@cached_keyboard
 def push_preview_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -381,6 +420,7 @@ def kind_detail_inline(kind: str) -> InlineKeyboardMarkup:
     )
 
 
+@cached_keyboard
 def analytics_inline() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         inline_keyboard=[
@@ -388,3 +428,14 @@ def analytics_inline() -> InlineKeyboardMarkup:
             [InlineKeyboardButton(text="🏠 Главное меню", callback_data="analytics:home")],
         ]
     )
+
+
+def search_results_inline(page: int, has_next: bool) -> InlineKeyboardMarkup:
+    nav: List[InlineKeyboardButton] = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data=f"search:page:{page - 1}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data=f"search:page:{page + 1}"))
+    rows = [nav] if nav else []
+    rows.append([InlineKeyboardButton(text="🏠 Главное меню", callback_data="menu:home")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -2,7 +2,7 @@ import logging
 import os
 from typing import Optional
 
-from prometheus_client import Counter, Histogram, start_http_server
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
 
 logger = logging.getLogger(__name__)
 
@@ -11,15 +11,36 @@ ERROR_COUNTER = Counter("bot_update_errors_total", "Ошибки при обра
 PROCESSING_TIME = Histogram(
     "bot_update_processing_seconds", "Время обработки обновлений", ["event_type"]
 )
+WEBHOOK_QUEUE_DEPTH = Gauge("bot_webhook_queue_depth", "Обновления в очереди webhook")
+WEBHOOK_REJECTED = Counter("bot_webhook_rejected_total", "Отклонённые webhook-запросы", ["reason"])
+WEBHOOK_DROPPED = Counter("bot_webhook_dropped_total", "Принятые webhook-обновления, не обработанные до остановки")
+SCHEDULER_QUEUE_DEPTH = Gauge("bot_scheduler_queue_depth", "Обновления, ожидающие в очередях чатов")
+SCHEDULER_WAIT_TIME = Histogram("bot_scheduler_wait_seconds", "Ожидание обновления в очереди чата")
+SCHEDULER_DROPPED = Counter("bot_scheduler_dropped_total", "Отброшенные планировщиком обновления", ["reason"])
+VIEW_REFRESH_TIME = Histogram(
+    "bot_view_refresh_seconds", "Длительность обновления витрины", ["view"], buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900)
+)
+VIEW_REFRESH_LAST_SUCCESS = Gauge("bot_view_refresh_last_success_timestamp", "Время последнего успешного обновления витрины", ["view"])
+VIEW_REFRESH_FAILURES = Counter("bot_view_refresh_failures_total", "Неудачные обновления витрин", ["view"])
 
 _METRICS_STARTED = False
 
 
+def metrics_port() -> int:
+    return int(os.getenv("METRICS_PORT", "9000"))
+
+
 def setup_metrics_server() -> None:
     global _METRICS_STARTED
     if _METRICS_STARTED:
         return
-    port = int(os.getenv("METRICS_PORT", "9000"))
+    port = metrics_port()
     start_http_server(port)
     logger.info("Prometheus metrics server started on port %s", port)
     _METRICS_STARTED = True
+
+
+def mark_metrics_served() -> None:
+    """Метрики отдаёт webhook-сервер на своём порту — отдельный HTTP-сервер не нужен."""
+    global _METRICS_STARTED
+    _METRICS_STARTED = True
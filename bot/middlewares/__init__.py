@@ -1,3 +1,4 @@
 from .metrics import MetricsMiddleware
+from .scheduler import ChatSchedulerMiddleware
 
-__all__ = ["MetricsMiddleware"]
+__all__ = ["ChatSchedulerMiddleware", "MetricsMiddleware"]
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from ..metrics import SCHEDULER_DROPPED, SCHEDULER_QUEUE_DEPTH, SCHEDULER_WAIT_TIME
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT_SECONDS = 30
+
+
+@dataclass
+class _Job:
+    handler: Callable[[Any, dict], Awaitable[Any]]
+    event: Update
+    data: dict
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+def _callback_signature(update: Update) -> Optional[tuple]:
+    cb = update.callback_query
+    if cb is None:
+        return None
+    message_id = cb.message.message_id if cb.message else None
+    return cb.data, message_id
+
+
+class ChatSchedulerMiddleware(BaseMiddleware):
+    """Очередь обновлений перед роутером: внутри чата строго по порядку, между чатами параллельно.
+
+    Обновление ставится в очередь своего чата и сразу возвращается диспетчеру; общий пул
+    из workers задач берёт чаты, у которых есть работа и никто её сейчас не выполняет.
+    Повторное нажатие той же кнопки, пока первое ещё ждёт, склеивается с ним, а при
+    переполнении очереди чата новые обновления отбрасываются.
+
+    Всего в очередях не больше max_pending обновлений: сверх этого вызов ждёт места,
+    и нагрузка доходит до очереди webhook (503) или до polling, а не копится в памяти.
+    """
+
+    def __init__(self, workers: int, chat_queue_limit: int, max_pending: int) -> None:
+        self.workers = max(1, workers)
+        self.chat_queue_limit = max(1, chat_queue_limit)
+        self.max_pending = max(1, max_pending)
+        self._queues: Dict[int, Deque[_Job]] = {}
+        self._busy: Set[int] = set()
+        self._ready: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._in_flight: Set[int] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._pending = 0
+        self._stopping = False
+
+    def _start(self) -> None:
+        self._ready = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_pending)
+        self._idle = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict], Awaitable[Any]],
+        event: Update,
+        data: dict,
+    ) -> Any:
+        chat = data.get("event_chat") or data.get("event_from_user")
+        if chat is None:
+            return await handler(event, data)
+        if self._ready is None:
+            self._start()
+        if self._stopping:
+            self._drop_on_shutdown([event.update_id])
+            return None
+        # Ждём места до проверок: пока ждали, очередь чата могла измениться или исчезнуть
+        await self._slots.acquire()
+        chat_id = chat.id
+        queue = self._queues.setdefault(chat_id, deque())
+        signature = _callback_signature(event)
+        if signature is not None and any(_callback_signature(job.event) == signature for job in queue):
+            self._slots.release()
+            SCHEDULER_DROPPED.labels(reason="duplicate_callback").inc()
+            await self._answer_dropped(event)
+            return None
+        if len(queue) >= self.chat_queue_limit:
+            self._slots.release()
+            SCHEDULER_DROPPED.labels(reason="queue_limit").inc()
+            logger.warning("Chat %s queue is full, update %s dropped", chat_id, event.update_id)
+            await self._answer_dropped(event)
+            return None
+        queue.append(_Job(handler, event, data))
+        self._pending += 1
+        SCHEDULER_QUEUE_DEPTH.set(self._pending)
+        self._idle.clear()
+        if chat_id not in self._busy:
+            self._busy.add(chat_id)
+            self._ready.put_nowait(chat_id)
+        return None
+
+    async def _answer_dropped(self, event: Update) -> None:
+        # Кнопка не должна «крутиться», даже если нажатие отброшено
+        if event.callback_query is not None:
+            try:
+                await event.callback_query.answer()
+            except Exception:
+                pass
+
+    async def _worker(self) -> None:
+        while True:
+            chat_id = await self._ready.get()
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            self._pending -= 1
+            self._slots.release()
+            SCHEDULER_QUEUE_DEPTH.set(self._pending)
+            SCHEDULER_WAIT_TIME.observe(time.perf_counter() - job.enqueued_at)
+            self._in_flight.add(job.event.update_id)
+            try:
+                await job.handler(job.event, job.data)
+            except Exception:
+                logger.exception("Update %s failed in chat %s", job.event.update_id, chat_id)
+            finally:
+                self._in_flight.discard(job.event.update_id)
+            if queue:
+                self._ready.put_nowait(chat_id)
+            else:
+                self._busy.discard(chat_id)
+                del self._queues[chat_id]
+                if not self._busy:
+                    self._idle.set()
+
+    def _drop_on_shutdown(self, update_ids: List[int]) -> None:
+        """Обновления уже подтверждены Telegram и не придут повторно — фиксируем, какие потеряны."""
+        SCHEDULER_DROPPED.labels(reason="shutdown").inc(len(update_ids))
+        if update_ids:
+            logger.error("Chat scheduler stopped, dropped updates: %s", update_ids)
+
+    async def stop(self, timeout: float = DRAIN_TIMEOUT_SECONDS) -> None:
+        """Перестаёт принимать обновления, дорабатывает очереди не дольше timeout, остаток считает потерянным."""
+        self._stopping = True
+        if not self._tasks:
+            return
+        if self._busy:
+            try:
+                await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        # Прерванные на середине обработки тоже потеряны; после отмены воркеры уберут их из _in_flight
+        dropped = sorted(self._in_flight) + [job.event.update_id for queue in self._queues.values() for job in queue]
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues.clear()
+        self._busy.clear()
+        self._pending = 0
+        SCHEDULER_QUEUE_DEPTH.set(0)
+        self._drop_on_shutdown(dropped)
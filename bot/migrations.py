@@ -0,0 +1,418 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, List
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from .context import get_database
+from .models import Base, KindKeywordsVersion, OrderStatusInterval, PublicIdReservation
+from .services.events import migrate_communication_to_events
+from .services.jobs import JOB_KIND_RECLASSIFY_KINDS, enqueue_job
+from .services.macros import seed_macro_templates
+from .services.public_ids import backfill_user_public_ids, compute_reserved_public_ids
+from .services.search import create_search_indexes
+from .services.stats import ensure_order_stats
+from .services.views import create_materialized_views
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock: реплики бота не применяют миграции одновременно
+MIGRATIONS_LOCK_KEY = 7_204_310_044
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMP NOT NULL DEFAULT (NOW() AT TIME ZONE 'utc'),
+    duration_ms INTEGER NOT NULL
+)
+"""
+
+SYNC_ORDER_COUNTERS_SQL = """
+UPDATE users u SET order_counter = m.max_num
+FROM (
+    SELECT user_id, MAX(user_order_number) AS max_num
+    FROM orders
+    WHERE user_order_number IS NOT NULL
+    GROUP BY user_id
+) m
+WHERE m.user_id = u.id AND u.order_counter < m.max_num
+"""
+
+# Шаги 2 и 3 работают с копией определений на момент их появления, а не с текущими моделями и витринами:
+# иначе правка модели задним числом требовала бы колонок, которые на старой базе добавит только поздний шаг.
+# Витрины и индексы, появившиеся или изменённые позже, создают свои шаги.
+_FROZEN_CLOSED_STATUS_INTERVALS = """(
+    SELECT order_id, status, EXTRACT(EPOCH FROM (ended_at - started_at)) AS seconds_in_status
+    FROM order_status_intervals
+    WHERE ended_at IS NOT NULL
+) AS closed"""
+
+# (имя, запрос, колонки уникального индекса)
+FROZEN_MATERIALIZED_VIEWS_V2 = [
+    (
+        "mv_status_avg",
+        f"""
+        SELECT
+            status,
+            AVG(seconds_in_status) AS avg_seconds,
+            SUM(seconds_in_status) AS total_seconds,
+            COUNT(*) AS transitions,
+            NOW() AS refreshed_at
+        FROM {_FROZEN_CLOSED_STATUS_INTERVALS}
+        GROUP BY status
+        """,
+        "status",
+    ),
+    (
+        "mv_order_status_time",
+        f"""
+        SELECT
+            order_id,
+            status,
+            SUM(seconds_in_status) AS seconds_in_status
+        FROM {_FROZEN_CLOSED_STATUS_INTERVALS}
+        GROUP BY order_id, status
+        """,
+        "order_id, status",
+    ),
+    (
+        "mv_order_stats",
+        """
+        SELECT
+            1 AS id,
+            (SELECT COUNT(*) FROM orders) AS total_orders,
+            (SELECT COUNT(*) FROM orders WHERE status IN ('Добавлен','Не будет добавлен','Отменена пользователем')) AS closed_orders,
+            (SELECT COUNT(*) FROM orders WHERE status NOT IN ('Добавлен','Не будет добавлен','Отменена пользователем')) AS active_orders,
+            (SELECT COUNT(*) FROM orders WHERE status = 'Добавлен') AS added_orders,
+            CASE WHEN (SELECT COUNT(*) FROM orders) > 0
+                 THEN (SELECT COUNT(*) FROM orders WHERE status = 'Добавлен')::DECIMAL / (SELECT COUNT(*) FROM orders)
+                 ELSE 0 END AS conversion_added,
+            (SELECT COUNT(*) FROM users WHERE COALESCE(is_admin, FALSE) = FALSE) AS users_non_admin,
+            NOW() AS refreshed_at
+        """,
+        "id",
+    ),
+    (
+        "mv_top_brands",
+        """
+        SELECT
+            COALESCE(NULLIF(TRIM(brand), ''), '—') AS brand,
+            COUNT(*) AS cnt,
+            NOW() AS refreshed_at
+        FROM orders
+        GROUP BY 1
+        """,
+        "brand",
+    ),
+    # Версия до orders.kind: вид считался по kind_keywords на лету; шаг 9 пересоздаёт витрину
+    (
+        "mv_kind_distribution",
+        """
+        SELECT
+            COALESCE(
+                (
+                    SELECT kk.kind
+                    FROM kind_keywords kk
+                    WHERE lower(COALESCE(o.product, '')) LIKE '%' || kk.keyword || '%'
+                    LIMIT 1
+                ),
+                'Не определено'
+            ) AS kind,
+            COUNT(*) AS cnt,
+            NOW() AS refreshed_at
+        FROM orders o
+        GROUP BY 1
+        """,
+        "kind",
+    ),
+]
+
+# Вторичные индексы на момент шага 3; ix_orders_kind и ix_notification_outbox_pending добавляют шаги 9 и 15
+FROZEN_INDEXES_V3 = [
+    "CREATE INDEX IF NOT EXISTS ix_users_blocked ON users (id) WHERE is_blocked",
+    "CREATE INDEX IF NOT EXISTS ix_orders_user_created ON orders (user_id, created_at)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_orders_user_number ON orders (user_id, user_order_number)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_status ON orders (status)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_created_at ON orders (created_at)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_updated_at ON orders (updated_at)",
+    "CREATE INDEX IF NOT EXISTS ix_orders_active_user_created ON orders (user_id, created_at) "
+    "WHERE status NOT IN ('Добавлен', 'Не будет добавлен', 'Отменена пользователем')",
+    "CREATE INDEX IF NOT EXISTS ix_order_photos_order_id ON order_photos (order_id)",
+    "CREATE INDEX IF NOT EXISTS ix_order_status_logs_order_ts ON order_status_logs (order_id, ts)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_order_status_intervals_open ON order_status_intervals (order_id) "
+    "WHERE ended_at IS NULL",
+    "CREATE INDEX IF NOT EXISTS ix_order_status_intervals_order ON order_status_intervals (order_id, started_at)",
+    "CREATE INDEX IF NOT EXISTS ix_order_events_order_ts ON order_events (order_id, ts)",
+    "CREATE INDEX IF NOT EXISTS ix_fsm_state_expires_at ON fsm_state (expires_at)",
+    "CREATE INDEX IF NOT EXISTS ix_jobs_pending ON jobs (available_at, id) WHERE status = 'pending'",
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_jobs_dedupe_active ON jobs (dedupe_key) "
+    "WHERE status IN ('pending', 'running') AND dedupe_key IS NOT NULL",
+]
+
+
+@asynccontextmanager
+async def step_session(conn: AsyncConnection) -> AsyncIterator[AsyncSession]:
+    """ORM-сессия внутри транзакции шага: её commit() фиксирует только точку сохранения."""
+    async with AsyncSession(bind=conn, join_transaction_mode="create_savepoint", expire_on_commit=False) as session:
+        yield session
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    # Выполняется в транзакции conn; сервисам с ORM-сессиями шаг передаёт step_session(conn)
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+    # False — conn в режиме AUTOCOMMIT (CREATE INDEX CONCURRENTLY); такой шаг обязан быть идемпотентным
+    transactional: bool = True
+
+
+async def create_base_schema(conn: AsyncConnection) -> None:
+    """Схема, которую раньше init_db накатывал на каждом старте; на существующей базе ничего не ломает."""
+    await conn.run_sync(Base.metadata.create_all)
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS public_id VARCHAR(32) UNIQUE"))
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS is_blocked BOOLEAN DEFAULT FALSE"))
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS block_reason TEXT"))
+    await conn.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS user_order_number INTEGER"))
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS last_status_digest_at TIMESTAMP"))
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS order_counter INTEGER NOT NULL DEFAULT 0"))
+
+
+async def create_views(conn: AsyncConnection) -> None:
+    await conn.execute(text("""
+    CREATE OR REPLACE VIEW view_orders_count_status AS
+    SELECT status, COUNT(*) AS cnt FROM orders GROUP BY status;
+    """))
+    # аналитические представления
+    await conn.execute(text("""
+    CREATE OR REPLACE VIEW v_order_status_durations AS
+    SELECT
+        order_id,
+        status,
+        started_at AS ts,
+        ended_at AS next_ts,
+        EXTRACT(EPOCH FROM (COALESCE(ended_at, NOW()) - started_at)) AS seconds_in_status
+    FROM order_status_intervals;
+    """))
+    # Сколько активные заявки уже находятся в текущем статусе: частичный индекс по открытым интервалам
+    await conn.execute(text("""
+    CREATE OR REPLACE VIEW v_order_current_status_age AS
+    SELECT
+        order_id,
+        status,
+        started_at,
+        EXTRACT(EPOCH FROM (NOW() - started_at)) AS seconds_in_status
+    FROM order_status_intervals
+    WHERE ended_at IS NULL;
+    """))
+    for name, query, unique_columns in FROZEN_MATERIALIZED_VIEWS_V2:
+        await conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {name}"))
+        await conn.execute(text(f"CREATE MATERIALIZED VIEW {name} AS {query}"))
+        await conn.execute(text(f"CREATE UNIQUE INDEX ux_{name} ON {name} ({unique_columns})"))
+
+
+async def ensure_indexes(conn: AsyncConnection) -> None:
+    """Создаёт вторичные индексы на уже существующих таблицах (create_all их не добавляет)."""
+    has_unique_numbers = await conn.scalar(text("SELECT to_regclass('ux_orders_user_number') IS NOT NULL"))
+    if not has_unique_numbers:
+        # Дубли номеров (гонка при создании) сбрасываем — заявки перенумеруются бэкфиллом номеров
+        await conn.execute(text("""
+        UPDATE orders SET user_order_number = NULL
+        WHERE id IN (
+            SELECT id FROM (
+                SELECT id, ROW_NUMBER() OVER (
+                    PARTITION BY user_id, user_order_number ORDER BY created_at, id
+                ) AS rn
+                FROM orders
+                WHERE user_order_number IS NOT NULL
+            ) numbered
+            WHERE rn > 1
+        )
+        """))
+    for ddl in FROZEN_INDEXES_V3:
+        await conn.execute(text(ddl))
+
+
+async def backfill_order_numbers(conn: AsyncConnection) -> None:
+    """Нумерует заявки без номера и выравнивает счётчики; после этого чтения ничего не дописывают."""
+    # Заявки старых пользователей без строки в users: заводим строку, чтобы им достались номер и public_id
+    await conn.execute(text("""
+    INSERT INTO users (id, is_admin, is_blocked, first_seen, order_counter)
+    SELECT DISTINCT o.user_id, FALSE, FALSE, NOW(), 0
+    FROM orders o
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = o.user_id)
+    ON CONFLICT (id) DO NOTHING
+    """))
+    await conn.execute(text(SYNC_ORDER_COUNTERS_SQL))
+    numbered = await conn.execute(text("""
+    WITH numbered AS (
+        SELECT
+            o.id,
+            u.order_counter + ROW_NUMBER() OVER (PARTITION BY o.user_id ORDER BY o.created_at, o.id) AS num
+        FROM orders o
+        JOIN users u ON u.id = o.user_id
+        WHERE o.user_order_number IS NULL
+    )
+    UPDATE orders o SET user_order_number = n.num
+    FROM numbered n
+    WHERE o.id = n.id
+    """))
+    if numbered.rowcount:
+        await conn.execute(text(SYNC_ORDER_COUNTERS_SQL))
+        logger.info("Присвоены номера %s заявкам без user_order_number", numbered.rowcount)
+
+
+async def backfill_status_intervals(conn: AsyncConnection) -> None:
+    """Строит order_status_intervals по истории order_status_logs; дальше их ведёт log_status_change."""
+    filled = await conn.scalar(select(OrderStatusInterval.id).limit(1))
+    if filled is not None:
+        return
+    inserted = await conn.execute(text("""
+    INSERT INTO order_status_intervals (order_id, status, started_at, ended_at)
+    SELECT
+        order_id,
+        status,
+        ts,
+        LEAD(ts) OVER (PARTITION BY order_id ORDER BY ts, id)
+    FROM order_status_logs
+    """))
+    if inserted.rowcount:
+        logger.info("Построено %s интервалов статусов по журналу", inserted.rowcount)
+
+
+async def fill_order_stats(conn: AsyncConnection) -> None:
+    async with step_session(conn) as session:
+        await ensure_order_stats(session)
+
+
+async def backfill_public_ids(conn: AsyncConnection) -> None:
+    # Новые ID не должны совпасть со старыми случайными — сначала собираем занятые.
+    # Сохраняет список init_db после всех шагов: таблицы public_id_reservations здесь может ещё не быть
+    await compute_reserved_public_ids(conn)
+    async with step_session(conn) as session:
+        assigned = await backfill_user_public_ids(session)
+    if assigned:
+        logger.info("Выданы public_id %s пользователям", assigned)
+
+
+async def move_communication_to_events(conn: AsyncConnection) -> None:
+    async with step_session(conn) as session:
+        migrated = await migrate_communication_to_events(session)
+    if migrated:
+        logger.info("Перенесена история %s заявок в order_events", migrated)
+
+
+async def add_order_kind(conn: AsyncConnection) -> None:
+    await conn.execute(text("ALTER TABLE orders ADD COLUMN IF NOT EXISTS kind VARCHAR(64)"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_kind ON orders (kind)"))
+    await create_materialized_views(conn, ["mv_kind_distribution"])
+    # Существующие заявки классифицирует воркер пачками, старт бота не ждёт
+    await enqueue_job(JOB_KIND_RECLASSIFY_KINDS, dedupe_key=JOB_KIND_RECLASSIFY_KINDS, session=conn)
+
+
+async def widen_order_stats_key(conn: AsyncConnection) -> None:
+    # String(255) не вмещал бренды длиной 256 (orders.brand), и INSERT счётчика ронял запись заявки
+    await conn.execute(text("ALTER TABLE order_stats ALTER COLUMN key TYPE TEXT"))
+
+
+async def add_kind_keywords_version(conn: AsyncConnection) -> None:
+    """Версия словаря в строке таблицы: в отличие от последовательности, видна только после commit правки."""
+    await conn.run_sync(Base.metadata.create_all, tables=[KindKeywordsVersion.__table__])
+    await conn.execute(text("INSERT INTO kind_keywords_version (id, version) VALUES (1, 0) ON CONFLICT (id) DO NOTHING"))
+    await conn.execute(text("DROP SEQUENCE IF EXISTS kind_keywords_version_seq"))
+
+
+async def add_outbox_pending_index(conn: AsyncConnection) -> None:
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_notification_outbox_pending "
+        "ON notification_outbox (available_at, id) WHERE sent_at IS NULL"
+    ))
+
+
+async def add_job_heartbeat(conn: AsyncConnection) -> None:
+    await conn.execute(text("ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP"))
+
+
+async def add_public_id_reservations(conn: AsyncConnection) -> None:
+    await conn.run_sync(Base.metadata.create_all, tables=[PublicIdReservation.__table__])
+
+
+async def add_user_updated_at(conn: AsyncConnection) -> None:
+    # Водяной знак витрин по users был COUNT(*) и не замечал смену is_admin
+    await conn.execute(text("ALTER TABLE users ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP"))
+    await conn.execute(text("UPDATE users SET updated_at = COALESCE(first_seen, NOW() AT TIME ZONE 'utc') WHERE updated_at IS NULL"))
+    await conn.execute(text("ALTER TABLE users ALTER COLUMN updated_at SET NOT NULL"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_updated_at ON users (updated_at)"))
+
+
+# Только дописывать в конец: применённые версии не перезапускаются. Новая таблица —
+# шаг с create_all(tables=[...]), изменённая витрина — create_materialized_views(conn, [имя]).
+MIGRATIONS: List[Migration] = [
+    Migration(1, "base schema", create_base_schema),
+    Migration(2, "views and materialized views", create_views),
+    Migration(3, "secondary indexes", ensure_indexes),
+    Migration(4, "order numbers backfill", backfill_order_numbers),
+    Migration(5, "status intervals backfill", backfill_status_intervals),
+    Migration(6, "order stats", fill_order_stats),
+    Migration(7, "user public ids backfill", backfill_public_ids),
+    Migration(8, "communication to order_events", move_communication_to_events),
+    Migration(9, "orders.kind column", add_order_kind),
+    # 10 — последовательность версии словаря видов, заменена таблицей в шаге 14; номер не занимать
+    # Раньше шаблоны досеивались при каждом «Редактировать» в превью заявки
+    Migration(11, "default macro templates", seed_macro_templates),
+    Migration(12, "order search indexes", create_search_indexes, transactional=False),
+    Migration(13, "order_stats.key as text", widen_order_stats_key),
+    Migration(14, "kind keywords version row", add_kind_keywords_version),
+    Migration(15, "pending outbox index", add_outbox_pending_index),
+    Migration(16, "jobs.heartbeat_at", add_job_heartbeat),
+    Migration(17, "public id reservations", add_public_id_reservations),
+    Migration(18, "users.updated_at", add_user_updated_at),
+]
+
+
+async def run_migrations() -> int:
+    """Применяет ещё не применённые шаги по порядку, каждый в своей транзакции; возвращает их число.
+
+    Шаги с transactional=False выполняются в AUTOCOMMIT, версия пишется отдельной транзакцией после них.
+    Ошибка шага прерывает запуск: версия не записана, шаг повторится при следующем старте.
+    """
+    started = time.perf_counter()
+    async with get_database().engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+        await conn.commit()
+        try:
+            await conn.execute(text(SCHEMA_VERSION_DDL))
+            applied = set((await conn.execute(text("SELECT version FROM schema_version"))).scalars())
+            await conn.commit()
+            pending = [migration for migration in MIGRATIONS if migration.version not in applied]
+            for migration in pending:
+                step_started = time.perf_counter()
+                if not migration.transactional:
+                    isolation_level = await conn.get_isolation_level()
+                    await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    try:
+                        await migration.apply(conn)
+                        await conn.commit()
+                    finally:
+                        await conn.execution_options(isolation_level=isolation_level)
+                async with conn.begin():
+                    if migration.transactional:
+                        await migration.apply(conn)
+                    duration_ms = int((time.perf_counter() - step_started) * 1000)
+                    await conn.execute(
+                        text("INSERT INTO schema_version (version, name, duration_ms) VALUES (:version, :name, :ms)"),
+                        {"version": migration.version, "name": migration.name, "ms": duration_ms},
+                    )
+                logger.info("Миграция %s (%s) применена за %s мс", migration.version, migration.name, duration_ms)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            await conn.commit()
+    version = max([m.version for m in MIGRATIONS] or [0])
+    logger.info(
+        "Схема БД: версия %s, применено шагов %s за %.0f мс", version, len(pending), (time.perf_counter() - started) * 1000
+    )
+    return len(pending)
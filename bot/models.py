@@ -1,16 +1,40 @@
 from datetime import datetime
 from typing import Optional
 
-from sqlalchemy import BigInteger, Boolean, DateTime, Integer, LargeBinary, String, Text
+from sqlalchemy import BigInteger, Boolean, DateTime, Index, Integer, LargeBinary, Sequence, String, Text, text
 from sqlalchemy.orm import Mapped, declarative_base, mapped_column
 
-from .constants import STATUS_NEW
+from .constants import FINAL_ORDER_STATUSES, STATUS_NEW
 
 Base = declarative_base()
 
+_FINAL_STATUSES_SQL = ", ".join(f"'{status}'" for status in sorted(FINAL_ORDER_STATUSES))
+
+# Источник users.public_id: значение прогоняется через ключевую перестановку (services/public_ids.py)
+USER_PUBLIC_ID_SEQ = Sequence("user_public_id_seq", start=0, minvalue=0, metadata=Base.metadata)
+
+
+class PublicIdReservation(Base):
+    """Одна строка: индексы user_public_id_seq, попадающие на занятые ID, посчитанные для ключа key_hash."""
+
+    __tablename__ = "public_id_reservations"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    # sha256 ключа перестановки: при смене ключа список пересчитывается
+    key_hash: Mapped[str] = mapped_column(String(64), nullable=False)
+    # JSON-список индексов
+    indices: Mapped[str] = mapped_column(Text, nullable=False)
+    computed_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+
 
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # блок-лист и проверка блокировки смотрят только на заблокированных
+        Index("ix_users_blocked", "id", postgresql_where=text("is_blocked")),
+        # водяной знак витрин по users: MAX(updated_at)
+        Index("ix_users_updated_at", "updated_at"),
+    )
 
     # Telegram chat IDs exceed 32-bit, so we use BigInteger to avoid overflow
     id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
@@ -22,16 +46,36 @@ class User(Base):
     block_reason: Mapped[Optional[str]] = mapped_column(Text)
     first_seen: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     last_status_digest_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    # onupdate срабатывает и для ORM, и для update(User); смена is_admin тоже двигает водяной знак витрин
+    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Последний выданный user_order_number; увеличивается атомарно через UPDATE ... RETURNING
+    order_counter: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
 
 
 class Order(Base):
     __tablename__ = "orders"
+    __table_args__ = (
+        Index("ix_orders_user_created", "user_id", "created_at"),
+        Index("ux_orders_user_number", "user_id", "user_order_number", unique=True),
+        Index("ix_orders_status", "status"),
+        Index("ix_orders_created_at", "created_at"),
+        Index("ix_orders_updated_at", "updated_at"),
+        Index("ix_orders_kind", "kind"),
+        Index(
+            "ix_orders_active_user_created",
+            "user_id",
+            "created_at",
+            postgresql_where=text(f"status NOT IN ({_FINAL_STATUSES_SQL})"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
     user_order_number: Mapped[Optional[int]] = mapped_column(Integer)
     status: Mapped[str] = mapped_column(String(64), nullable=False, default=STATUS_NEW)
     product: Mapped[Optional[str]] = mapped_column(String(512))
+    # Вид по словарю kind_keywords; считается при записи заявки и задачей reclassify_kinds
+    kind: Mapped[Optional[str]] = mapped_column(String(64))
     brand: Mapped[Optional[str]] = mapped_column(String(256))
     size: Mapped[Optional[str]] = mapped_column(String(128))
     desired_price: Mapped[Optional[str]] = mapped_column(String(64))
@@ -69,6 +113,7 @@ class MacroTemplate(Base):
 
 class OrderPhoto(Base):
     __tablename__ = "order_photos"
+    __table_args__ = (Index("ix_order_photos_order_id", "order_id"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     order_id: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -81,6 +126,7 @@ class OrderPhoto(Base):
 
 class OrderStatusLog(Base):
     __tablename__ = "order_status_logs"
+    __table_args__ = (Index("ix_order_status_logs_order_ts", "order_id", "ts"),)
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     order_id: Mapped[int] = mapped_column(Integer, nullable=False)
@@ -88,9 +134,126 @@ class OrderStatusLog(Base):
     ts: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
 
 
+class OrderStatusInterval(Base):
+    """Время заявки в статусе: интервал закрывается, когда log_status_change пишет следующий статус."""
+
+    __tablename__ = "order_status_intervals"
+    __table_args__ = (
+        # У заявки ровно один открытый интервал — текущий статус
+        Index("ux_order_status_intervals_open", "order_id", unique=True, postgresql_where=text("ended_at IS NULL")),
+        Index("ix_order_status_intervals_order", "order_id", "started_at"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    status: Mapped[str] = mapped_column(String(64), nullable=False)
+    started_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+    ended_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
 class KindKeyword(Base):
     __tablename__ = "kind_keywords"
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     kind: Mapped[str] = mapped_column(String(64), nullable=False)
     keyword: Mapped[str] = mapped_column(String(128), nullable=False, unique=True)
+
+
+class KindKeywordsVersion(Base):
+    """Одна строка: версия словаря kind_keywords, растёт в транзакции каждой правки."""
+
+    __tablename__ = "kind_keywords_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, default=1)
+    version: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class NotificationOutbox(Base):
+    __tablename__ = "notification_outbox"
+    __table_args__ = (
+        # relay выбирает только неотправленные; без частичного индекса он сканировал бы всю историю
+        Index("ix_notification_outbox_pending", "available_at", "id", postgresql_where=text("sent_at IS NULL")),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    chat_id: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    text: Mapped[str] = mapped_column(Text, nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    available_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    sent_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class OrderEvent(Base):
+    __tablename__ = "order_events"
+    __table_args__ = (Index("ix_order_events_order_ts", "order_id", "ts"),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(Integer, nullable=False)
+    kind: Mapped[str] = mapped_column(String(32), nullable=False)
+    actor_id: Mapped[Optional[int]] = mapped_column(BigInteger)
+    ts: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    payload: Mapped[Optional[str]] = mapped_column(Text)
+
+
+class FsmState(Base):
+    __tablename__ = "fsm_state"
+    __table_args__ = (Index("ix_fsm_state_expires_at", "expires_at"),)
+
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(255))
+    data: Mapped[Optional[str]] = mapped_column(Text)
+    expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+
+class Job(Base):
+    __tablename__ = "jobs"
+    __table_args__ = (
+        Index("ix_jobs_pending", "available_at", "id", postgresql_where=text("status = 'pending'")),
+        # Периодические задачи: одновременно живёт только одна копия с тем же ключом
+        Index(
+            "ux_jobs_dedupe_active",
+            "dedupe_key",
+            unique=True,
+            postgresql_where=text("status IN ('pending', 'running') AND dedupe_key IS NOT NULL"),
+        ),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    kind: Mapped[str] = mapped_column(String(64), nullable=False)
+    payload: Mapped[Optional[str]] = mapped_column(Text)
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="pending", server_default="pending")
+    dedupe_key: Mapped[Optional[str]] = mapped_column(String(128))
+    attempts: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    last_error: Mapped[Optional[str]] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    available_at: Mapped[datetime] = mapped_column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    # Обновляется выполняющейся задачей раз в JOB_HEARTBEAT_SECONDS; по нему находят зависшие
+    heartbeat_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    finished_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+
+
+class OrderStat(Base):
+    """Счётчики аналитики: metric/key -> value, обновляются в транзакциях заявок."""
+
+    __tablename__ = "order_stats"
+
+    metric: Mapped[str] = mapped_column(String(16), primary_key=True)
+    # Ключ — бренд, статус или час; Text, чтобы вместить любое значение orders.brand
+    key: Mapped[str] = mapped_column(Text, primary_key=True, default="")
+    value: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+
+
+class ViewRefreshState(Base):
+    """Водяные знаки входных таблиц, по которым витрина обновлялась последний раз."""
+
+    __tablename__ = "view_refresh_state"
+
+    view: Mapped[str] = mapped_column(String(64), primary_key=True)
+    watermark: Mapped[Optional[str]] = mapped_column(Text)
+    pending_watermark: Mapped[Optional[str]] = mapped_column(Text)
+    first_change_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    last_change_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
+    refreshed_at: Mapped[Optional[datetime]] = mapped_column(DateTime)
@@ -0,0 +1,128 @@
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from sqlalchemy import bindparam, func, select
+
+from .constants import FINAL_ORDER_STATUSES
+from .models import Order
+
+# Количество фото считаем на стороне БД, чтобы не тянуть саму строку с путями
+PHOTOS_COUNT = func.coalesce(
+    func.array_length(func.string_to_array(func.nullif(Order.photos, ""), ";"), 1), 0
+).label("photos_count")
+
+
+class OrderListItem(NamedTuple):
+    """Строка списка «Мои заявки»."""
+
+    id: int
+    user_id: int
+    user_order_number: Optional[int]
+    status: str
+    product: Optional[str]
+    brand: Optional[str]
+    size: Optional[str]
+    product_link: Optional[str]
+    photos_count: int
+
+
+class OrderCard(NamedTuple):
+    """Карточка заявки и поиск заявки по ID."""
+
+    id: int
+    user_id: int
+    user_order_number: Optional[int]
+    status: str
+    product: Optional[str]
+    brand: Optional[str]
+    size: Optional[str]
+    comment: Optional[str]
+
+
+class OrderDigestItem(NamedTuple):
+    """Строка еженедельного дайджеста."""
+
+    id: int
+    user_id: int
+    user_order_number: Optional[int]
+    status: str
+    product: Optional[str]
+    brand: Optional[str]
+    size: Optional[str]
+    comment: Optional[str]
+    created_at: Optional[datetime]
+
+
+ORDER_LIST_COLUMNS = (
+    Order.id,
+    Order.user_id,
+    Order.user_order_number,
+    Order.status,
+    Order.product,
+    Order.brand,
+    Order.size,
+    Order.product_link,
+    PHOTOS_COUNT,
+)
+ORDER_CARD_COLUMNS = (
+    Order.id,
+    Order.user_id,
+    Order.user_order_number,
+    Order.status,
+    Order.product,
+    Order.brand,
+    Order.size,
+    Order.comment,
+)
+ORDER_DIGEST_COLUMNS = ORDER_CARD_COLUMNS + (Order.created_at,)
+
+# Поля, которые нужны для загрузки заявки в черновик редактирования
+ORDER_EDIT_FIELDS = (
+    Order.id,
+    Order.user_id,
+    Order.product,
+    Order.brand,
+    Order.size,
+    Order.desired_price,
+    Order.comment,
+    Order.photos,
+)
+
+# Финальные статусы уходят в SQL литералами: условие с параметрами Postgres не сопоставит
+# с предикатом частичного индекса ix_orders_active_user_created
+ORDER_IS_ACTIVE = Order.status.not_in(
+    bindparam("final_statuses", sorted(FINAL_ORDER_STATUSES), expanding=True, literal_execute=True)
+)
+
+
+def select_order_list():
+    return select(*ORDER_LIST_COLUMNS)
+
+
+def select_order_card():
+    return select(*ORDER_CARD_COLUMNS)
+
+
+def select_order_digest():
+    return select(*ORDER_DIGEST_COLUMNS)
+
+
+def select_active_orders(user_id: int):
+    return (
+        select_order_digest()
+        .where(Order.user_id == user_id, ORDER_IS_ACTIVE)
+        .order_by(Order.created_at.desc())
+    )
+
+
+__all__ = [
+    "ORDER_EDIT_FIELDS",
+    "ORDER_IS_ACTIVE",
+    "OrderCard",
+    "OrderDigestItem",
+    "OrderListItem",
+    "select_active_orders",
+    "select_order_card",
+    "select_order_digest",
+    "select_order_list",
+]
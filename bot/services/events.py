@@ -0,0 +1,216 @@
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_, select, update
+
+from ..models import Order, OrderEvent
+
+EVENT_CREATED = "created"
+EVENT_STATUS_CHANGE = "status_change"
+EVENT_ADMIN_UPDATE = "admin_update"
+EVENT_ADMIN_QUESTION = "admin_question"
+EVENT_USER_COMMENT = "user_comment"
+EVENT_USER_EDIT = "user_edit"
+EVENT_DELETED_BY_USER = "deleted_by_user"
+EVENT_LEGACY = "legacy"
+EVENT_LEGACY_INTERNAL = "legacy_internal"
+
+# События, которые раньше писались во внутренние комментарии, а не в «Общение»
+INTERNAL_EVENTS = {EVENT_DELETED_BY_USER, EVENT_LEGACY_INTERNAL}
+
+MIGRATION_BATCH_SIZE = 500
+
+_LINE_RE = re.compile(r"^(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?) (.*)$")
+_CREATED_RE = re.compile(r"^CREATED by (\d+)$")
+_USER_EDIT_RE = re.compile(r"^USER_EDIT ?(\d*)$")
+_USER_COMMENT_RE = re.compile(r"^USER\((\d+)\): (.*)$", re.S)
+_DELETED_RE = re.compile(r"^Deleted by user (\d+)$")
+
+
+def record_order_event(
+    session,
+    order_id: int,
+    kind: str,
+    actor_id: Optional[int] = None,
+    payload: Optional[str] = None,
+    ts: Optional[datetime] = None,
+) -> None:
+    """Append an event row in the caller's transaction."""
+    session.add(
+        OrderEvent(order_id=order_id, kind=kind, actor_id=actor_id, payload=payload, ts=ts or datetime.utcnow())
+    )
+
+
+def _format_event(event: OrderEvent) -> str:
+    stamp = event.ts.isoformat() if event.ts else ""
+    payload = event.payload or ""
+    if event.kind == EVENT_CREATED:
+        body = f"CREATED by {event.actor_id or ''}"
+    elif event.kind == EVENT_STATUS_CHANGE:
+        body = f"ADMIN_STATUS_CHANGE {payload}"
+    elif event.kind == EVENT_ADMIN_UPDATE:
+        body = f"ADMIN_UPDATE: {payload}"
+    elif event.kind == EVENT_ADMIN_QUESTION:
+        body = f"ADMIN_QUESTION: {payload}"
+    elif event.kind == EVENT_USER_COMMENT:
+        body = f"USER_COMMENT: {payload}"
+    elif event.kind == EVENT_USER_EDIT:
+        body = f"USER_EDIT {event.actor_id or ''}"
+    elif event.kind == EVENT_DELETED_BY_USER:
+        body = f"Deleted by user {event.actor_id or ''}"
+    else:
+        return payload
+    return f"{stamp} {body}"
+
+
+def render_communication(events: Iterable[OrderEvent]) -> str:
+    """Собирает текст «Общение» в прежнем построчном формате."""
+    return "\n".join(_format_event(e) for e in events if e.kind not in INTERNAL_EVENTS)
+
+
+def render_internal_comments(events: Iterable[OrderEvent]) -> str:
+    return "\n".join(_format_event(e) for e in events if e.kind in INTERNAL_EVENTS)
+
+
+async def load_order_events(session, order_ids: Optional[Iterable[int]] = None) -> Dict[int, List[OrderEvent]]:
+    stmt = select(OrderEvent).order_by(OrderEvent.order_id, OrderEvent.ts, OrderEvent.id)
+    if order_ids is not None:
+        stmt = stmt.where(OrderEvent.order_id.in_(list(order_ids)))
+    q = await session.execute(stmt)
+    grouped: Dict[int, List[OrderEvent]] = defaultdict(list)
+    for event in q.scalars():
+        grouped[event.order_id].append(event)
+    return grouped
+
+
+def _split_legacy_lines(raw: Optional[str]) -> List[Tuple[Optional[datetime], str]]:
+    """Split a legacy text blob into (ts, body) entries; untimed lines continue the previous entry."""
+    entries: List[Tuple[Optional[datetime], str]] = []
+    for line in (raw or "").splitlines():
+        match = _LINE_RE.match(line)
+        if match:
+            try:
+                ts = datetime.fromisoformat(match.group(1))
+            except ValueError:
+                ts = None
+            entries.append((ts, match.group(2)))
+        elif entries:
+            ts, body = entries[-1]
+            entries[-1] = (ts, f"{body}\n{line}")
+        elif line.strip():
+            entries.append((None, line))
+    return entries
+
+
+def _parse_communication_entry(body: str, order: Order) -> Tuple[str, Optional[int], Optional[str]]:
+    match = _CREATED_RE.match(body)
+    if match:
+        return EVENT_CREATED, int(match.group(1)), None
+    if body.startswith("ADMIN_STATUS_CHANGE "):
+        return EVENT_STATUS_CHANGE, None, body[len("ADMIN_STATUS_CHANGE "):]
+    if body.startswith("ADMIN_UPDATE: "):
+        return EVENT_ADMIN_UPDATE, None, body[len("ADMIN_UPDATE: "):]
+    if body.startswith("ADMIN_QUESTION: "):
+        return EVENT_ADMIN_QUESTION, None, body[len("ADMIN_QUESTION: "):]
+    if body.startswith("USER_COMMENT: "):
+        return EVENT_USER_COMMENT, order.user_id, body[len("USER_COMMENT: "):]
+    match = _USER_EDIT_RE.match(body)
+    if match:
+        return EVENT_USER_EDIT, int(match.group(1)) if match.group(1) else None, None
+    return EVENT_LEGACY, None, body
+
+
+def split_legacy_order_text(order: Order) -> List[OrderEvent]:
+    """Convert the communication/user_comments/internal_comments blobs of an order into events."""
+    events: List[OrderEvent] = []
+    fallback_ts = order.created_at or datetime.utcnow()
+    user_comments = _split_legacy_lines(order.user_comments)
+    for ts, body in _split_legacy_lines(order.communication):
+        kind, actor_id, payload = _parse_communication_entry(body, order)
+        if kind == EVENT_LEGACY:
+            payload = f"{ts.isoformat()} {body}" if ts else body
+        # Комментарии пользователя дублировались в user_comments вместе с автором — берём их оттуда
+        if kind == EVENT_USER_COMMENT and user_comments:
+            continue
+        events.append(
+            OrderEvent(order_id=order.id, kind=kind, actor_id=actor_id, payload=payload, ts=ts or fallback_ts)
+        )
+    for ts, body in user_comments:
+        match = _USER_COMMENT_RE.match(body)
+        if match:
+            actor_id, payload = int(match.group(1)), match.group(2)
+        else:
+            actor_id, payload = order.user_id, body
+        events.append(
+            OrderEvent(order_id=order.id, kind=EVENT_USER_COMMENT, actor_id=actor_id, payload=payload, ts=ts or fallback_ts)
+        )
+    for ts, body in _split_legacy_lines(order.internal_comments):
+        match = _DELETED_RE.match(body)
+        if match:
+            events.append(
+                OrderEvent(
+                    order_id=order.id,
+                    kind=EVENT_DELETED_BY_USER,
+                    actor_id=int(match.group(1)),
+                    ts=ts or fallback_ts,
+                )
+            )
+        else:
+            events.append(
+                OrderEvent(
+                    order_id=order.id,
+                    kind=EVENT_LEGACY_INTERNAL,
+                    payload=f"{ts.isoformat()} {body}" if ts else body,
+                    ts=ts or fallback_ts,
+                )
+            )
+    return events
+
+
+async def migrate_communication_to_events(session) -> int:
+    """Move legacy text blobs into order_events and clear the columns; returns migrated orders.
+
+    Runs inside the migration step's session; commit() after each batch only releases its savepoint.
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        # Only the columns the split needs: select(Order) would also read columns added by later steps
+        q = await session.execute(
+            select(
+                Order.id,
+                Order.user_id,
+                Order.created_at,
+                Order.communication,
+                Order.user_comments,
+                Order.internal_comments,
+            )
+            .where(
+                Order.id > last_id,
+                or_(
+                    Order.communication.isnot(None),
+                    Order.user_comments.isnot(None),
+                    Order.internal_comments.isnot(None),
+                ),
+            )
+            .order_by(Order.id)
+            .limit(MIGRATION_BATCH_SIZE)
+        )
+        orders = q.all()
+        if not orders:
+            return migrated
+        for order in orders:
+            session.add_all(split_legacy_order_text(order))
+        # updated_at оставляем прежним: перенос истории не является изменением заявки
+        await session.execute(
+            update(Order)
+            .where(Order.id.in_([o.id for o in orders]))
+            .values(communication=None, user_comments=None, internal_comments=None, updated_at=Order.updated_at)
+            .execution_options(synchronize_session=False)
+        )
+        await session.commit()
+        session.expunge_all()
+        migrated += len(orders)
+        last_id = orders[-1].id
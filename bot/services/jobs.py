@@ -0,0 +1,316 @@
+import asyncio
+import json
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Union
+
+from sqlalchemy import delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..context import get_session_factory, get_settings
+from ..models import Job
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+JOB_MAX_ATTEMPTS = 3
+# last_error задачи, чей воркер пропал на последней попытке
+JOB_WORKER_LOST_ERROR = "worker lost"
+JOB_RETRY_BASE_SECONDS = 30
+JOBS_MAINTENANCE_INTERVAL_SECONDS = 60
+# Выполняющаяся задача отмечается не реже; зависшей считается та, что молчит дольше JOBS_STALE_SECONDS
+JOB_HEARTBEAT_SECONDS = 30
+JOBS_PURGE_BATCH_SIZE = 10000
+
+JOB_KIND_REPORT = "report"
+JOB_KIND_BULK_UPLOAD = "bulk_upload"
+JOB_KIND_DIGEST = "digest"
+JOB_KIND_WEEKLY_DIGEST = "weekly_digest"
+JOB_KIND_PUSH = "push"
+JOB_KIND_REFRESH_VIEWS = "refresh_views"
+JOB_KIND_PHOTO_BACKFILL = "photo_backfill"
+JOB_KIND_RECONCILE_STATS = "reconcile_stats"
+JOB_KIND_RECLASSIFY_KINDS = "reclassify_kinds"
+JOB_KIND_PURGE_OUTBOX = "purge_outbox"
+JOB_KIND_PURGE_JOBS = "purge_jobs"
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+JobInterval = Union[float, Callable[[], float]]
+
+_handlers: Dict[str, JobHandler] = {}
+# kind -> интервал повторения в секундах (или функция, читающая его из настроек)
+_periodic: Dict[str, JobInterval] = {}
+# Виды, у которых dedupe_key склеивает только ждущие копии: ключ снимается при захвате задачи
+_dedupe_pending_only: Set[str] = set()
+# Задача, которую выполняет текущий asyncio-таск; по ней save_job_progress находит строку
+_current_job: ContextVar[Optional["Job"]] = ContextVar("current_job", default=None)
+
+
+def job_handler(
+    kind: str, every_seconds: Optional[JobInterval] = None, dedupe_pending_only: bool = False
+) -> Callable[[JobHandler], JobHandler]:
+    """Регистрирует обработчик задачи; воркер берёт только задачи известных ему видов.
+
+    С every_seconds задача периодическая: воркеры сами ставят следующий запуск.
+    Интервал из настроек передаётся функцией — на импорте настройки ещё не загружены.
+    С dedupe_pending_only постановка во время выполнения не теряется, а заводит следующий запуск.
+    """
+
+    def decorator(func: JobHandler) -> JobHandler:
+        _handlers[kind] = func
+        if every_seconds:
+            _periodic[kind] = every_seconds
+        if dedupe_pending_only:
+            _dedupe_pending_only.add(kind)
+        return func
+
+    return decorator
+
+
+async def enqueue_job(
+    kind: str,
+    payload: Optional[Dict[str, Any]] = None,
+    dedupe_key: Optional[str] = None,
+    delay_seconds: float = 0,
+    session=None,
+) -> bool:
+    """Ставит задачу в очередь; False — такая же (dedupe_key) уже ждёт или выполняется."""
+    stmt = pg_insert(Job).values(
+        kind=kind,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        dedupe_key=dedupe_key,
+        status=JOB_PENDING,
+        attempts=0,
+        created_at=datetime.utcnow(),
+        available_at=datetime.utcnow() + timedelta(seconds=delay_seconds),
+    )
+    if dedupe_key:
+        stmt = stmt.on_conflict_do_nothing(
+            index_elements=[Job.dedupe_key],
+            # Литерал, а не параметры: иначе Postgres не сопоставит условие с частичным индексом
+            index_where=text(f"status IN ('{JOB_PENDING}', '{JOB_RUNNING}') AND dedupe_key IS NOT NULL"),
+        )
+    stmt = stmt.returning(Job.id)
+    if session is not None:
+        return (await session.scalar(stmt)) is not None
+    session_factory = get_session_factory()
+    async with session_factory() as own_session:
+        job_id = await own_session.scalar(stmt)
+        await own_session.commit()
+    return job_id is not None
+
+
+async def _claim_job() -> Optional[Job]:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(
+            select(Job)
+            .where(
+                Job.status == JOB_PENDING,
+                Job.available_at <= datetime.utcnow(),
+                Job.kind.in_(list(_handlers)),
+            )
+            .order_by(Job.available_at, Job.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        )
+        job = q.scalars().first()
+        if not job:
+            return None
+        job.status = JOB_RUNNING
+        job.attempts += 1
+        if job.kind in _dedupe_pending_only:
+            job.dedupe_key = None
+        job.started_at = job.heartbeat_at = datetime.utcnow()
+        await session.commit()
+        return job
+
+
+def _owned(job: Job):
+    # Задачу, которую уже вернули в очередь (и, возможно, взял другой воркер), прежний исполнитель не трогает
+    return (Job.id == job.id) & (Job.status == JOB_RUNNING) & (Job.attempts == job.attempts)
+
+
+async def _heartbeat(job: Job) -> None:
+    session_factory = get_session_factory()
+    while True:
+        await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            async with session_factory() as session:
+                await session.execute(update(Job).where(_owned(job)).values(heartbeat_at=datetime.utcnow()))
+                await session.commit()
+        except Exception:
+            logger.exception("Job %s heartbeat failed", job.id)
+
+
+async def save_job_progress(payload: Dict[str, Any]) -> None:
+    """Сохраняет payload выполняющейся задачи: повторная попытка продолжит с сохранённого места."""
+    job = _current_job.get()
+    if job is None:
+        return
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        await session.execute(
+            update(Job)
+            .where(_owned(job))
+            .values(payload=json.dumps(payload, ensure_ascii=False), heartbeat_at=datetime.utcnow())
+        )
+        await session.commit()
+
+
+async def _finish_job(job: Job, error: Optional[str]) -> None:
+    now = datetime.utcnow()
+    values: Dict[str, Any] = {"finished_at": now, "last_error": error}
+    if error is None:
+        values["status"] = JOB_DONE
+    elif job.attempts >= JOB_MAX_ATTEMPTS:
+        values["status"] = JOB_FAILED
+    else:
+        values["status"] = JOB_PENDING
+        values["available_at"] = now + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** job.attempts)
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        await session.execute(update(Job).where(_owned(job)).values(**values))
+        await session.commit()
+
+
+async def run_job(job: Job) -> None:
+    handler = _handlers[job.kind]
+    heartbeat = asyncio.create_task(_heartbeat(job))
+    token = _current_job.set(job)
+    try:
+        await handler(json.loads(job.payload) if job.payload else {})
+    except Exception as exc:
+        logger.exception("Job %s (%s) failed, attempt %s", job.id, job.kind, job.attempts)
+        await _finish_job(job, str(exc) or exc.__class__.__name__)
+        return
+    finally:
+        _current_job.reset(token)
+        heartbeat.cancel()
+    await _finish_job(job, None)
+
+
+async def requeue_stale_jobs() -> int:
+    """Возвращает в очередь задачи, чей воркер перестал присылать heartbeat (умер посреди выполнения).
+
+    Задача, исчерпавшая JOB_MAX_ATTEMPTS, помечается failed: иначе задача, которая сама роняет воркер
+    (падение процесса, OOM), возвращалась бы в очередь бесконечно.
+    """
+    now = datetime.utcnow()
+    horizon = now - timedelta(seconds=get_settings().jobs_stale_seconds)
+    stale = (Job.status == JOB_RUNNING) & (func.coalesce(Job.heartbeat_at, Job.started_at) < horizon)
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        failed = await session.execute(
+            update(Job)
+            .where(stale, Job.attempts >= JOB_MAX_ATTEMPTS)
+            .values(status=JOB_FAILED, finished_at=now, last_error=JOB_WORKER_LOST_ERROR)
+            .returning(Job.id, Job.kind)
+        )
+        failed_jobs = failed.all()
+        result = await session.execute(update(Job).where(stale).values(status=JOB_PENDING, available_at=now))
+        await session.commit()
+    for job_id, kind in failed_jobs:
+        logger.error("Job %s (%s) failed: worker lost on the last attempt", job_id, kind)
+    return result.rowcount or 0
+
+
+async def _last_periodic_runs() -> Dict[str, datetime]:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(
+            select(Job.kind, func.max(Job.finished_at))
+            .where(Job.kind.in_(list(_periodic)), Job.status == JOB_DONE)
+            .group_by(Job.kind)
+        )
+        return {kind: finished for kind, finished in q.all() if finished is not None}
+
+
+async def schedule_periodic_jobs(first_run: bool = False) -> None:
+    """Ставит следующий запуск периодических задач; dedupe_key не даёт завести вторую копию.
+
+    На старте воркера задача запускается сразу, только если с её прошлого успешного запуска
+    прошёл интервал: перезапуск не гоняет все периодические задачи заново.
+    """
+    last_runs = await _last_periodic_runs() if first_run else {}
+    now = datetime.utcnow()
+    for kind, interval in _periodic.items():
+        seconds = interval() if callable(interval) else interval
+        if first_run:
+            last = last_runs.get(kind)
+            delay = max(0.0, seconds - (now - last).total_seconds()) if last else 0
+        else:
+            delay = seconds
+        await enqueue_job(kind, dedupe_key=f"periodic:{kind}", delay_seconds=delay)
+
+
+async def purge_finished_jobs() -> int:
+    """Удаляет выполненные и упавшие задачи старше JOBS_RETENTION_DAYS пачками; возвращает их число."""
+    horizon = datetime.utcnow() - timedelta(days=get_settings().jobs_retention_days)
+    session_factory = get_session_factory()
+    removed = 0
+    while True:
+        async with session_factory() as session:
+            ids = (
+                select(Job.id)
+                .where(Job.status.in_([JOB_DONE, JOB_FAILED]), Job.finished_at < horizon)
+                .limit(JOBS_PURGE_BATCH_SIZE)
+                .scalar_subquery()
+            )
+            result = await session.execute(delete(Job).where(Job.id.in_(ids)))
+            await session.commit()
+        removed += result.rowcount or 0
+        if (result.rowcount or 0) < JOBS_PURGE_BATCH_SIZE:
+            return removed
+
+
+@job_handler(JOB_KIND_PURGE_JOBS, every_seconds=6 * 3600)
+async def job_purge_jobs(payload: Dict[str, Any]) -> None:
+    removed = await purge_finished_jobs()
+    if removed:
+        logger.info("Удалено завершённых задач: %s", removed)
+
+
+async def job_consumer() -> None:
+    settings = get_settings()
+    while True:
+        try:
+            job = await _claim_job()
+        except Exception:
+            logger.exception("Job claim failure")
+            job = None
+        if job is None:
+            await asyncio.sleep(settings.jobs_poll_interval)
+            continue
+        try:
+            await run_job(job)
+        except Exception:
+            # Например, сбой БД в _finish_job: задача вернётся в очередь по heartbeat, а потребитель должен жить
+            logger.exception("Job %s (%s) run failure", job.id, job.kind)
+
+
+async def run_job_consumers() -> None:
+    """Запускает JOBS_CONCURRENCY потребителей; раз в минуту планирует периодические задачи и возвращает зависшие."""
+    settings = get_settings()
+    consumers = [asyncio.create_task(job_consumer()) for _ in range(max(1, settings.jobs_concurrency))]
+    first_run = True
+    try:
+        while True:
+            try:
+                await schedule_periodic_jobs(first_run)
+                first_run = False
+                requeued = await requeue_stale_jobs()
+                if requeued:
+                    logger.warning("Requeued %s stale jobs", requeued)
+            except Exception:
+                logger.exception("Job maintenance failure")
+            await asyncio.sleep(JOBS_MAINTENANCE_INTERVAL_SECONDS)
+    finally:
+        for task in consumers:
+            task.cancel()
+        await asyncio.gather(*consumers, return_exceptions=True)
@@ -0,0 +1,247 @@
+import logging
+import re
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+from sqlalchemy import bindparam, select, update
+
+from ..constants import KIND_VALUES
+from ..context import get_session_factory
+from ..models import KindKeyword, KindKeywordsVersion, Order
+from .jobs import JOB_KIND_RECLASSIFY_KINDS, enqueue_job
+
+logger = logging.getLogger(__name__)
+
+RECLASSIFY_BATCH_SIZE = 1000
+KIND_CACHE_CHECK_SECONDS = 30
+
+_TERMINAL = ""
+
+
+def _trie_pattern(node: Dict[str, dict]) -> str:
+    """Регулярное выражение из префиксного дерева: общий префикс проверяется один раз."""
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char != _TERMINAL]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    if _TERMINAL in node:
+        # Слово уже закончилось, но жадное «?» сначала пробует более длинное продолжение
+        return "(?:" + body + ")?"
+    return body
+
+
+class KindClassifier:
+    """Определяет вид товара по ключевым словам за один проход по тексту.
+
+    Слова собираются в префиксное дерево и компилируются в одно регулярное выражение,
+    поэтому стоимость не растёт с числом слов так, как перебор «слово in текст».
+    Если подходят несколько слов, выигрывает то, что встречается в тексте раньше,
+    а при одинаковом начале — более длинное («кеды» важнее «кед»).
+    """
+
+    def __init__(self, keywords: Mapping[str, Iterable[str]]) -> None:
+        self.kind_by_keyword: Dict[str, str] = {}
+        for kind, words in keywords.items():
+            for word in words:
+                word = word.strip().lower()
+                if word:
+                    self.kind_by_keyword.setdefault(word, kind)
+        trie: Dict[str, dict] = {}
+        for word in self.kind_by_keyword:
+            node = trie
+            for char in word:
+                node = node.setdefault(char, {})
+            node[_TERMINAL] = {}
+        pattern = _trie_pattern(trie)
+        self._regex = re.compile(pattern) if pattern else None
+
+    def classify(self, text: Optional[str]) -> str:
+        """Вид для текста или пустая строка, если ни одно слово не встретилось."""
+        if self._regex is None or not text:
+            return ""
+        match = self._regex.search(text.lower())
+        return self.kind_by_keyword[match.group()] if match else ""
+
+
+@dataclass(frozen=True)
+class KindDictionary:
+    """Снимок словаря видов; version растёт с каждой правкой словаря в любом процессе."""
+
+    version: int
+    keywords: Mapping[str, Tuple[str, ...]]
+
+    def with_change(self, version: int, kind: str, keyword: str, added: bool) -> "KindDictionary":
+        words = set(self.keywords.get(kind, ()))
+        if added:
+            words.add(keyword)
+        else:
+            words.discard(keyword)
+        keywords = dict(self.keywords)
+        keywords[kind] = tuple(sorted(words))
+        return KindDictionary(version, keywords)
+
+
+_dictionary: Optional[KindDictionary] = None
+_checked_at = 0.0
+_classifier: Optional[Tuple[int, KindClassifier]] = None
+
+
+async def _current_version(session) -> int:
+    return await session.scalar(select(KindKeywordsVersion.version).where(KindKeywordsVersion.id == 1)) or 0
+
+
+async def _load_dictionary() -> KindDictionary:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        # Версия видна только вместе с закоммиченной правкой. Читаем её до слов: правка между запросами
+        # даст словарь новее версии и лишнюю перезагрузку, но не устаревший кэш
+        version = await _current_version(session)
+        q = await session.execute(select(KindKeyword.kind, KindKeyword.keyword).order_by(KindKeyword.kind))
+        kinds: Dict[str, List[str]] = defaultdict(list)
+        for kind, kw in q.all():
+            kinds[kind].append(kw)
+    return KindDictionary(version, {kind: tuple(sorted(words)) for kind, words in kinds.items()})
+
+
+async def get_kind_dictionary(fresh: bool = False) -> KindDictionary:
+    """Словарь из памяти процесса; правки из других процессов подхватываются не позже KIND_CACHE_CHECK_SECONDS.
+
+    fresh=True сверяет версию с БД сразу — для фоновых задач, которым нужен точный словарь.
+    """
+    global _dictionary, _checked_at
+    now = time.monotonic()
+    if _dictionary is not None and (fresh or now - _checked_at >= KIND_CACHE_CHECK_SECONDS):
+        session_factory = get_session_factory()
+        async with session_factory() as session:
+            if await _current_version(session) != _dictionary.version:
+                _dictionary = None
+        _checked_at = now
+    if _dictionary is None:
+        _dictionary = await _load_dictionary()
+        _checked_at = now
+    return _dictionary
+
+
+async def get_kind_classifier(fresh: bool = False) -> KindClassifier:
+    """Классификатор для текущей версии словаря; пересобирается только при смене версии."""
+    global _classifier
+    dictionary = await get_kind_dictionary(fresh)
+    if _classifier is None or _classifier[0] != dictionary.version:
+        _classifier = (dictionary.version, KindClassifier(dictionary.keywords))
+    return _classifier[1]
+
+
+async def add_kind_keyword(kind: str, keyword: str) -> Tuple[bool, str]:
+    kind = kind.strip()
+    keyword = keyword.strip().lower()
+    if not keyword or kind not in KIND_VALUES:
+        return False, "Некорректные данные."
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        existing = await session.execute(select(KindKeyword).where(KindKeyword.keyword == keyword))
+        if existing.scalars().first():
+            return False, "Слово уже используется в другом виде."
+        session.add(KindKeyword(kind=kind, keyword=keyword))
+        version = await _bump_version(session)
+        await session.commit()
+    _write_through(version, kind, keyword, added=True)
+    return True, "Добавлено."
+
+
+async def remove_kind_keyword(kind: str, keyword: str) -> Tuple[bool, str]:
+    keyword = keyword.strip().lower()
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(select(KindKeyword).where(KindKeyword.kind == kind, KindKeyword.keyword == keyword))
+        row = q.scalars().first()
+        if not row:
+            return False, "Такое слово не найдено в этом виде."
+        await session.delete(row)
+        version = await _bump_version(session)
+        await session.commit()
+    _write_through(version, kind, keyword, added=False)
+    return True, "Удалено."
+
+
+async def _bump_version(session) -> int:
+    """Новая версия словаря и задача пересчёта orders.kind — в транзакции правки.
+
+    Блокировка строки версии выстраивает правки в очередь, поэтому версии идут подряд.
+    Версия поднимается до постановки задачи: если задача склеилась с ждущей, та при проверке
+    версии в конце прохода дождётся коммита этой правки (см. reclassify_orders).
+    """
+    version = await session.scalar(
+        update(KindKeywordsVersion)
+        .where(KindKeywordsVersion.id == 1)
+        .values(version=KindKeywordsVersion.version + 1)
+        .returning(KindKeywordsVersion.version)
+    )
+    await enqueue_job(JOB_KIND_RECLASSIFY_KINDS, dedupe_key=JOB_KIND_RECLASSIFY_KINDS, session=session)
+    return version
+
+
+def _write_through(version: int, kind: str, keyword: str, added: bool) -> None:
+    global _dictionary
+    if _dictionary is not None and _dictionary.version == version - 1:
+        _dictionary = _dictionary.with_change(version, kind, keyword, added)
+    else:
+        # Между нашей и прошлой известной версией были чужие правки — перечитаем целиком
+        _dictionary = None
+
+
+async def reclassify_orders() -> int:
+    """Пересчитывает orders.kind пачками по id, каждая пачка в своей транзакции; возвращает число изменённых.
+
+    Если словарь поменяли во время прохода, проход повторяется с новым словарём.
+    """
+    session_factory = get_session_factory()
+    changed_total = 0
+    while True:
+        dictionary = await get_kind_dictionary(fresh=True)
+        classifier = await get_kind_classifier()
+        last_id = 0
+        while True:
+            async with session_factory() as session:
+                rows = (
+                    await session.execute(
+                        select(Order.id, Order.product, Order.kind)
+                        .where(Order.id > last_id)
+                        .order_by(Order.id)
+                        .limit(RECLASSIFY_BATCH_SIZE)
+                    )
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                changes = []
+                for row in rows:
+                    kind = classifier.classify(row.product) or None
+                    if kind != row.kind:
+                        changes.append({"order_id": row.id, "old_product": row.product, "new_kind": kind})
+                if changes:
+                    orders = Order.__table__
+                    # Заявку могли отредактировать после чтения пачки — тогда вид уже посчитан при записи
+                    await session.execute(
+                        update(orders)
+                        .where(
+                            orders.c.id == bindparam("order_id"),
+                            orders.c.product.is_not_distinct_from(bindparam("old_product")),
+                        )
+                        .values(kind=bindparam("new_kind")),
+                        changes,
+                    )
+                    await session.commit()
+                    changed_total += len(changes)
+        async with session_factory() as session:
+            # FOR SHARE ждёт незакоммиченную правку словаря: её задача пересчёта могла склеиться с этой
+            latest = await session.scalar(
+                select(KindKeywordsVersion.version)
+                .where(KindKeywordsVersion.id == 1)
+                .with_for_update(read=True)
+            )
+        if (latest or 0) == dictionary.version:
+            break
+        logger.info("Словарь видов изменился во время пересчёта, повторяем проход")
+    return changed_total
@@ -0,0 +1,121 @@
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..context import get_session_factory
+from ..models import AdminAction, MacroTemplate
+
+# Правки с других реплик бота подхватываются полной перезагрузкой не реже этого интервала
+MACROS_RELOAD_SECONDS = 300
+
+ADMIN_QUESTION_TEMPLATES = [
+    (
+        "Уточнить размер",
+        "Подскажите, пожалуйста, какой размер вам подойдёт? Это поможет точнее найти товар.",
+    ),
+    (
+        "Уточнить бюджет",
+        "Подтвердите, какой бюджет комфортен за этот товар, чтобы мы искали в нужном диапазоне.",
+    ),
+    (
+        "Предложить альтернативу",
+        "Нашлась похожая модель. Готовы рассмотреть альтернативу, если она появится быстрее?",
+    ),
+]
+
+
+@dataclass(frozen=True)
+class Macro:
+    id: int
+    title: str
+    body: str
+
+
+# id -> макрос в порядке id; новые id только растут, поэтому порядок сохраняется без сортировки
+_macros: Dict[int, Macro] = {}
+_loaded_at: Optional[float] = None
+
+
+async def seed_macro_templates(conn: AsyncConnection) -> None:
+    """Стартовые макросы для пустой таблицы; выполняется один раз миграцией."""
+    existing = await conn.scalar(select(func.count(MacroTemplate.id)))
+    if not existing:
+        await conn.execute(
+            insert(MacroTemplate),
+            [{"title": title, "body": body, "created_by": 0, "updated_by": 0} for title, body in ADMIN_QUESTION_TEMPLATES],
+        )
+
+
+async def load_macros() -> None:
+    """Перечитывает все макросы в память процесса; вызывается на старте бота."""
+    global _macros, _loaded_at
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(select(MacroTemplate.id, MacroTemplate.title, MacroTemplate.body).order_by(MacroTemplate.id))
+        _macros = {row.id: Macro(row.id, row.title, row.body) for row in q.all()}
+    _loaded_at = time.monotonic()
+
+
+async def _ensure_loaded() -> None:
+    if _loaded_at is None or time.monotonic() - _loaded_at >= MACROS_RELOAD_SECONDS:
+        await load_macros()
+
+
+async def get_macro_templates() -> List[Macro]:
+    await _ensure_loaded()
+    return list(_macros.values())
+
+
+async def get_macro_by_id(macro_id: int) -> Optional[Macro]:
+    await _ensure_loaded()
+    return _macros.get(macro_id)
+
+
+async def create_macro_db(title: str, body: str, admin_id: int) -> int:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        macro = MacroTemplate(title=title, body=body, created_by=admin_id, updated_by=admin_id)
+        session.add(macro)
+        action = AdminAction(admin_id=admin_id, action_type="macro_create", details=f"{title}")
+        session.add(action)
+        await session.commit()
+        await session.refresh(macro)
+    _macros[macro.id] = Macro(macro.id, title, body)
+    return macro.id
+
+
+async def update_macro_db(macro_id: int, title: str, body: str, admin_id: int) -> bool:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(select(MacroTemplate).where(MacroTemplate.id == macro_id))
+        macro = q.scalars().first()
+        if not macro:
+            _macros.pop(macro_id, None)
+            return False
+        macro.title = title
+        macro.body = body
+        macro.updated_by = admin_id
+        action = AdminAction(admin_id=admin_id, action_type="macro_edit", details=f"{macro_id}")
+        session.add(action)
+        await session.commit()
+    _macros[macro_id] = Macro(macro_id, title, body)
+    return True
+
+
+async def delete_macro_db(macro_id: int, admin_id: int) -> bool:
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(select(MacroTemplate).where(MacroTemplate.id == macro_id))
+        macro = q.scalars().first()
+        if not macro:
+            _macros.pop(macro_id, None)
+            return False
+        await session.delete(macro)
+        action = AdminAction(admin_id=admin_id, action_type="macro_delete", details=f"{macro_id}")
+        session.add(action)
+        await session.commit()
+    _macros.pop(macro_id, None)
+    return True
@@ -0,0 +1,133 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from sqlalchemy import delete, or_, select
+
+from ..context import get_bot, get_session_factory, get_settings
+from ..models import NotificationOutbox
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RETRY_BASE_SECONDS = 5
+OUTBOX_PURGE_BATCH_SIZE = 10000
+
+_wakeup: Optional[asyncio.Event] = None
+
+
+def enqueue_notification(session, chat_id: int, text: str) -> None:
+    """Queue a message in the caller's transaction; it is sent only after commit."""
+    session.add(NotificationOutbox(chat_id=chat_id, text=text))
+
+
+def wake_outbox_relay() -> None:
+    """Ask the relay to drain the outbox now instead of waiting for the next poll."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def _deliver_chat(rows: List[NotificationOutbox], semaphore: asyncio.Semaphore) -> None:
+    # Сообщения одного чата отправляем по порядку; после первой ошибки остальные ждут следующего прохода
+    async with semaphore:
+        tg_bot = get_bot()
+        for row in rows:
+            now = datetime.utcnow()
+            try:
+                await tg_bot.send_message(chat_id=row.chat_id, text=row.text)
+            except TelegramRetryAfter as exc:
+                row.available_at = now + timedelta(seconds=exc.retry_after)
+                row.last_error = str(exc)
+                return
+            except TelegramForbiddenError as exc:
+                # Пользователь заблокировал бота — повторять бессмысленно
+                row.attempts = OUTBOX_MAX_ATTEMPTS
+                row.last_error = str(exc)
+                continue
+            except Exception as exc:
+                row.attempts += 1
+                row.available_at = now + timedelta(seconds=OUTBOX_RETRY_BASE_SECONDS * 2 ** row.attempts)
+                row.last_error = str(exc)
+                logger.warning("Outbox delivery to %s failed (attempt %s): %s", row.chat_id, row.attempts, exc)
+                return
+            row.sent_at = now
+
+
+async def relay_outbox_once() -> int:
+    """Send one batch of pending notifications; returns the number of rows claimed."""
+    settings = get_settings()
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        q = await session.execute(
+            select(NotificationOutbox)
+            .where(
+                NotificationOutbox.sent_at.is_(None),
+                NotificationOutbox.attempts < OUTBOX_MAX_ATTEMPTS,
+                NotificationOutbox.available_at <= datetime.utcnow(),
+            )
+            .order_by(NotificationOutbox.id)
+            .limit(settings.outbox_batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        rows = q.scalars().all()
+        if not rows:
+            return 0
+        by_chat: Dict[int, List[NotificationOutbox]] = defaultdict(list)
+        for row in rows:
+            by_chat[row.chat_id].append(row)
+        semaphore = asyncio.Semaphore(max(1, settings.outbox_concurrency))
+        await asyncio.gather(*(_deliver_chat(chat_rows, semaphore) for chat_rows in by_chat.values()))
+        await session.commit()
+    return len(rows)
+
+
+async def purge_outbox() -> int:
+    """Удаляет отправленные и исчерпавшие попытки уведомления старше OUTBOX_RETENTION_DAYS; возвращает их число.
+
+    Удаляем пачками по id, чтобы не держать долгую транзакцию рядом с relay.
+    """
+    horizon = datetime.utcnow() - timedelta(days=get_settings().outbox_retention_days)
+    session_factory = get_session_factory()
+    removed = 0
+    while True:
+        async with session_factory() as session:
+            ids = (
+                select(NotificationOutbox.id)
+                .where(
+                    or_(
+                        NotificationOutbox.sent_at < horizon,
+                        (NotificationOutbox.sent_at.is_(None))
+                        & (NotificationOutbox.attempts >= OUTBOX_MAX_ATTEMPTS)
+                        & (NotificationOutbox.created_at < horizon),
+                    )
+                )
+                .limit(OUTBOX_PURGE_BATCH_SIZE)
+                .scalar_subquery()
+            )
+            result = await session.execute(delete(NotificationOutbox).where(NotificationOutbox.id.in_(ids)))
+            await session.commit()
+        removed += result.rowcount or 0
+        if (result.rowcount or 0) < OUTBOX_PURGE_BATCH_SIZE:
+            return removed
+
+
+async def outbox_relay_worker() -> None:
+    global _wakeup
+    _wakeup = asyncio.Event()
+    settings = get_settings()
+    while True:
+        _wakeup.clear()
+        try:
+            claimed = await relay_outbox_once()
+        except Exception:
+            logger.exception("Outbox relay failure")
+            claimed = 0
+        if claimed >= settings.outbox_batch_size:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.outbox_poll_interval)
+        except asyncio.TimeoutError:
+            pass
@@ -56,13 +56,20 @@ async def restore_order_photos(order_id: int) -> None:
     """Ensure photo files exist on disk, restoring from DB copies if needed."""
     session_factory = get_session_factory()
     async with session_factory() as session:
-        q = await session.execute(select(OrderPhoto).where(OrderPhoto.order_id == order_id))
-        for photo in q.scalars():
-            path = Path(photo.source_path)
-            if path.exists():
-                continue
+        # Байты фото читаем только для файлов, которых нет на диске
+        q = await session.execute(
+            select(OrderPhoto.id, OrderPhoto.source_path).where(OrderPhoto.order_id == order_id)
+        )
+        missing = [photo_id for photo_id, source_path in q.all() if not Path(source_path).exists()]
+        if not missing:
+            return
+        q = await session.execute(
+            select(OrderPhoto.source_path, OrderPhoto.data).where(OrderPhoto.id.in_(missing))
+        )
+        for source_path, data in q.all():
+            path = Path(source_path)
             try:
                 path.parent.mkdir(parents=True, exist_ok=True)
-                path.write_bytes(photo.data)
+                path.write_bytes(data)
             except OSError:
                 continue
@@ -0,0 +1,155 @@
+import hashlib
+import hmac
+import json
+from datetime import datetime
+from math import isqrt
+from typing import Iterable, Optional, Set, Tuple
+
+from sqlalchemy import BigInteger, String, column, select, table, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..context import get_database, get_session_factory, get_settings
+from ..models import USER_PUBLIC_ID_SEQ, PublicIdReservation, User
+
+PUBLIC_ID_MIN_WIDTH = 6
+FEISTEL_ROUNDS = 6
+
+# Индексы последовательности, которые при текущем ключе попадают на уже занятые (старые случайные) ID
+_reserved: Set[int] = set()
+
+
+def _tier_size(width: int) -> int:
+    return 9 * 10 ** (width - 1)
+
+
+def _split_index(n: int) -> Tuple[int, int]:
+    """Map a sequence value to (width, index inside that width's number range)."""
+    width = PUBLIC_ID_MIN_WIDTH
+    while n >= _tier_size(width):
+        n -= _tier_size(width)
+        width += 1
+    return width, n
+
+
+def _tier_offset(width: int) -> int:
+    return sum(_tier_size(w) for w in range(PUBLIC_ID_MIN_WIDTH, width))
+
+
+def _round_value(key: bytes, width: int, rnd: int, half: int, modulus: int) -> int:
+    digest = hmac.new(key, f"{width}:{rnd}:{half}".encode(), hashlib.sha256).digest()
+    return int.from_bytes(digest[:8], "big") % modulus
+
+
+def _feistel(x: int, key: bytes, width: int, modulus: int, inverse: bool = False) -> int:
+    left, right = divmod(x, modulus)
+    if inverse:
+        for rnd in reversed(range(FEISTEL_ROUNDS)):
+            left, right = (right - _round_value(key, width, rnd, left, modulus)) % modulus, left
+    else:
+        for rnd in range(FEISTEL_ROUNDS):
+            left, right = right, (left + _round_value(key, width, rnd, right, modulus)) % modulus
+    return left * modulus + right
+
+
+def _permute(index: int, key: bytes, width: int, inverse: bool = False) -> int:
+    """Keyed bijection on [0, tier size); cycle-walks out of the square Feistel domain."""
+    size = _tier_size(width)
+    modulus = isqrt(size - 1) + 1
+    value = _feistel(index, key, width, modulus, inverse)
+    while value >= size:
+        value = _feistel(value, key, width, modulus, inverse)
+    return value
+
+
+def public_id_for_index(n: int, key: bytes) -> str:
+    """Public ID for the n-th sequence value: 6 digits first, 7 after 900 000 users, and so on."""
+    width, index = _split_index(n)
+    return str(10 ** (width - 1) + _permute(index, key, width))
+
+
+def index_for_public_id(public_id: str, key: bytes) -> Optional[int]:
+    """Inverse of public_id_for_index; None for IDs outside the generated format."""
+    if not public_id.isdigit() or public_id.startswith("0") or len(public_id) < PUBLIC_ID_MIN_WIDTH:
+        return None
+    width = len(public_id)
+    index = _permute(int(public_id) - 10 ** (width - 1), key, width, inverse=True)
+    return _tier_offset(width) + index
+
+
+def _key() -> bytes:
+    settings = get_settings()
+    return (settings.public_id_key or settings.bot_token).encode()
+
+
+def reserve_public_ids(public_ids: Iterable[str], next_index: int) -> int:
+    """Remember sequence indices whose IDs are already taken; returns how many will be skipped."""
+    key = _key()
+    reserved = set()
+    for public_id in public_ids:
+        index = index_for_public_id(public_id, key)
+        if index is not None and index >= next_index:
+            reserved.add(index)
+    _reserved.clear()
+    _reserved.update(reserved)
+    return len(reserved)
+
+
+async def compute_reserved_public_ids(conn=None) -> int:
+    """Собирает занятые ID (старые случайные и выданные при другом ключе) обращением каждого public_id — O(пользователей)."""
+    if conn is None:
+        async with get_database().engine.connect() as own_conn:
+            return await compute_reserved_public_ids(own_conn)
+    row = (await conn.execute(text(f"SELECT last_value, is_called FROM {USER_PUBLIC_ID_SEQ.name}"))).one()
+    next_index = row.last_value + 1 if row.is_called else row.last_value
+    q = await conn.execute(select(User.public_id).where(User.public_id.isnot(None)))
+    return reserve_public_ids(q.scalars(), next_index)
+
+
+async def load_reserved_public_ids() -> int:
+    """Список пропуска на старте: для текущего ключа считается один раз и хранится в public_id_reservations.
+
+    Новые ID, выданные при том же ключе, в список не попадают (их индексы уже пройдены),
+    поэтому сохранённый список остаётся верным, пока ключ не сменится.
+    """
+    key_hash = hashlib.sha256(_key()).hexdigest()
+    async with get_database().read_session() as session:
+        stored = await session.scalar(
+            select(PublicIdReservation.indices).where(
+                PublicIdReservation.id == 1, PublicIdReservation.key_hash == key_hash
+            )
+        )
+    if stored is not None:
+        _reserved.clear()
+        _reserved.update(json.loads(stored))
+        return len(_reserved)
+    count = await compute_reserved_public_ids()
+    values = {"key_hash": key_hash, "indices": json.dumps(sorted(_reserved)), "computed_at": datetime.utcnow()}
+    stmt = pg_insert(PublicIdReservation).values(id=1, **values)
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        await session.execute(stmt.on_conflict_do_update(index_elements=[PublicIdReservation.id], set_=values))
+        await session.commit()
+    return count
+
+
+async def allocate_user_public_id(session) -> str:
+    """Takes the next sequence value and maps it to a public ID; no lookup in users is needed."""
+    key = _key()
+    while True:
+        n = await session.scalar(select(USER_PUBLIC_ID_SEQ.next_value()))
+        if n not in _reserved:
+            return public_id_for_index(n, key)
+
+
+# Шаг 7 идёт раньше шага 18 с users.updated_at: update(User) дописал бы эту колонку через onupdate
+_USERS_PUBLIC_ID = table("users", column("id", BigInteger), column("public_id", String))
+
+
+async def backfill_user_public_ids(session) -> int:
+    """Выдаёт public_id пользователям, у которых его нет; выполняется шагом миграции в его транзакции."""
+    q = await session.execute(select(User.id).where(User.public_id.is_(None)).order_by(User.id))
+    user_ids = q.scalars().all()
+    for user_id in user_ids:
+        public_id = await allocate_user_public_id(session)
+        await session.execute(update(_USERS_PUBLIC_ID).where(_USERS_PUBLIC_ID.c.id == user_id).values(public_id=public_id))
+    return len(user_ids)
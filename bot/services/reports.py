@@ -1,13 +1,8 @@
+import asyncio
 import os
-from collections import defaultdict
 from datetime import datetime
 from typing import Dict, List, Tuple
 
-import pandas as pd
-from openpyxl import Workbook
-from openpyxl.styles import PatternFill
-from openpyxl.worksheet.datavalidation import DataValidation
-from openpyxl.formatting.rule import FormulaRule
 from sqlalchemy import select
 
 from ..constants import (
@@ -20,9 +15,11 @@ from ..constants import (
     STATUS_NEW,
     STATUS_NOT_ADDED,
 )
-from ..context import get_session_factory, get_settings
-from ..models import Order, KindKeyword
+from ..context import get_database, get_session_factory, get_settings
+from ..models import Order
 from ..utils.photos import parse_photo_entries
+from .events import load_order_events, render_communication, render_internal_comments
+from .kinds import get_kind_dictionary
 from .photos import restore_order_photos
 
 KIND_CATALOG = ["Одежда", "Обувь", "Инвентарь", "Аксессуары"]
@@ -30,24 +27,16 @@ KIND_CATALOG = ["Одежда", "Обувь", "Инвентарь", "Аксес
 
 async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
     settings = get_settings()
-    session_factory = get_session_factory()
-    async with session_factory() as session:
+    # Выгрузка тяжёлая и допускает небольшое отставание — читаем с реплики, если она настроена
+    async with get_database().replica_session() as session:
         q = await session.execute(select(Order).order_by(Order.created_at.asc()))
         rows = q.scalars().all()
-        kw_rows = await session.execute(select(KindKeyword.kind, KindKeyword.keyword))
-        keywords_map: Dict[str, List[str]] = defaultdict(list)
-        for kind, kw in kw_rows.all():
-            keywords_map[kind].append(kw)
+        # История собирается из order_events только при выгрузке, а не хранится в строке заказа
+        events_by_order = await load_order_events(session)
 
     # Для классификации используем только слова из БД; без дефолтных словарей, чтобы пустой список не давал ложных срабатываний
-    KIND_VALUES = sorted(set(keywords_map.keys()) | set(KIND_CATALOG))
-
-    def guess_kind(name: str) -> str:
-        title = (name or "").lower()
-        for kind, keys in keywords_map.items():
-            if any(k in title for k in keys):
-                return kind
-        return ""
+    dictionary = await get_kind_dictionary(fresh=True)
+    KIND_VALUES = sorted(set(dictionary.keywords) | set(KIND_CATALOG))
 
     timestamp_human = datetime.utcnow().strftime("%d-%m-%Y %H-%M")
     full_path = os.path.join(tmp_dir, f"Все заказы {timestamp_human}.xlsx")
@@ -70,17 +59,57 @@ async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
                 "Статус": order.status,
                 "Дата создания": order.created_at.strftime("%Y-%m-%d %H:%M") if order.created_at else "",
                 "Товар": order.product,
-                "Вид": guess_kind(order.product),
+                "Вид": order.kind or "",
+                "Бренд": order.brand,
+                "Размер": order.size,
+                "Комментарий": order.comment,
+                "Фото (локально)": local_photos,
+                "Ссылки на фото": public_photos,
+                "Ссылка на товар": order.product_link,
+                "Общение": render_communication(events_by_order.get(order.id, [])),
+                "Внутренние комментарии": render_internal_comments(events_by_order.get(order.id, [])),
+            }
+        )
+    # Сборка книг — синхронный pandas/openpyxl на секунды; в потоке, чтобы не останавливать цикл событий бота
+    await asyncio.to_thread(_write_full_report, full_path, data_full, KIND_VALUES)
+
+    data_work: List[Dict[str, str]] = []
+    for order in rows:
+        if order.status in (STATUS_ADDED, STATUS_NOT_ADDED):
+            continue
+        await restore_order_photos(order.id)
+        local_photos, public_photos = build_photo_columns(order.photos or "")
+        data_work.append(
+            {
+                "ID заказа": order.id,
+                "ID пользователя": order.user_id,
+                "Статус": order.status,
+                "Дата создания": order.created_at.strftime("%Y-%m-%d %H:%M") if order.created_at else "",
+                "Товар": order.product,
+                "Вид": order.kind or "",
                 "Бренд": order.brand,
                 "Размер": order.size,
                 "Комментарий": order.comment,
                 "Фото (локально)": local_photos,
                 "Ссылки на фото": public_photos,
                 "Ссылка на товар": order.product_link,
-                "Общение": order.communication,
-                "Внутренние комментарии": order.internal_comments,
+                "Общение": render_communication(events_by_order.get(order.id, [])),
+                "Внутренние комментарии": render_internal_comments(events_by_order.get(order.id, [])),
             }
         )
+
+    await asyncio.to_thread(_write_work_report, work_path, data_work, KIND_VALUES)
+
+    return full_path, work_path
+
+
+def _write_full_report(full_path: str, data_full: List[Dict[str, str]], kind_values: List[str]) -> None:
+    # pandas и openpyxl долго импортируются — грузим их только когда выгрузка действительно нужна
+    import pandas as pd
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import PatternFill
+    from openpyxl.worksheet.datavalidation import DataValidation
+
     df_full = pd.DataFrame(data_full)
     with pd.ExcelWriter(full_path, engine="openpyxl") as writer:
         df_full.to_excel(writer, index=False, sheet_name="Все заявки")
@@ -100,10 +129,10 @@ async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
 
         # Валидация для столбца "Вид"
         kinds_sheet = writer.book.create_sheet("Справочник видов")
-        for i, k in enumerate(KIND_VALUES, start=1):
+        for i, k in enumerate(kind_values, start=1):
             kinds_sheet.cell(row=i, column=1, value=k)
         kinds_sheet.sheet_state = "hidden"
-        kind_range = f"'Справочник видов'!$A$1:$A${len(KIND_VALUES)}"
+        kind_range = f"'Справочник видов'!$A$1:$A${len(kind_values)}"
         dv_kind = DataValidation(type="list", formula1=kind_range, allow_blank=True)
         dv_kind.errorTitle = "Недопустимое значение"
         dv_kind.error = "Выберите значение из списка."
@@ -129,30 +158,12 @@ async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
                 FormulaRule(formula=[formula], fill=fill),
             )
 
-    data_work: List[Dict[str, str]] = []
-    for order in rows:
-        if order.status in (STATUS_ADDED, STATUS_NOT_ADDED):
-            continue
-        await restore_order_photos(order.id)
-        local_photos, public_photos = build_photo_columns(order.photos or "")
-        data_work.append(
-            {
-                "ID заказа": order.id,
-                "ID пользователя": order.user_id,
-                "Статус": order.status,
-                "Дата создания": order.created_at.strftime("%Y-%m-%d %H:%M") if order.created_at else "",
-                "Товар": order.product,
-                "Вид": guess_kind(order.product),
-                "Бренд": order.brand,
-                "Размер": order.size,
-                "Комментарий": order.comment,
-                "Фото (локально)": local_photos,
-                "Ссылки на фото": public_photos,
-                "Ссылка на товар": order.product_link,
-                "Общение": order.communication,
-                "Внутренние комментарии": order.internal_comments,
-            }
-        )
+
+def _write_work_report(work_path: str, data_work: List[Dict[str, str]], kind_values: List[str]) -> None:
+    from openpyxl import Workbook
+    from openpyxl.formatting.rule import FormulaRule
+    from openpyxl.styles import PatternFill
+    from openpyxl.worksheet.datavalidation import DataValidation
 
     wb = Workbook()
     ws = wb.active
@@ -191,10 +202,10 @@ async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
 
     # Валидация для столбца "Вид" (рабочий лист)
     kinds_sheet = wb.create_sheet("Справочник видов")
-    for i, k in enumerate(KIND_VALUES, start=1):
+    for i, k in enumerate(kind_values, start=1):
         kinds_sheet.cell(row=i, column=1, value=k)
     kinds_sheet.sheet_state = "hidden"
-    kind_range = f"'Справочник видов'!$A$1:$A${len(KIND_VALUES)}"
+    kind_range = f"'Справочник видов'!$A$1:$A${len(kind_values)}"
     dv_kind = DataValidation(type="list", formula1=kind_range, allow_blank=True)
     dv_kind.errorTitle = "Недопустимое значение"
     dv_kind.error = "Выберите значение из списка."
@@ -221,15 +232,14 @@ async def generate_order_reports(tmp_dir: str) -> Tuple[str, str]:
         )
     wb.save(work_path)
 
-    return full_path, work_path
-
 
 async def prepare_status_updates(path: str) -> Tuple[List[str], Dict[int, Dict[str, str]]]:
     errors: List[str] = []
     updates: Dict[int, Dict[str, str]] = {}
+    import pandas as pd
 
     try:
-        df = pd.read_excel(path)
+        df = await asyncio.to_thread(pd.read_excel, path)
     except Exception as exc:
         errors.append(f"Не удалось прочитать файл: {exc}")
         return errors, updates
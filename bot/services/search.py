@@ -0,0 +1,136 @@
+import re
+from dataclasses import dataclass
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from ..context import get_database
+
+SEARCH_PAGE_SIZE = 10
+SEARCH_QUERY_MAX_LENGTH = 200
+
+# Одно и то же выражение в индексах и в запросах: иначе Postgres не возьмёт индекс по выражению
+SEARCH_TEXT_SQL = (
+    "lower(coalesce(product, '') || ' ' || coalesce(brand, '') || ' ' "
+    "|| coalesce(size, '') || ' ' || coalesce(comment, ''))"
+)
+# 'simple' без стемминга: в заявках вперемешку русский, латиница брендов и размеры
+SEARCH_TSVECTOR_SQL = f"to_tsvector('simple', {SEARCH_TEXT_SQL})"
+
+# {public_id}-{user_order_number}; без public_id номер строится из user_id
+ORDER_NUMBER_RE = re.compile(r"^#?(\w+)-(\d+)$", re.ASCII)
+# Границы INTEGER и BIGINT: значения за ними asyncpg отвергает ошибкой ещё до запроса
+PG_INT_MAX = 2 ** 31 - 1
+PG_BIGINT_MAX = 2 ** 63 - 1
+
+_HIT_COLUMNS = """
+    o.id, o.user_id, o.user_order_number, o.status, o.product, o.brand, o.size, o.comment, u.public_id
+"""
+
+_SEARCH_SQL = f"""
+SELECT {_HIT_COLUMNS}
+FROM (
+    SELECT
+        id,
+        {SEARCH_TSVECTOR_SQL} @@ websearch_to_tsquery('simple', :query) AS exact,
+        word_similarity(:query, {SEARCH_TEXT_SQL}) AS score
+    FROM orders
+    WHERE {SEARCH_TSVECTOR_SQL} @@ websearch_to_tsquery('simple', :query)
+       OR :query <% {SEARCH_TEXT_SQL}
+    ORDER BY exact DESC, score DESC, id DESC
+    LIMIT :limit OFFSET :offset
+) found
+JOIN orders o ON o.id = found.id
+LEFT JOIN users u ON u.id = o.user_id
+ORDER BY found.exact DESC, found.score DESC, o.id DESC
+"""
+
+# Оба варианта идут по уникальным индексам: users.public_id и ux_orders_user_number
+_NUMBER_SQL = f"""
+SELECT {_HIT_COLUMNS}
+FROM orders o
+JOIN users u ON u.id = o.user_id
+WHERE o.user_order_number = :number
+  AND (u.public_id = :prefix OR (u.public_id IS NULL AND o.user_id = :user_id))
+"""
+
+
+class OrderSearchHit(NamedTuple):
+    id: int
+    user_id: int
+    user_order_number: Optional[int]
+    status: str
+    product: Optional[str]
+    brand: Optional[str]
+    size: Optional[str]
+    comment: Optional[str]
+    public_id: Optional[str]
+
+
+@dataclass
+class OrderSearchPage:
+    hits: List[OrderSearchHit]
+    page: int
+    has_next: bool
+
+
+SEARCH_INDEXES = {
+    "ix_orders_search_fts": f"USING gin ({SEARCH_TSVECTOR_SQL})",
+    "ix_orders_search_trgm": f"USING gin ({SEARCH_TEXT_SQL} gin_trgm_ops)",
+}
+
+
+async def create_search_indexes(conn: AsyncConnection) -> None:
+    """GIN-индексы полнотекстового и нечёткого (pg_trgm) поиска по товару, бренду, размеру и комментарию.
+
+    Строятся CONCURRENTLY, поэтому conn должен быть в режиме AUTOCOMMIT; запись в orders не блокируется.
+    """
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    for name, definition in SEARCH_INDEXES.items():
+        # Прерванная сборка CONCURRENTLY оставляет невалидный индекс, а IF NOT EXISTS его бы пропустил
+        invalid = await conn.scalar(
+            text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+        )
+        if invalid:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+        await conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON orders {definition}"))
+
+
+def normalize_search_query(raw: Optional[str]) -> str:
+    return " ".join((raw or "").split())[:SEARCH_QUERY_MAX_LENGTH].lower()
+
+
+async def find_order_by_number(term: str) -> Optional[OrderSearchHit]:
+    """Заявка по публичному номеру {public_id}-{n}; None, если строка не похожа на номер или заявки нет."""
+    match = ORDER_NUMBER_RE.match(term.strip())
+    if not match:
+        return None
+    prefix, number = match.group(1), int(match.group(2))
+    if number > PG_INT_MAX:
+        return None
+    user_id = int(prefix) if prefix.isdecimal() else None
+    if user_id is not None and user_id > PG_BIGINT_MAX:
+        user_id = None
+    params = {"prefix": prefix, "number": number, "user_id": user_id}
+    async with get_database().replica_session() as session:
+        row = (await session.execute(text(_NUMBER_SQL), params)).first()
+    return OrderSearchHit(*row) if row else None
+
+
+async def search_orders(query: str, page: int = 0) -> OrderSearchPage:
+    """Страница результатов: сначала полные совпадения по словам, затем нечёткие по сходству, новые выше.
+
+    Нечёткая часть ловит опечатки и части слов («найк», «airmax»): оператор <% из pg_trgm
+    с порогом pg_trgm.word_similarity_threshold.
+    """
+    query = normalize_search_query(query)
+    page = max(page, 0)
+    if not query:
+        return OrderSearchPage([], page, False)
+    params = {"query": query, "limit": SEARCH_PAGE_SIZE + 1, "offset": page * SEARCH_PAGE_SIZE}
+    # Поиск допускает небольшое отставание — читаем с реплики, если она настроена
+    async with get_database().replica_session() as session:
+        rows = (await session.execute(text(_SEARCH_SQL), params)).all()
+    hits = [OrderSearchHit(*row) for row in rows[:SEARCH_PAGE_SIZE]]
+    return OrderSearchPage(hits, page, len(rows) > SEARCH_PAGE_SIZE)
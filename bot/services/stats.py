@@ -0,0 +1,189 @@
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, event, func, literal, literal_column, select, text, union_all
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..context import get_database, get_session_factory
+from ..models import Order, OrderStat
+
+STAT_TOTAL = "total"
+STAT_USERS = "users"
+STAT_STATUS = "status"
+STAT_BRAND = "brand"
+STAT_HOUR = "hour"
+
+STATS_WINDOW_DAYS = 7
+# Почасовые корзины храним с запасом: сверка удаляет всё, что старше
+STATS_HOURS_KEPT_DAYS = STATS_WINDOW_DAYS + 1
+STATS_SNAPSHOT_TTL_SECONDS = 30
+HOUR_KEY_FORMAT = "%Y-%m-%dT%H"
+
+StatDeltas = Counter
+
+
+@dataclass
+class StatsSnapshot:
+    total: int = 0
+    last_week: int = 0
+    users: int = 0
+    by_status: Dict[str, int] = field(default_factory=dict)
+    top_brands: List[str] = field(default_factory=list)
+
+
+_snapshot: Optional[Tuple[float, StatsSnapshot]] = None
+
+
+def _hour_key(ts: datetime) -> str:
+    return ts.strftime(HOUR_KEY_FORMAT)
+
+
+def order_created_deltas(status: str, brand: Optional[str], first_for_user: bool, ts: Optional[datetime] = None) -> StatDeltas:
+    deltas: StatDeltas = Counter()
+    deltas[(STAT_TOTAL, "")] += 1
+    deltas[(STAT_STATUS, status)] += 1
+    deltas[(STAT_HOUR, _hour_key(ts or datetime.utcnow()))] += 1
+    if brand:
+        deltas[(STAT_BRAND, brand)] += 1
+    if first_for_user:
+        deltas[(STAT_USERS, "")] += 1
+    return deltas
+
+
+def status_change_deltas(old: Optional[str], new: str) -> StatDeltas:
+    deltas: StatDeltas = Counter()
+    if old != new:
+        if old:
+            deltas[(STAT_STATUS, old)] -= 1
+        deltas[(STAT_STATUS, new)] += 1
+    return deltas
+
+
+def brand_change_deltas(old: Optional[str], new: Optional[str]) -> StatDeltas:
+    deltas: StatDeltas = Counter()
+    if old != new:
+        if old:
+            deltas[(STAT_BRAND, old)] -= 1
+        if new:
+            deltas[(STAT_BRAND, new)] += 1
+    return deltas
+
+
+def invalidate_stats_snapshot() -> None:
+    global _snapshot
+    _snapshot = None
+
+
+async def bump_order_stats(session, deltas: StatDeltas) -> None:
+    """Прибавляет дельты к счётчикам в транзакции вызывающего; снимок сбрасывается после commit.
+
+    Строки идут в одном INSERT ... ON CONFLICT в порядке ключей, чтобы параллельные
+    транзакции блокировали их в одинаковом порядке и не ловили взаимоблокировку.
+    """
+    rows = [
+        {"metric": metric, "key": key, "value": value}
+        for (metric, key), value in sorted(deltas.items())
+        if value
+    ]
+    if not rows:
+        return
+    stmt = pg_insert(OrderStat).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrderStat.metric, OrderStat.key],
+        set_={"value": OrderStat.value + stmt.excluded.value},
+    )
+    await session.execute(stmt)
+    event.listen(session.sync_session, "after_commit", lambda _: invalidate_stats_snapshot(), once=True)
+
+
+async def load_stats_snapshot() -> StatsSnapshot:
+    horizon = _hour_key(datetime.utcnow() - timedelta(days=STATS_WINDOW_DAYS))
+    async with get_database().read_session() as session:
+        rows = (
+            await session.execute(
+                select(OrderStat.metric, OrderStat.key, OrderStat.value).where(
+                    OrderStat.metric.in_([STAT_TOTAL, STAT_USERS, STAT_STATUS])
+                    | ((OrderStat.metric == STAT_HOUR) & (OrderStat.key >= horizon))
+                )
+            )
+        ).all()
+        brand_rows = (
+            await session.execute(
+                select(OrderStat.key)
+                .where(OrderStat.metric == STAT_BRAND, OrderStat.value > 0)
+                .order_by(OrderStat.value.desc())
+                .limit(3)
+            )
+        ).all()
+    snapshot = StatsSnapshot(top_brands=[row[0] for row in brand_rows])
+    for metric, key, value in rows:
+        if metric == STAT_TOTAL:
+            snapshot.total = value
+        elif metric == STAT_USERS:
+            snapshot.users = value
+        elif metric == STAT_STATUS:
+            snapshot.by_status[key] = value
+        else:
+            snapshot.last_week += value
+    return snapshot
+
+
+async def get_stats_snapshot() -> StatsSnapshot:
+    """Снимок счётчиков из памяти процесса; чужие процессы увидят изменения не позже чем через TTL."""
+    global _snapshot
+    now = time.monotonic()
+    if _snapshot is not None and now - _snapshot[0] < STATS_SNAPSHOT_TTL_SECONDS:
+        return _snapshot[1]
+    snapshot = await load_stats_snapshot()
+    _snapshot = (now, snapshot)
+    return snapshot
+
+
+async def reconcile_order_stats(session=None) -> int:
+    """Пересчитывает счётчики по orders и заменяет ими таблицу; заодно удаляет старые почасовые корзины.
+
+    SHARE ROW EXCLUSIVE не пускает параллельные bump_order_stats до конца пересчёта:
+    транзакции, начавшие менять счётчики раньше, успевают зафиксироваться до снимка,
+    а начатые позже применят свои дельты уже поверх пересчитанных значений.
+    С session пересчёт идёт в транзакции вызывающего (шаг миграции).
+    """
+    # Литералы, а не параметры: иначе выражение в SELECT и GROUP BY для Postgres будет разным
+    hour = func.to_char(
+        func.date_trunc(literal_column("'hour'"), Order.created_at), literal_column("'YYYY-MM-DD\"T\"HH24'")
+    )
+    horizon = datetime.utcnow() - timedelta(days=STATS_HOURS_KEPT_DAYS)
+    source = union_all(
+        select(literal(STAT_TOTAL), literal(""), func.count(Order.id)),
+        select(literal(STAT_USERS), literal(""), func.count(func.distinct(Order.user_id))),
+        select(literal(STAT_STATUS), Order.status, func.count(Order.id)).group_by(Order.status),
+        select(literal(STAT_BRAND), Order.brand, func.count(Order.id))
+        .where(Order.brand.isnot(None), Order.brand != "")
+        .group_by(Order.brand),
+        select(literal(STAT_HOUR), hour, func.count(Order.id)).where(Order.created_at >= horizon).group_by(hour),
+    )
+    if session is None:
+        session_factory = get_session_factory()
+        async with session_factory() as own_session:
+            rows = await _replace_order_stats(own_session, source)
+            await own_session.commit()
+    else:
+        rows = await _replace_order_stats(session, source)
+    invalidate_stats_snapshot()
+    return rows
+
+
+async def _replace_order_stats(session, source) -> int:
+    await session.execute(text("LOCK TABLE order_stats IN SHARE ROW EXCLUSIVE MODE"))
+    await session.execute(delete(OrderStat))
+    result = await session.execute(pg_insert(OrderStat).from_select(["metric", "key", "value"], source))
+    return result.rowcount or 0
+
+
+async def ensure_order_stats(session) -> None:
+    """Первое заполнение после появления таблицы, иначе аналитика покажет нули до первой сверки."""
+    filled = await session.scalar(select(OrderStat.metric).limit(1))
+    if filled is None:
+        await reconcile_order_stats(session)
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+from sqlalchemy import select, text
+
+from ..config import Settings
+from ..constants import STATUS_ADDED, STATUS_DELETED_BY_USER, STATUS_NOT_ADDED
+from ..context import get_database, get_session_factory, get_settings
+from ..metrics import VIEW_REFRESH_FAILURES, VIEW_REFRESH_LAST_SUCCESS, VIEW_REFRESH_TIME
+from ..models import ViewRefreshState
+
+logger = logging.getLogger(__name__)
+
+# Витрины обновляются на отдельных соединениях; больше трёх сразу — лишняя нагрузка на пул и диск
+VIEWS_REFRESH_CONCURRENCY = 3
+
+
+@dataclass(frozen=True)
+class MaterializedView:
+    name: str
+    query: str
+    # Уникальный индекс обязателен для REFRESH ... CONCURRENTLY
+    unique_columns: Sequence[str]
+    # Входные таблицы (ключи WATERMARK_QUERIES): витрина обновляется, только когда они изменились
+    sources: Sequence[str]
+
+
+# Запросы по одному концу B-tree индекса, значение которых меняется при любой записи в таблицу.
+# orders и users не удаляются, а каждая вставка и правка ставит updated_at (onupdate в моделях),
+# поэтому хватает MAX(updated_at). Запись, закоммиченная позже более новой, но с меньшим
+# updated_at, знак не сдвинет — такую правку подберёт обновление по VIEWS_MAX_INTERVAL.
+WATERMARK_QUERIES: Dict[str, str] = {
+    # Закрытие интервала всегда идёт вместе со вставкой следующего, поэтому хватает MAX(id)
+    "order_status_intervals": "SELECT COALESCE(MAX(id), 0)::text FROM order_status_intervals",
+    "orders": "SELECT COALESCE(MAX(updated_at)::text, '') FROM orders",
+    "users": "SELECT COALESCE(MAX(updated_at)::text, '') FROM users",
+}
+
+# Только закрытые интервалы: их длительность уже не меняется, окно LEAD() по всей истории не нужно
+CLOSED_STATUS_INTERVALS = """(
+    SELECT order_id, status, EXTRACT(EPOCH FROM (ended_at - started_at)) AS seconds_in_status
+    FROM order_status_intervals
+    WHERE ended_at IS NOT NULL
+) AS closed"""
+
+
+MATERIALIZED_VIEWS: Dict[str, MaterializedView] = {
+    view.name: view
+    for view in [
+        MaterializedView(
+            "mv_status_avg",
+            f"""
+            SELECT
+                status,
+                AVG(seconds_in_status) AS avg_seconds,
+                SUM(seconds_in_status) AS total_seconds,
+                COUNT(*) AS transitions,
+                NOW() AS refreshed_at
+            FROM {CLOSED_STATUS_INTERVALS}
+            GROUP BY status
+            """,
+            ("status",),
+            ("order_status_intervals",),
+        ),
+        MaterializedView(
+            "mv_order_status_time",
+            f"""
+            SELECT
+                order_id,
+                status,
+                SUM(seconds_in_status) AS seconds_in_status
+            FROM {CLOSED_STATUS_INTERVALS}
+            GROUP BY order_id, status
+            """,
+            ("order_id", "status"),
+            ("order_status_intervals",),
+        ),
+        MaterializedView(
+            "mv_order_stats",
+            f"""
+            SELECT
+                1 AS id,
+                (SELECT COUNT(*) FROM orders) AS total_orders,
+                (SELECT COUNT(*) FROM orders WHERE status IN ('{STATUS_ADDED}','{STATUS_NOT_ADDED}','{STATUS_DELETED_BY_USER}')) AS closed_orders,
+                (SELECT COUNT(*) FROM orders WHERE status NOT IN ('{STATUS_ADDED}','{STATUS_NOT_ADDED}','{STATUS_DELETED_BY_USER}')) AS active_orders,
+                (SELECT COUNT(*) FROM orders WHERE status = '{STATUS_ADDED}') AS added_orders,
+                CASE WHEN (SELECT COUNT(*) FROM orders) > 0
+                     THEN (SELECT COUNT(*) FROM orders WHERE status = '{STATUS_ADDED}')::DECIMAL / (SELECT COUNT(*) FROM orders)
+                     ELSE 0 END AS conversion_added,
+                (SELECT COUNT(*) FROM users WHERE COALESCE(is_admin, FALSE) = FALSE) AS users_non_admin,
+                NOW() AS refreshed_at
+            """,
+            ("id",),
+            ("orders", "users"),
+        ),
+        MaterializedView(
+            "mv_top_brands",
+            """
+            SELECT
+                COALESCE(NULLIF(TRIM(brand), ''), '—') AS brand,
+                COUNT(*) AS cnt,
+                NOW() AS refreshed_at
+            FROM orders
+            GROUP BY 1
+            """,
+            ("brand",),
+            ("orders",),
+        ),
+        MaterializedView(
+            "mv_kind_distribution",
+            """
+            SELECT
+                COALESCE(kind, 'Не определено') AS kind,
+                COUNT(*) AS cnt,
+                NOW() AS refreshed_at
+            FROM orders
+            GROUP BY 1
+            """,
+            ("kind",),
+            # После правки словаря витрину обновляет задача reclassify_kinds, когда пересчитает orders.kind
+            ("orders",),
+        ),
+    ]
+}
+
+
+async def create_materialized_views(conn, names: Sequence[str] = ()) -> None:
+    """Пересоздаёт витрины (по умолчанию все) по текущим определениям вместе с их уникальными индексами."""
+    for view in (MATERIALIZED_VIEWS[name] for name in names or MATERIALIZED_VIEWS):
+        await conn.execute(text(f"DROP MATERIALIZED VIEW IF EXISTS {view.name}"))
+        await conn.execute(text(f"CREATE MATERIALIZED VIEW {view.name} AS {view.query}"))
+        await conn.execute(
+            text(f"CREATE UNIQUE INDEX ux_{view.name} ON {view.name} ({', '.join(view.unique_columns)})")
+        )
+
+
+async def refresh_view(name: str) -> bool:
+    """REFRESH ... CONCURRENTLY в своей транзакции: читатели витрины не блокируются."""
+    started = time.perf_counter()
+    try:
+        async with get_database().engine.begin() as conn:
+            await conn.execute(text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {name}"))
+    except Exception:
+        VIEW_REFRESH_FAILURES.labels(view=name).inc()
+        logger.exception("Failed to refresh materialized view %s", name)
+        return False
+    VIEW_REFRESH_TIME.labels(view=name).observe(time.perf_counter() - started)
+    VIEW_REFRESH_LAST_SUCCESS.labels(view=name).set_to_current_time()
+    return True
+
+
+async def refresh_materialized_views(names: Sequence[str] = ()) -> List[str]:
+    """Обновляет витрины параллельно (не больше VIEWS_REFRESH_CONCURRENCY); возвращает успешно обновлённые."""
+    semaphore = asyncio.Semaphore(VIEWS_REFRESH_CONCURRENCY)
+
+    async def guarded(name: str) -> bool:
+        async with semaphore:
+            return await refresh_view(name)
+
+    names = list(names or MATERIALIZED_VIEWS)
+    results = await asyncio.gather(*(guarded(name) for name in names))
+    return [name for name, ok in zip(names, results) if ok]
+
+
+async def read_watermarks() -> Dict[str, str]:
+    async with get_database().read_session() as session:
+        return {source: await session.scalar(text(query)) for source, query in WATERMARK_QUERIES.items()}
+
+
+def _view_watermark(view: MaterializedView, watermarks: Dict[str, str]) -> str:
+    return "|".join(f"{source}={watermarks[source]}" for source in sorted(view.sources))
+
+
+def _refresh_due(state: ViewRefreshState, now: datetime, settings: Settings) -> bool:
+    if state.refreshed_at is None:
+        return True
+    since_refresh = (now - state.refreshed_at).total_seconds()
+    if since_refresh >= settings.views_max_interval:
+        return True
+    if state.pending_watermark is None or since_refresh < settings.views_min_interval:
+        return False
+    # Ждём паузы в записи, но при непрерывном потоке изменений — не дольше VIEWS_MIN_INTERVAL
+    quiet = (now - state.last_change_at).total_seconds()
+    waiting = (now - state.first_change_at).total_seconds()
+    return quiet >= settings.views_debounce or waiting >= settings.views_min_interval
+
+
+async def refresh_changed_views() -> List[str]:
+    """Обновляет только витрины, чьи входные таблицы изменились, с учётом min/max интервала и debounce.
+
+    Водяной знак снимается до REFRESH: изменения, попавшие между ними, вызовут ещё одно
+    обновление на следующей проверке, но не потеряются.
+    """
+    settings = get_settings()
+    now = datetime.utcnow()
+    watermarks = await read_watermarks()
+    session_factory = get_session_factory()
+    async with session_factory() as session:
+        states = {row.view: row for row in (await session.execute(select(ViewRefreshState))).scalars()}
+        due: Dict[str, str] = {}
+        for view in MATERIALIZED_VIEWS.values():
+            state = states.get(view.name)
+            if state is None:
+                state = ViewRefreshState(view=view.name)
+                session.add(state)
+            current = _view_watermark(view, watermarks)
+            if current == state.watermark:
+                state.pending_watermark = state.first_change_at = state.last_change_at = None
+            elif current != state.pending_watermark:
+                state.pending_watermark = current
+                state.last_change_at = now
+                state.first_change_at = state.first_change_at or now
+            if _refresh_due(state, now, settings):
+                due[view.name] = current
+        await session.commit()
+    if not due:
+        return []
+    refreshed = await refresh_materialized_views(list(due))
+    async with session_factory() as session:
+        for name in refreshed:
+            state = await session.get(ViewRefreshState, name)
+            state.watermark = due[name]
+            state.refreshed_at = now
+            if state.pending_watermark == due[name]:
+                state.pending_watermark = state.first_change_at = state.last_change_at = None
+        await session.commit()
+    return refreshed
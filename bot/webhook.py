@@ -0,0 +1,123 @@
+import asyncio
+import hmac
+import logging
+from typing import List
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from .config import Settings
+from .metrics import WEBHOOK_DROPPED, WEBHOOK_QUEUE_DEPTH, WEBHOOK_REJECTED, mark_metrics_served, metrics_port
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DRAIN_TIMEOUT_SECONDS = 30
+
+
+class WebhookServer:
+    """Принимает обновления по HTTP и отдаёт их воркерам через ограниченную очередь.
+
+    При переполнении очереди отвечаем 503 — Telegram повторит доставку позже,
+    а реплика не набирает неограниченный хвост в памяти.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, tg_bot: Bot, settings: Settings) -> None:
+        if not settings.webhook_secret:
+            # Без секрета любой, кто узнал URL, может прислать обновление от имени админа
+            raise RuntimeError("WEBHOOK_SECRET is required when BOT_MODE=webhook")
+        self.dispatcher = dispatcher
+        self.bot = tg_bot
+        self.settings = settings
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, settings.webhook_queue_size))
+        self.workers: List[asyncio.Task] = []
+        self.serves_metrics = settings.webhook_port == metrics_port()
+        if self.serves_metrics:
+            mark_metrics_served()
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.settings.webhook_secret):
+            WEBHOOK_REJECTED.labels(reason="secret").inc()
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception:
+            WEBHOOK_REJECTED.labels(reason="payload").inc()
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            WEBHOOK_REJECTED.labels(reason="queue_full").inc()
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        WEBHOOK_QUEUE_DEPTH.set(self.queue.qsize())
+        return web.Response()
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        return web.Response(body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            WEBHOOK_QUEUE_DEPTH.set(self.queue.qsize())
+            try:
+                await self.dispatcher.feed_update(self.bot, update)
+            except Exception:
+                logger.exception("Webhook update %s failed", update.update_id)
+            finally:
+                self.queue.task_done()
+
+    def _drop_queued(self) -> None:
+        """Обновления уже подтверждены Telegram ответом 200 и не придут повторно — фиксируем, какие потеряны."""
+        dropped: List[int] = []
+        while not self.queue.empty():
+            dropped.append(self.queue.get_nowait().update_id)
+            self.queue.task_done()
+        WEBHOOK_DROPPED.inc(len(dropped))
+        WEBHOOK_QUEUE_DEPTH.set(0)
+        if dropped:
+            logger.error("Webhook queue not drained in %s s, dropped updates: %s", DRAIN_TIMEOUT_SECONDS, dropped)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.settings.webhook_path, self.handle_update)
+        if self.serves_metrics:
+            app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+    async def run(self) -> None:
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        site = web.TCPSite(runner, self.settings.webhook_host, self.settings.webhook_port)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(max(1, self.settings.webhook_workers))]
+        await site.start()
+        logger.info(
+            "Webhook server listening on %s:%s%s",
+            self.settings.webhook_host,
+            self.settings.webhook_port,
+            self.settings.webhook_path,
+        )
+        if self.settings.webhook_url:
+            # Реплик может быть несколько; регистрация идемпотентна, URL у всех общий (балансировщик)
+            await self.bot.set_webhook(
+                url=self.settings.webhook_url.rstrip("/") + self.settings.webhook_path,
+                secret_token=self.settings.webhook_secret,
+                allowed_updates=self.dispatcher.resolve_used_update_types(),
+            )
+        try:
+            await asyncio.Event().wait()
+        finally:
+            # Сначала перестаём принимать, потом дорабатываем очередь
+            await site.stop()
+            try:
+                await asyncio.wait_for(self.queue.join(), timeout=DRAIN_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                self._drop_queued()
+            for task in self.workers:
+                task.cancel()
+            await asyncio.gather(*self.workers, return_exceptions=True)
+            await runner.cleanup()
+
+
+__all__ = ["WebhookServer"]
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from .app import create_app
+from .context import refresh_admins_cache
+from .metrics import setup_metrics_server
+from .services.jobs import run_job_consumers
+
+logger = logging.getLogger(__name__)
+
+
+async def main() -> None:
+    """Отдельный процесс фоновых задач: выгрузки, загрузки статусов, дайджесты, рассылки, обновление витрин."""
+    app = create_app()
+    await refresh_admins_cache()
+    # Витрины и прочие задачи выполняются здесь — их метрики отдаёт сам воркер
+    setup_metrics_server()
+    logger.info("Job worker started")
+    try:
+        await run_job_consumers()
+    finally:
+        await app.bot.session.close()
+        await app.database.dispose()
+
+
+def run() -> None:
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Stopped by user")
+
+
+if __name__ == "__main__":
+    run()
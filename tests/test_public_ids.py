@@ -0,0 +1,53 @@
+import random
+
+from bot.services.public_ids import (
+    PUBLIC_ID_MIN_WIDTH,
+    index_for_public_id,
+    public_id_for_index,
+    reserve_public_ids,
+)
+
+KEY = b"test-public-id-key"
+TIER_1 = 9 * 10 ** (PUBLIC_ID_MIN_WIDTH - 1)  # 900 000 шестизначных ID
+TIER_2 = 9 * 10 ** PUBLIC_ID_MIN_WIDTH
+
+
+def test_first_tier_is_a_bijection_onto_six_digit_ids():
+    seen = set()
+    for n in range(TIER_1):
+        public_id = public_id_for_index(n, KEY)
+        assert len(public_id) == PUBLIC_ID_MIN_WIDTH and public_id[0] != "0"
+        seen.add(public_id)
+    assert len(seen) == TIER_1
+
+
+def test_ids_widen_after_first_tier():
+    assert len(public_id_for_index(TIER_1 - 1, KEY)) == PUBLIC_ID_MIN_WIDTH
+    assert len(public_id_for_index(TIER_1, KEY)) == PUBLIC_ID_MIN_WIDTH + 1
+    assert len(public_id_for_index(TIER_1 + TIER_2 - 1, KEY)) == PUBLIC_ID_MIN_WIDTH + 1
+    assert len(public_id_for_index(TIER_1 + TIER_2, KEY)) == PUBLIC_ID_MIN_WIDTH + 2
+    sample = random.Random(1).sample(range(TIER_1, TIER_1 + TIER_2), 20000)
+    assert len({public_id_for_index(n, KEY) for n in sample}) == len(sample)
+
+
+def test_inverse_round_trips_across_tiers():
+    rng = random.Random(2)
+    indices = [0, 1, TIER_1 - 1, TIER_1, TIER_1 + TIER_2 - 1, TIER_1 + TIER_2]
+    indices += rng.sample(range(TIER_1 + TIER_2 * 2), 5000)
+    for n in indices:
+        assert index_for_public_id(public_id_for_index(n, KEY), KEY) == n
+
+
+def test_inverse_rejects_foreign_formats():
+    for public_id in ["", "12345", "012345", "12a456", "U-123456"]:
+        assert index_for_public_id(public_id, KEY) is None
+
+
+def test_different_keys_give_different_orders():
+    assert [public_id_for_index(n, KEY) for n in range(50)] != [public_id_for_index(n, b"other") for n in range(50)]
+
+
+def test_reserve_skips_only_future_indices(monkeypatch):
+    monkeypatch.setattr("bot.services.public_ids._key", lambda: KEY)
+    taken = [public_id_for_index(n, KEY) for n in (3, 10, 20)] + ["legacy-id"]
+    assert reserve_public_ids(taken, next_index=5) == 2